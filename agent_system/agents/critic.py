@@ -1,6 +1,8 @@
+from concurrent.futures import Future, ThreadPoolExecutor
 from typing import Dict, Optional, Callable, List
+from knowledge_pack import KnowledgePack
 from rag_retrieval import retrieve_and_generate, retrieve_context
-from .critique_task import CritiqueTask
+from .critique_task import CritiqueTask, RETRIEVAL_MODES, group_into_levels
 
 class Critic:
     def __init__(
@@ -9,11 +11,18 @@ class Critic:
             role: dict[str, str],
             tasks: Dict[str, str] = None, 
             retrieval_fn: Optional[Callable] = None,
+            max_workers: int = 1,  # >1 runs independent tasks of each dependency level in parallel
+            knowledge_pack: Optional[KnowledgePack] = None,  # precomputed retrievals, checked before retrieval_fn
+            retrieval_modes: Optional[Dict[str, str]] = None,  # per task: "generate" (default) or "direct"
+            context_fn: Optional[Callable] = None,  # chunk retrieval of the "direct" mode
             ):
         self.model = model
         self.role = role
         self.tasks = tasks or {}
         self.retrieval_fn = retrieval_fn or retrieve_and_generate
+        self.max_workers = max(1, max_workers)
+        self.knowledge_pack = knowledge_pack
+        self.context_fn = context_fn or retrieve_context
         
         # Default specialized instructions for different task types
         self.specialized_instructions = {
@@ -129,6 +138,13 @@ class Critic:
             )
         }
 
+        # "direct" tasks get the packed chunks in their prompt instead of a generated RAG answer
+        for task_type, retrieval_mode in (retrieval_modes or {}).items():
+            if retrieval_mode not in RETRIEVAL_MODES:
+                raise ValueError(f"Unknown retrieval mode '{retrieval_mode}' for {task_type}, expected one of {RETRIEVAL_MODES}")
+            if task_type in self.task_configs:
+                self.task_configs[task_type].retrieval_mode = retrieval_mode
+
     def get_task_query(self, program: dict[str, str | None], task_type: str) -> str:
         """Generate an appropriate query based on task type and week."""
         
@@ -146,17 +162,8 @@ class Critic:
         
         return queries.get(task_type, f"Best practices for {task_type} in strength training programs")
 
-    def run_single_critique(
-            self,
-            program: dict[str, str | None],
-            task_type: str,
-            previous_results: Dict[str, str] = None
-            ) -> str:
-        """Run a single critique with specialized RAG retrieval."""
-        previous_results = previous_results or {}
-        print(f"\n--- Running {task_type.upper()} critique ---")
-        
-        # Get task configuration
+    def get_task_config(self, task_type: str) -> CritiqueTask:
+        """Return the configuration for a task type, or a default configuration."""
         task_config = self.task_configs.get(task_type)
         if not task_config:
             print(f"No configuration for {task_type}, using default...")
@@ -169,6 +176,72 @@ class Critic:
                 specialized_instructions="",
                 dependencies=[],
             )
+        return task_config
+
+    def get_retrieval_request(self, program: dict[str, str | None], task_type: str) -> Optional[tuple[str, str]]:
+        """Return the (query, specialized_instructions) retrieval arguments for a task, if it needs retrieval."""
+        task_config = self.get_task_config(task_type)
+        if not task_config.needs_retrieval:
+            return None
+        retrieval_query = task_config.retrieval_query
+        if "{user_input}" in retrieval_query:
+            user_input = program.get('user-input', '')
+            retrieval_query = retrieval_query.format(user_input=user_input)
+        return retrieval_query, task_config.specialized_instructions
+
+    def get_retrieval_requests(self, program: dict[str, str | None]) -> List[tuple[str, str]]:
+        """Return the retrieval arguments of every task this Critic runs through retrieval_fn and not from the knowledge pack, in task order."""
+        requests = [
+            self.get_retrieval_request(program, task_type)
+            for task_type in self.task_types
+            if self.get_task_config(task_type).retrieval_mode == "generate"
+            and self.lookup_knowledge_pack(program, task_type, record=False) is None
+        ]
+        return [request for request in requests if request is not None]
+
+    def lookup_knowledge_pack(self, program: dict[str, str | None], task_type: str, record: bool = True) -> Optional[tuple[str, list]]:
+        """Return the precomputed (answer, sources) of a task's retrieval, if the knowledge pack has it."""
+        if self.knowledge_pack is None:
+            return None
+        return self.knowledge_pack.lookup(lambda p: self.get_retrieval_request(p, task_type), program, record)
+
+    def retrieve_for_task(self, program: dict[str, str | None], task_type: str) -> Optional[str]:
+        """
+        Run the RAG retrieval for a task. Only depends on the user input, not on the draft.
+        In the "direct" retrieval mode the packed chunks are returned without the RAG answer call.
+        """
+        request = self.get_retrieval_request(program, task_type)
+        if request is None:
+            return None
+        if self.get_task_config(task_type).retrieval_mode == "direct":
+            print(f"Retrieving literature excerpts for {task_type}...")
+            context, _, _ = self.context_fn(request[0])
+            return context
+        packed = self.lookup_knowledge_pack(program, task_type)
+        if packed is not None:
+            print(f"Using knowledge pack context for {task_type}")
+            return packed[0]
+        print(f"Retrieving context for {task_type}...")
+        retrieval_query, specialized_instructions = request
+        retrieval_result, _ = self.retrieval_fn(
+            retrieval_query, 
+            specialized_instructions
+        )
+        return retrieval_result
+
+    def run_single_critique(
+            self,
+            program: dict[str, str | None],
+            task_type: str,
+            previous_results: Dict[str, str] = None,
+            retrieval_result: Optional[str] = None,
+            ) -> str:
+        """Run a single critique with specialized RAG retrieval."""
+        previous_results = previous_results or {}
+        print(f"\n--- Running {task_type.upper()} critique ---")
+        
+        # Get task configuration
+        task_config = self.get_task_config(task_type)
         
         # Get context from dependencies
         dependency_context = task_config.get_context_from_dependencies(previous_results)
@@ -190,16 +263,12 @@ class Critic:
         
         # Retrieve context if needed
         if task_config.needs_retrieval:
-            print(f"Retrieving context...")
-            retrieval_query = task_config.retrieval_query
-            if "{user_input}" in retrieval_query:
-                user_input = program.get('user-input', '')
-                retrieval_query = retrieval_query.format(user_input=user_input)
-            retrieval_result, _ = self.retrieval_fn(
-                retrieval_query, 
-                task_config.specialized_instructions
-            )
-            context = f"\nRelevant context from training literature:\n{retrieval_result}\n"
+            if retrieval_result is None:
+                retrieval_result = self.retrieve_for_task(program, task_type)
+            if task_config.retrieval_mode == "direct":
+                context = f"\nRelevant excerpts from training literature:\n{retrieval_result}\n"
+            else:
+                context = f"\nRelevant context from training literature:\n{retrieval_result}\n"
         else:
             print(f"Skipping retrieval for {task_type} - using only task template guidance...")
             context = ""
@@ -257,42 +326,93 @@ class Critic:
             print(f"Error in {task_type.upper()} critique: {e}")
             return f"Error in {task_type} critique: {str(e)}"
 
-    def critique(self, program: dict[str, str | None]) -> dict[str, str | None]:
-        """Run each critique type sequentially with its own RAG retrieval."""
-        print("\n========== CRITIQUE PROCESS STARTED ==========")
-        all_feedback = []
+    def _record_feedback(
+            self,
+            task_type: str,
+            feedback: Optional[str],
+            previous_results: Dict[str, str],
+            ) -> Optional[str]:
+        """Store usable feedback for dependent tasks and return the formatted feedback section, if any."""
+        if feedback and isinstance(feedback, str) and len(feedback.strip()) > 10:
+            processed_feedback = feedback
+            if feedback.strip().endswith("None"):
+                processed_feedback = feedback.strip()[:-4].strip()
+            if processed_feedback and len(processed_feedback.strip()) > 10:
+                previous_results[task_type] = processed_feedback
+            if processed_feedback and 'no changes' not in processed_feedback.lower() and 'therefore, no changes' not in processed_feedback.lower():
+                formatted_feedback = f"[{task_type.upper()} FEEDBACK]:\n{processed_feedback}\n" 
+                print(f"\n{'='*50}")
+                print(f"{task_type.upper()} CRITIQUE:")
+                print(f"{'='*50}")
+                words = processed_feedback.split()
+                line = ""
+                for word in words:
+                    if len(line) + len(word) > 80:
+                        print(line)
+                        line = word + " "
+                    else:
+                        line += word + " "
+                if line:
+                    print(line)
+                print(f"{'='*50}\n")
+                return formatted_feedback
+            else:
+                print(f"\n{task_type.upper()} - Analysis performed but no changes needed")
+        else:
+            print(f"\n{task_type.upper()} - No significant feedback provided")
+        return None
+
+    def _critique_sequential(self, program: dict[str, str | None]) -> Dict[str, Optional[str]]:
+        """Run each task type one after another, each with its own RAG retrieval."""
+        formatted = {}
         previous_results = {}
-        
-        # Run each task type with its own specialized retrieval
         for task_type in self.task_types:
             feedback = self.run_single_critique(program, task_type, previous_results)
-            if feedback and isinstance(feedback, str) and len(feedback.strip()) > 10:
-                processed_feedback = feedback
-                if feedback.strip().endswith("None"):
-                    processed_feedback = feedback.strip()[:-4].strip()
-                if processed_feedback and len(processed_feedback.strip()) > 10:
-                    previous_results[task_type] = processed_feedback
-                if processed_feedback and 'no changes' not in processed_feedback.lower() and 'therefore, no changes' not in processed_feedback.lower():
-                    formatted_feedback = f"[{task_type.upper()} FEEDBACK]:\n{processed_feedback}\n" 
-                    all_feedback.append(formatted_feedback)
-                    print(f"\n{'='*50}")
-                    print(f"{task_type.upper()} CRITIQUE:")
-                    print(f"{'='*50}")
-                    words = processed_feedback.split()
-                    line = ""
-                    for word in words:
-                        if len(line) + len(word) > 80:
-                            print(line)
-                            line = word + " "
-                        else:
-                            line += word + " "
-                    if line:
-                        print(line)
-                    print(f"{'='*50}\n")
-                else:
-                    print(f"\n{task_type.upper()} - Analysis performed but no changes needed")
-            else:
-                print(f"\n{task_type.upper()} - No significant feedback provided")
+            formatted[task_type] = self._record_feedback(task_type, feedback, previous_results)
+        return formatted
+
+    def _critique_parallel(self, program: dict[str, str | None]) -> Dict[str, Optional[str]]:
+        """
+        Run the tasks level by level through the dependency DAG on a bounded thread pool.
+        Retrievals do not depend on other critiques, so they are all started up front and
+        the wall-clock time is roughly the longest chain of critique calls.
+        """
+        formatted = {}
+        previous_results = {}
+        levels = group_into_levels(self.task_types, self.task_configs)
+        print(f"Running critique in {len(levels)} levels with up to {self.max_workers} workers: {levels}")
+
+        def critique_task(task_type: str, level_results: Dict[str, str], retrieval: Optional[Future]) -> str:
+            retrieval_result = retrieval.result() if retrieval is not None else None
+            return self.run_single_critique(program, task_type, level_results, retrieval_result)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            # Submitted before any critique, so a worker never waits on a retrieval that is not running
+            retrievals = {
+                task_type: executor.submit(self.retrieve_for_task, program, task_type)
+                for task_type in self.task_types
+                if self.get_task_config(task_type).needs_retrieval
+            }
+            for level in levels:
+                level_results = dict(previous_results)
+                futures = {
+                    task_type: executor.submit(critique_task, task_type, level_results, retrievals.get(task_type))
+                    for task_type in level
+                }
+                for task_type in level:
+                    formatted[task_type] = self._record_feedback(task_type, futures[task_type].result(), previous_results)
+        return formatted
+
+    def critique(self, program: dict[str, str | None]) -> dict[str, str | None]:
+        """Run each critique type with its own RAG retrieval, sequentially or level by level in parallel."""
+        print("\n========== CRITIQUE PROCESS STARTED ==========")
+        if self.max_workers > 1 and len(self.task_types) > 1:
+            formatted = self._critique_parallel(program)
+        else:
+            formatted = self._critique_sequential(program)
+
+        # Keep the task order regardless of the order the tasks finished in
+        all_feedback = [formatted[task_type] for task_type in self.task_types if formatted.get(task_type)]
         
         if not all_feedback:
             print('No feedback from any critique tasks')
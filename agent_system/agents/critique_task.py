@@ -1,6 +1,8 @@
 from dataclasses import dataclass, field
 from typing import Dict, Optional, List, Callable, Any
 
+RETRIEVAL_MODES = ("generate", "direct")
+
 @dataclass
 class CritiqueTask:
     """Represents a single critique task with its configuration"""
@@ -11,6 +13,7 @@ class CritiqueTask:
     specialized_instructions: Optional[str] = None
     dependencies: List[str] = field(default_factory=list)
     reference_data: Dict[str, Any] = field(default_factory=dict)
+    retrieval_mode: str = "generate"  # "generate": RAG answer, "direct": the packed chunks themselves
     
     def get_context_from_dependencies(self, previous_results: Dict[str, str]) -> str:
         """Generate context from dependencies"""
@@ -19,3 +22,23 @@ class CritiqueTask:
             if dep in previous_results and previous_results[dep] != "None":
                 context.append(f"Previous {dep.upper()} critique suggested: {previous_results[dep]}")
         return "\n".join(context)
+
+
+def group_into_levels(task_types: List[str], task_configs: Dict[str, CritiqueTask]) -> List[List[str]]:
+    """
+    Group task types into topological levels of the dependency DAG.
+    A task only depends on tasks that come before it in task_types (later or unknown
+    dependencies are never available in a sequential run either), so every task in a
+    level can run concurrently once the previous levels are done.
+    """
+    level_of = {}
+    for position, task_type in enumerate(task_types):
+        task_config = task_configs.get(task_type)
+        earlier = task_types[:position]
+        dependencies = [dep for dep in (task_config.dependencies if task_config else []) if dep in earlier]
+        level_of[task_type] = 1 + max((level_of[dep] for dep in dependencies), default=-1)
+
+    levels = [[] for _ in range(max(level_of.values(), default=-1) + 1)]
+    for task_type in task_types:
+        levels[level_of[task_type]].append(task_type)
+    return levels
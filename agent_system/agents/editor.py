@@ -95,6 +95,38 @@ class Editor:
         
         return weekly_program
 
+    def validate_day(self, exercises: list) -> list:
+        """
+        Fill in the required fields of every exercise of one day.
+        Also usable on the days of a streamed draft as they arrive (see ProgramStream).
+        """
+        validated_exercises = []
+        for exercise in exercises:
+            # Ensure all required fields exist
+            validated_exercise = {
+                "name": exercise.get("name", "Unnamed Exercise"),
+                "sets": exercise.get("sets", 3),
+                "reps": exercise.get("reps", "8-12"),
+                "target_rpe": exercise.get("target_rpe", "7-8"),
+                "rest": exercise.get("rest", "60-90 seconds"),
+                "cues": exercise.get("cues", "Focus on proper form")
+            }
+            
+            # Handle AI Progression field for week 2+
+            progression_suggestion = None
+            
+            if "AI Progression" in exercise:
+                progression_suggestion = exercise["AI Progression"]
+            elif "suggestion" in exercise:
+                progression_suggestion = exercise["suggestion"]
+            elif "ai progression" in exercise:
+                progression_suggestion = exercise["ai progression"]
+            if progression_suggestion:
+                validated_exercise["suggestion"] = progression_suggestion
+            
+            validated_exercises.append(validated_exercise)
+        return validated_exercises
+
     def format_program(self, program: dict[str, str | None]) -> dict:
         """Ensure the program is in the correct format for the web application."""
         draft = program['draft']
@@ -105,31 +137,7 @@ class Editor:
         # Validate and ensure each exercise has the required fields
         validated_program = {}
         for day, exercises in weekly_program.items():
-            validated_program[day] = []
-            for exercise in exercises:
-                # Ensure all required fields exist
-                validated_exercise = {
-                    "name": exercise.get("name", "Unnamed Exercise"),
-                    "sets": exercise.get("sets", 3),
-                    "reps": exercise.get("reps", "8-12"),
-                    "target_rpe": exercise.get("target_rpe", "7-8"),
-                    "rest": exercise.get("rest", "60-90 seconds"),
-                    "cues": exercise.get("cues", "Focus on proper form")
-                }
-                
-                # Handle AI Progression field for week 2+
-                progression_suggestion = None
-                
-                if "AI Progression" in exercise:
-                    progression_suggestion = exercise["AI Progression"]
-                elif "suggestion" in exercise:
-                    progression_suggestion = exercise["suggestion"]
-                elif "ai progression" in exercise:
-                    progression_suggestion = exercise["ai progression"]
-                if progression_suggestion:
-                    validated_exercise["suggestion"] = progression_suggestion
-                
-                validated_program[day].append(validated_exercise)
+            validated_program[day] = self.validate_day(exercises)
         
         return {"weekly_program": validated_program}
 
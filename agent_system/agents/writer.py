@@ -1,6 +1,7 @@
 import json
 from typing import Dict, Optional, Callable
-from rag_retrieval import retrieve_and_generate
+from knowledge_pack import KnowledgePack
+from rag_retrieval import retrieve_and_generate, retrieve_context
 
 class Writer:
     def __init__(
@@ -13,6 +14,10 @@ class Writer:
             task_progression: Optional[str] = None,  # Add task_progression parameter
             writer_type: str = "initial",  # New parameter to identify writer type
             retrieval_fn: Optional[Callable] = None,
+            knowledge_pack: Optional[KnowledgePack] = None,  # precomputed retrievals, checked before retrieval_fn
+            retrieval_mode: str = "generate",  # "direct" puts the packed chunks in the prompt without a RAG answer call
+            context_fn: Optional[Callable] = None,  # chunk retrieval of the "direct" mode
+            on_day: Optional[Callable[[str, list], None]] = None,  # called with each day of a streamed initial draft
             ):
         self.model = model
         self.role = role
@@ -22,6 +27,12 @@ class Writer:
         self.task_progression = task_progression  # Store task_progression
         self.writer_type = writer_type
         self.retrieval_fn = retrieval_fn or retrieve_and_generate
+        self.knowledge_pack = knowledge_pack
+        if retrieval_mode not in ("generate", "direct"):
+            raise ValueError(f"Unknown retrieval mode '{retrieval_mode}', expected 'generate' or 'direct'")
+        self.retrieval_mode = retrieval_mode
+        self.context_fn = context_fn or retrieve_context
+        self.on_day = on_day
         
         # Specialized instructions for initial writing
         self.specialized_instructions = {
@@ -34,6 +45,22 @@ class Writer:
             return "Best practices for designing a strength training program based on {user_input} and preferences."
         return ""
 
+    def get_retrieval_request(self, program: dict[str, str | None]) -> Optional[tuple[str, str]]:
+        """Return the (query, specialized_instructions) retrieval arguments for the initial draft, if any."""
+        query = self.get_retrieval_query(program)
+        if self.writer_type != "initial" or not query:
+            return None
+        retrieval_instructions = self.specialized_instructions.get(self.writer_type, "")
+        if '{user_input}' in retrieval_instructions:
+            retrieval_instructions = retrieval_instructions.format(user_input=program.get('user-input', ''))
+        return query, retrieval_instructions
+
+    def lookup_knowledge_pack(self, program: dict[str, str | None], record: bool = True) -> Optional[tuple[str, list]]:
+        """Return the precomputed (answer, sources) of the initial draft's retrieval, if the knowledge pack has it."""
+        if self.knowledge_pack is None:
+            return None
+        return self.knowledge_pack.lookup(self.get_retrieval_request, program, record)
+
     def format_previous_week_program(self, program: dict[str, str | None]) -> str:
         """
         Format the previous week's program data specifically for progression tasks.
@@ -73,18 +100,27 @@ class Writer:
             self,
             program: dict[str, str | None],
             ) -> tuple[str, dict[str, str]]:
-        query = self.get_retrieval_query(program)
-        user_input = program.get('user-input', '')
-        retrieval_instructions = self.specialized_instructions.get(self.writer_type, "")
-        if '{user_input}' in retrieval_instructions:
-            retrieval_instructions = retrieval_instructions.format(user_input=user_input)
+        retrieval_request = self.get_retrieval_request(program)
         if not self.task:
             raise ValueError(f"Writer of type '{self.writer_type}' does not support initial program creation")
         enhanced_task = self.task
-        if self.writer_type == "initial" and query:
-            print(f"\n--- Writer (initial) retrieving context ---")
-            retrieval_result, _ = self.retrieval_fn(query, retrieval_instructions)
-            context = f"\nRelevant context from training literature:\n{retrieval_result}\n"
+        if retrieval_request:
+            if self.retrieval_mode == "direct":
+                print(f"\n--- Writer (initial) retrieving literature excerpts ---")
+                retrieval_result, _, _ = self.context_fn(retrieval_request[0])
+                heading = "Relevant excerpts from training literature"
+            else:
+                packed = self.lookup_knowledge_pack(program)
+                if packed is not None:
+                    print(f"\n--- Writer (initial) using knowledge pack context ---")
+                    retrieval_result = packed[0]
+                else:
+                    print(f"\n--- Writer (initial) retrieving context ---")
+                    retrieval_result, _ = self.retrieval_fn(*retrieval_request)
+                heading = "Relevant context from training literature"
+            # The task is formatted below, so braces in the retrieved text must not be read as fields
+            retrieval_result = retrieval_result.replace("{", "{{").replace("}", "}}")
+            context = f"\n{heading}:\n{retrieval_result}\n"
             enhanced_task = self.task + context
         
         prompt = [
@@ -100,8 +136,12 @@ class Writer:
         combined_prompt = "\n".join(item.get("content", "") if isinstance(item, dict) else str(item) for item in prompt)
         
         print(f"Generating initial program...")
-        # Real LLM call
-        draft = self.model(combined_prompt)
+        # Real LLM call; streamed when someone wants the days as soon as they are written
+        stream_program = getattr(self.model, "stream_program", None)
+        if self.on_day is not None and stream_program is not None:
+            draft = stream_program(combined_prompt).collect(self.on_day)
+        else:
+            draft = self.model(combined_prompt)
         
         # Handle case where draft is string (non-JSON response)
         if isinstance(draft, str):
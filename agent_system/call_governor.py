@@ -0,0 +1,332 @@
+import os
+import random
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, Optional
+
+from google.api_core import exceptions as google_exceptions
+
+# Errors worth retrying: quota (429), overload (503), transient server errors and timeouts
+RETRYABLE_ERRORS = (
+    google_exceptions.TooManyRequests,
+    google_exceptions.ResourceExhausted,
+    google_exceptions.InternalServerError,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.GatewayTimeout,
+    google_exceptions.DeadlineExceeded,
+    ConnectionError,
+    TimeoutError,
+)
+
+# (requests per minute, tokens per minute); the Gemini API paid tier 1 limits
+DEFAULT_MODEL_LIMITS: Dict[str, tuple[Optional[int], Optional[int]]] = {
+    "models/gemini-2.0-flash": (2000, 4_000_000),
+}
+
+
+class CallDeadlineExceeded(TimeoutError):
+    """The call could not be completed (including queueing and retries) before its deadline."""
+
+
+def estimate_tokens(text: str) -> int:
+    # Same rule of thumb as rag_packing: about four characters per token
+    return max(1, len(text) // 4)
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket refilled at per_minute / 60 per second, holding at most
+    one minute's worth. reserve() takes the tokens immediately, possibly into debt,
+    and returns how long the caller must wait before using them, so concurrent
+    callers are served in the order they arrived.
+    """
+
+    def __init__(self, per_minute: float):
+        self.rate = per_minute / 60.0
+        self.capacity = float(per_minute)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount: float) -> float:
+        with self._lock:
+            self._refill(time.monotonic())
+            self.level -= amount
+            return max(0.0, -self.level / self.rate)
+
+    def refund(self, amount: float) -> None:
+        """Give tokens back (a cancelled call, or a call that used fewer tokens than reserved)."""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.level = min(self.capacity, self.level + amount)
+
+
+class ModelStats:
+    def __init__(self, window: int = 1000):
+        self.calls = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.retries = 0
+        self.deadline_exceeded = 0
+        self.tokens_reserved = 0
+        self.tokens_used = 0
+        self.rate_wait_seconds = 0.0
+        self.queue_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.call_seconds = 0.0
+        # Total wait (rate limits plus concurrency queue) of the most recent calls
+        self.recent_waits: deque = deque(maxlen=window)
+
+    def as_dict(self) -> dict:
+        waits = sorted(self.recent_waits)
+
+        def percentile(p):
+            return round(waits[min(len(waits) - 1, int(p * len(waits)))], 3) if waits else None
+
+        return {
+            "calls": self.calls,
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "retries": self.retries,
+            "deadline_exceeded": self.deadline_exceeded,
+            "tokens_reserved": self.tokens_reserved,
+            "tokens_used": self.tokens_used,
+            "rate_wait_seconds": round(self.rate_wait_seconds, 3),
+            "queue_wait_seconds": round(self.queue_wait_seconds, 3),
+            "wait_p50_seconds": percentile(0.5),
+            "wait_p95_seconds": percentile(0.95),
+            "max_wait_seconds": round(self.max_wait_seconds, 3),
+            "mean_call_seconds": round(self.call_seconds / self.succeeded, 3) if self.succeeded else None,
+        }
+
+
+class CallGovernor:
+    """
+    Shared gate for every Gemini call made through setup_llm.
+      * Per-model RPM and TPM token buckets; a call reserves one request and its
+        estimated tokens (prompt + max output) and waits until the buckets allow it.
+        The reservation is corrected with the token count the API reports.
+      * A global limit on the number of calls in flight.
+      * Retryable errors (429, 5xx, timeouts) are retried with full-jitter
+        exponential backoff.
+      * Every call has a deadline covering queueing, retries and the request itself;
+        the remaining time is passed to the request as its timeout.
+    Waits, retries and token use are counted per model (stats()), and waits longer
+    than log_wait_seconds are printed.
+    """
+
+    def __init__(
+            self,
+            max_concurrency: int = 8,
+            model_limits: Optional[Dict[str, tuple[Optional[int], Optional[int]]]] = None,
+            default_limits: tuple[Optional[int], Optional[int]] = (None, None),
+            max_retries: int = 5,
+            base_delay: float = 1.0,
+            max_delay: float = 30.0,
+            deadline_seconds: float = 180.0,
+            log_wait_seconds: float = 1.0,
+    ):
+        self.max_concurrency = max_concurrency
+        self.model_limits = dict(DEFAULT_MODEL_LIMITS if model_limits is None else model_limits)
+        self.default_limits = default_limits
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline_seconds = deadline_seconds
+        self.log_wait_seconds = log_wait_seconds
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._buckets: Dict[str, tuple[Optional[TokenBucket], Optional[TokenBucket]]] = {}
+        self._stats: Dict[str, ModelStats] = {}
+        self._in_flight = 0
+        self._queued = 0
+        self._lock = threading.Lock()
+
+    def _model_state(self, model: str) -> tuple[Optional[TokenBucket], Optional[TokenBucket], ModelStats]:
+        with self._lock:
+            if model not in self._buckets:
+                rpm, tpm = self.model_limits.get(model, self.default_limits)
+                self._buckets[model] = (TokenBucket(rpm) if rpm else None, TokenBucket(tpm) if tpm else None)
+                self._stats[model] = ModelStats()
+            return (*self._buckets[model], self._stats[model])
+
+    def _count(self, stats: ModelStats, **increments) -> None:
+        with self._lock:
+            for name, value in increments.items():
+                setattr(stats, name, getattr(stats, name) + value)
+
+    def backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def call(self, model: str, request: Callable[[float], object], estimated_tokens: int = 0,
+             deadline_seconds: Optional[float] = None, usage: Optional[Callable[[object], Optional[int]]] = None):
+        """
+        Run request(timeout) under the limits of model and return its result.
+        usage(result) may return the tokens the call actually used, to correct the TPM bucket.
+        Raises CallDeadlineExceeded when the deadline passes, or the last error once the
+        retries are used up.
+        """
+        deadline = time.monotonic() + (deadline_seconds or self.deadline_seconds)
+        rpm_bucket, tpm_bucket, stats = self._model_state(model)
+        self._count(stats, calls=1)
+        attempt = 0
+        while True:
+            self._admit(model, estimated_tokens, deadline, rpm_bucket, tpm_bucket, stats)
+            call_start = time.monotonic()
+            try:
+                result = request(max(0.001, deadline - call_start))
+            except Exception as e:
+                # The slot is not held during the backoff
+                self._release()
+                self._retry_or_raise(model, e, attempt, deadline, stats)
+                attempt += 1
+                continue
+            self._release()
+            self._succeeded(result, estimated_tokens, tpm_bucket, stats, usage, call_start)
+            return result
+
+    def stream(self, model: str, request: Callable[[float], object], estimated_tokens: int = 0,
+               deadline_seconds: Optional[float] = None, usage: Optional[Callable[[object], Optional[int]]] = None):
+        """
+        call() for a streaming request: request(timeout) returns an iterable of chunks,
+        which are yielded as they arrive. The call slot is held until the stream ends or
+        the generator is closed; a caller that stops reading early must close() it, or the
+        slot stays taken until the generator is garbage collected.
+        Failures before the first chunk are retried; once chunks were yielded they are not.
+        """
+        deadline = time.monotonic() + (deadline_seconds or self.deadline_seconds)
+        rpm_bucket, tpm_bucket, stats = self._model_state(model)
+        self._count(stats, calls=1)
+        attempt = 0
+        while True:
+            self._admit(model, estimated_tokens, deadline, rpm_bucket, tpm_bucket, stats)
+            call_start = time.monotonic()
+            try:
+                response = request(max(0.001, deadline - call_start))
+                chunks = iter(response)
+                first = next(chunks, None)
+            except Exception as e:
+                self._release()
+                self._retry_or_raise(model, e, attempt, deadline, stats)
+                attempt += 1
+                continue
+            try:
+                if first is not None:
+                    yield first
+                yield from chunks
+            except GeneratorExit:
+                # Closed by the caller before the end of the stream
+                self._count(stats, failed=1)
+                close = getattr(chunks, "close", None)
+                if close is not None:
+                    close()
+                raise
+            except BaseException:
+                self._count(stats, failed=1)
+                raise
+            finally:
+                self._release()
+            self._succeeded(response, estimated_tokens, tpm_bucket, stats, usage, call_start)
+            return
+
+    def _retry_or_raise(self, model, error, attempt, deadline, stats) -> None:
+        """Sleep before the next attempt after a retryable error, or raise."""
+        if not isinstance(error, RETRYABLE_ERRORS) or attempt >= self.max_retries:
+            self._count(stats, failed=1)
+            raise error
+        delay = self.backoff(attempt)
+        if time.monotonic() + delay >= deadline:
+            self._count(stats, failed=1, deadline_exceeded=1)
+            raise CallDeadlineExceeded(f"{model}: deadline reached while retrying ({error})") from error
+        self._count(stats, retries=1)
+        print(f"LLM call to {model} failed ({type(error).__name__}: {error}), retry {attempt + 1} in {delay:.1f}s")
+        time.sleep(delay)
+
+    def _admit(self, model, estimated_tokens, deadline, rpm_bucket, tpm_bucket, stats) -> None:
+        """Wait for the rate limits and a free call slot; the caller must _release() the slot."""
+        start = time.monotonic()
+        rate_wait = max(
+            rpm_bucket.reserve(1) if rpm_bucket else 0.0,
+            tpm_bucket.reserve(estimated_tokens) if tpm_bucket else 0.0,
+        )
+        if start + rate_wait >= deadline:
+            if rpm_bucket:
+                rpm_bucket.refund(1)
+            if tpm_bucket:
+                tpm_bucket.refund(estimated_tokens)
+            self._count(stats, failed=1, deadline_exceeded=1)
+            raise CallDeadlineExceeded(f"{model}: rate limits would delay the call past its deadline ({rate_wait:.1f}s)")
+        if rate_wait:
+            time.sleep(rate_wait)
+        queue_start = time.monotonic()
+        with self._lock:
+            self._queued += 1
+        acquired = self._slots.acquire(timeout=max(0.0, deadline - queue_start))
+        queue_wait = time.monotonic() - queue_start
+        wait = rate_wait + queue_wait
+        with self._lock:
+            self._queued -= 1
+            stats.rate_wait_seconds += rate_wait
+            stats.queue_wait_seconds += queue_wait
+            stats.max_wait_seconds = max(stats.max_wait_seconds, wait)
+            stats.recent_waits.append(wait)
+            if acquired:
+                stats.tokens_reserved += estimated_tokens
+                self._in_flight += 1
+        if wait >= self.log_wait_seconds:
+            print(f"LLM call to {model} waited {wait:.1f}s (rate limits {rate_wait:.1f}s, concurrency queue {queue_wait:.1f}s)")
+        if not acquired:
+            # The call is never made, so it must not use up rate budget
+            if rpm_bucket:
+                rpm_bucket.refund(1)
+            if tpm_bucket:
+                tpm_bucket.refund(estimated_tokens)
+            self._count(stats, failed=1, deadline_exceeded=1)
+            raise CallDeadlineExceeded(f"{model}: no free call slot before the deadline")
+
+    def _release(self) -> None:
+        with self._lock:
+            self._in_flight -= 1
+        self._slots.release()
+
+    def _succeeded(self, result, estimated_tokens, tpm_bucket, stats, usage, call_start) -> None:
+        used = usage(result) if usage else None
+        if used is not None and tpm_bucket:
+            tpm_bucket.refund(estimated_tokens - used)
+        self._count(stats, succeeded=1, tokens_used=used or 0, call_seconds=time.monotonic() - call_start)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "in_flight": self._in_flight,
+                "queued": self._queued,
+                "max_concurrency": self.max_concurrency,
+                "models": {model: stats.as_dict() for model, stats in self._stats.items()},
+            }
+
+
+def _env_int(name: str) -> Optional[int]:
+    value = os.environ.get(name)
+    return int(value) if value else None
+
+
+def _governor_from_env() -> CallGovernor:
+    limits = dict(DEFAULT_MODEL_LIMITS)
+    rpm, tpm = _env_int("LLM_RPM"), _env_int("LLM_TPM")
+    if rpm or tpm:
+        # One limit for every model, e.g. the free tier: LLM_RPM=15 LLM_TPM=1000000
+        limits = {}
+    return CallGovernor(
+        max_concurrency=_env_int("LLM_MAX_CONCURRENCY") or 8,
+        model_limits=limits,
+        default_limits=(rpm, tpm),
+        deadline_seconds=float(os.environ.get("LLM_DEADLINE_SECONDS", 180)),
+    )
+
+
+# Shared by every setup_llm model in the process
+call_governor = _governor_from_env()
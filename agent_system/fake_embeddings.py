@@ -0,0 +1,35 @@
+import hashlib
+import threading
+import time
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+
+class FakeEmbeddings(Embeddings):
+    """
+    Deterministic local embedder for testing the build and retrieval pipelines offline.
+    Every text maps to a fixed unit vector derived from its hash; latency simulates
+    the per-request time of the embedding API.
+    """
+
+    def __init__(self, dimension=768, latency=0.0):
+        self.dimension = dimension
+        self.latency = latency
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def _embed(self, text):
+        seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+        vector = np.random.default_rng(seed).normal(size=self.dimension)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def embed_documents(self, texts, **kwargs):
+        with self._lock:
+            self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text, **kwargs):
+        return self.embed_documents([text])[0]
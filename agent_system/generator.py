@@ -1,3 +1,6 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
 from langgraph.graph import Graph
 
 from .agents import (
@@ -5,6 +8,7 @@ from .agents import (
     Critic,
     Editor,
 )
+from .prefetch import RetrievalPrefetcher
 
 class ProgramGenerator:
     def __init__(
@@ -13,10 +17,30 @@ class ProgramGenerator:
             critic: Critic,
             editor: Editor,
             max_iterations: int = 3, #default maximum iterations for critique and revision
+            prefetch_retrieval: bool = True, # start all retrievals while the Writer drafts
+            prefetch_workers: int = 6,
+            batch_retrieval_fn: Optional[Callable] = None, # batched version of the agents' retrieval_fn
             ):
         # Agents
         self.writer = writer
         self.critic = critic
+        self.prefetch_workers = prefetch_workers
+
+        # Retrievals only depend on the user input, so they are served from background futures
+        self.prefetchers = []
+        if prefetch_retrieval:
+            if self.writer.retrieval_fn is self.critic.retrieval_fn:
+                # Both agents use the same retrieval, so the Critic's requests can go out as one batch
+                shared = self.writer.retrieval_fn
+                if not isinstance(shared, RetrievalPrefetcher):
+                    shared = RetrievalPrefetcher(shared, batch_retrieval_fn)
+                self.writer.retrieval_fn = self.critic.retrieval_fn = shared
+                self.prefetchers.append(shared)
+            else:
+                for agent in (self.writer, self.critic):
+                    if not isinstance(agent.retrieval_fn, RetrievalPrefetcher):
+                        agent.retrieval_fn = RetrievalPrefetcher(agent.retrieval_fn)
+                    self.prefetchers.append(agent.retrieval_fn)
         
         # Pass writer to editor to enable implementing final feedback
         if not hasattr(editor, 'writer') or editor.writer is None:
@@ -76,6 +100,30 @@ class ProgramGenerator:
             'iteration_count': 0,
         }
 
-        final_state = self.app.invoke(program)
+        if not self.prefetchers:
+            return self.app.invoke(program)
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.prefetch_workers, thread_name_prefix="retrieval-prefetch") as executor:
+                self.start_prefetch(program, executor)
+                final_state = self.app.invoke(program)
+        finally:
+            # Also after a failed run, so the next one never picks up its futures
+            for prefetcher in self.prefetchers:
+                prefetcher.reset()
 
         return final_state
+
+    def start_prefetch(self, program: dict[str, str | None], executor: ThreadPoolExecutor) -> None:
+        """Start the Writer's and every Critic task's RAG answer that is not in the knowledge pack before the first draft is written."""
+        writer_request = None
+        if self.writer.retrieval_mode == "generate" and self.writer.lookup_knowledge_pack(program, record=False) is None:
+            writer_request = self.writer.get_retrieval_request(program)
+        critic_requests = self.critic.get_retrieval_requests(program)
+        print(f"Prefetching {len(critic_requests) + (1 if writer_request else 0)} retrievals in the background")
+        for prefetcher in self.prefetchers:
+            prefetcher.reset()
+        # The Writer's answer is on the critical path, so it is never batched with the Critic's
+        if writer_request:
+            self.writer.retrieval_fn.prefetch([writer_request], executor)
+        self.critic.retrieval_fn.prefetch(critic_requests, executor)
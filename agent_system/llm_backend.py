@@ -0,0 +1,379 @@
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from typing import Optional
+
+from days_per_week import requested_days
+
+from .call_governor import estimate_tokens
+from .fake_embeddings import FakeEmbeddings
+from .response_cache import ResponseCache
+
+BACKENDS = ("gemini", "record", "replay", "synthetic")
+DEFAULT_RECORDINGS_PATH = os.path.join("data", "llm_recordings", "recordings.jsonl")
+
+# Settings from configure_backend(), falling back to the environment
+_overrides: dict = {}
+
+
+def configure_backend(
+        name: Optional[str] = None,
+        recordings_path: Optional[str] = None,
+        latency: Optional[str] = None,
+        embedding_latency: Optional[str] = None,
+        seed: Optional[int] = None,
+        replay_fallback: Optional[str] = None,
+) -> None:
+    """
+    Select the backend of setup_llm and setup_embeddings for this process:
+      gemini     the live API (default)
+      record     the live API, saving every response and embedding to recordings_path
+      replay     only the recorded responses; a prompt that was not recorded raises
+                 ReplayMiss, or is answered synthetically with replay_fallback="synthetic"
+      synthetic  schema-valid programs and critiques, deterministic fake embeddings,
+                 with latencies drawn from the given distributions (see Latency)
+    Every argument left None falls back to LLM_BACKEND, LLM_RECORDINGS_PATH,
+    LLM_SYNTHETIC_LATENCY, EMBEDDING_SYNTHETIC_LATENCY, LLM_SYNTHETIC_SEED and
+    LLM_REPLAY_FALLBACK.
+    """
+    values = {
+        "name": name,
+        "recordings_path": recordings_path,
+        "latency": latency,
+        "embedding_latency": embedding_latency,
+        "seed": seed,
+        "replay_fallback": replay_fallback,
+    }
+    _overrides.update({key: value for key, value in values.items() if value is not None})
+    if backend_settings()["name"] not in BACKENDS:
+        raise ValueError(f"Unknown LLM backend '{backend_settings()['name']}', expected one of {BACKENDS}")
+
+
+def backend_settings() -> dict:
+    return {
+        "name": _overrides.get("name") or os.environ.get("LLM_BACKEND", "gemini"),
+        "recordings_path": _overrides.get("recordings_path") or os.environ.get("LLM_RECORDINGS_PATH", DEFAULT_RECORDINGS_PATH),
+        "latency": _overrides.get("latency") or os.environ.get("LLM_SYNTHETIC_LATENCY", "lognormal:1.0,0.3"),
+        "embedding_latency": _overrides.get("embedding_latency") or os.environ.get("EMBEDDING_SYNTHETIC_LATENCY", "constant:0.05"),
+        "seed": int(_overrides.get("seed", os.environ.get("LLM_SYNTHETIC_SEED", 0))),
+        "replay_fallback": _overrides.get("replay_fallback") or os.environ.get("LLM_REPLAY_FALLBACK", "error"),
+    }
+
+
+def cache_namespace() -> Optional[str]:
+    """
+    None for the live API (gemini and record); otherwise the backend name. The
+    persistent caches (responses, RAG answers, query embeddings) add it to their
+    keys, so an offline run never serves its entries to a live one or vice versa.
+    """
+    name = backend_settings()["name"]
+    return None if name in ("gemini", "record") else name
+
+
+class ReplayMiss(KeyError):
+    """A replayed call whose request was never recorded."""
+
+
+class Latency:
+    """
+    A latency distribution in seconds, written as "kind:parameters":
+      constant:0.5           always 0.5
+      uniform:0.5,2.0        uniform between 0.5 and 2.0
+      normal:1.0,0.2         mean 1.0, standard deviation 0.2 (clipped at 0)
+      lognormal:1.0,0.3      median 1.0, sigma 0.3 (long right tail, like API calls)
+    """
+
+    def __init__(self, spec: str, seed: int = 0):
+        self.spec = spec
+        kind, _, parameters = spec.partition(":")
+        self.kind = kind.strip()
+        self.parameters = [float(value) for value in parameters.split(",") if value.strip()]
+        if self.kind not in ("constant", "uniform", "normal", "lognormal"):
+            raise ValueError(f"Unknown latency distribution '{spec}'")
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def sample(self) -> float:
+        with self._lock:
+            if self.kind == "constant":
+                return self.parameters[0]
+            if self.kind == "uniform":
+                return self._random.uniform(*self.parameters)
+            if self.kind == "normal":
+                return max(0.0, self._random.gauss(*self.parameters))
+            median, sigma = self.parameters
+            return median * self._random.lognormvariate(0.0, sigma)
+
+    def wait(self) -> None:
+        time.sleep(self.sample())
+
+
+class RecordingStore:
+    """Recorded LLM responses and embeddings, one JSON object per line, loaded once and appended to."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.entries: dict[str, dict] = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.entries[entry["key"]] = entry
+
+    def get(self, key: str) -> Optional[dict]:
+        return self.entries.get(key)
+
+    def add(self, entry: dict) -> None:
+        with self._lock:
+            if entry["key"] in self.entries:
+                return
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self.entries[entry["key"]] = entry
+
+
+_stores: dict[str, RecordingStore] = {}
+_stores_lock = threading.Lock()
+
+
+def recording_store(path: Optional[str] = None) -> RecordingStore:
+    path = path or backend_settings()["recordings_path"]
+    with _stores_lock:
+        if path not in _stores:
+            _stores[path] = RecordingStore(path)
+        return _stores[path]
+
+
+class UsageMetadata:
+    def __init__(self, prompt: str, text: str):
+        self.prompt_token_count = estimate_tokens(str(prompt))
+        self.candidates_token_count = estimate_tokens(text)
+        self.total_token_count = self.prompt_token_count + self.candidates_token_count
+
+
+class TextResponse:
+    """The parts of a GenerateContentResponse that setup_llm uses: text, usage_metadata and chunk iteration."""
+
+    def __init__(self, text: str, prompt: str = "", chunks: Optional[list] = None, chunk_delay: float = 0.0):
+        self.text = text
+        self.usage_metadata = UsageMetadata(prompt, text)
+        self._chunks = chunks if chunks is not None else [text]
+        self._chunk_delay = chunk_delay
+
+    def __iter__(self):
+        for chunk in self._chunks:
+            if self._chunk_delay:
+                time.sleep(self._chunk_delay)
+            yield TextResponse(chunk)
+
+
+def split_chunks(text: str, size: int = 200) -> list[str]:
+    return [text[i:i + size] for i in range(0, len(text), size)] or [""]
+
+
+EXERCISES = {
+    "lower": ["Back Squat", "Romanian Deadlift", "Bulgarian Split Squat", "Leg Press", "Walking Lunge", "Standing Calf Raise"],
+    "upper": ["Bench Press", "Barbell Row", "Overhead Press", "Lat Pulldown", "Incline Dumbbell Press", "Face Pull"],
+    "full": ["Deadlift", "Front Squat", "Pull-Up", "Dips", "Hip Thrust", "Farmer's Carry"],
+}
+
+
+class SyntheticModel:
+    """
+    Stand-in for a GenerativeModel. JSON requests get a schema-valid weekly_program
+    in a ```json fence (so the extraction path runs), with as many days as the prompt
+    asks for; other requests get a short critique-style text. Responses are
+    deterministic per prompt; the latency is sampled for every call.
+    """
+
+    def __init__(self, respond_as_json: bool, latency: Latency):
+        self.respond_as_json = respond_as_json
+        self.latency = latency
+
+    def program(self, prompt: str) -> dict:
+        rng = random.Random(hashlib.sha256(prompt.encode("utf-8")).hexdigest())
+        days = min(max(requested_days(prompt.lower()) or 3, 2), 6)
+        progression = "AI Progression" in prompt
+        weekly_program = {}
+        for day in range(1, days + 1):
+            split = ("lower", "upper")[day % 2] if days > 3 else "full"
+            exercises = []
+            for name in rng.sample(EXERCISES[split], rng.randint(4, 5)):
+                exercise = {
+                    "name": name,
+                    "sets": rng.randint(2, 5),
+                    "reps": rng.choice(["3-5", "5-8", "6-10", "8-12", "12-15"]),
+                    "target_rpe": rng.choice(["6-7", "7-8", "8-9"]),
+                    "rest": rng.choice(["60-90 seconds", "2-3 minutes", "3-5 minutes"]),
+                    "cues": "Brace, control the eccentric and keep a consistent tempo",
+                }
+                if progression:
+                    exercise["AI Progression"] = "Add 2.5 kg if all sets were completed at the target RPE"
+                exercises.append(exercise)
+            weekly_program[f"Day {day}"] = exercises
+        return {"weekly_program": weekly_program}
+
+    def text(self, prompt: str) -> str:
+        if self.respond_as_json:
+            return "```json\n" + json.dumps(self.program(prompt), indent=2) + "\n```"
+        rng = random.Random(hashlib.sha256(prompt.encode("utf-8")).hexdigest())
+        names = [name for names in EXERCISES.values() for name in names if name in prompt] or ["the main lifts"]
+        return "\n".join(
+            f"- {rng.choice(['Consider', 'Adjust', 'Review'])} the volume of {name}: keep it within 10-20 weekly sets per muscle group."
+            for name in names[:3]
+        )
+
+    def generate_content(self, prompt, stream: bool = False, request_options: Optional[dict] = None):
+        prompt = str(prompt)
+        text = self.text(prompt)
+        seconds = self.latency.sample()
+        if not stream:
+            time.sleep(seconds)
+            return TextResponse(text, prompt)
+        chunks = split_chunks(text)
+        return TextResponse(text, prompt, chunks, chunk_delay=seconds / len(chunks))
+
+
+class RecordingModel:
+    """Calls the live model and saves every complete response text."""
+
+    def __init__(self, model, model_name: str, generation_config: dict, store: RecordingStore):
+        self.model = model
+        self.model_name = model_name
+        self.generation_config = generation_config
+        self.store = store
+
+    def _record(self, prompt, text: str) -> None:
+        key = ResponseCache.make_key(self.model_name, self.generation_config, prompt)
+        self.store.add({"key": key, "kind": "llm", "model": self.model_name, "text": text})
+
+    def generate_content(self, prompt, stream: bool = False, request_options: Optional[dict] = None):
+        response = self.model.generate_content(prompt, stream=stream, request_options=request_options)
+        if not stream:
+            self._record(prompt, response.text)
+            return response
+        return self._recorded_stream(prompt, response)
+
+    def _recorded_stream(self, prompt, response):
+        parts = []
+        for chunk in response:
+            try:
+                parts.append(chunk.text)
+            except ValueError:
+                pass
+            yield chunk
+        self._record(prompt, "".join(parts))
+
+
+class ReplayModel:
+    """Serves recorded response texts; unrecorded prompts raise ReplayMiss or go to the fallback model."""
+
+    def __init__(self, model_name: str, generation_config: dict, store: RecordingStore, fallback=None):
+        self.model_name = model_name
+        self.generation_config = generation_config
+        self.store = store
+        self.fallback = fallback
+
+    def generate_content(self, prompt, stream: bool = False, request_options: Optional[dict] = None):
+        entry = self.store.get(ResponseCache.make_key(self.model_name, self.generation_config, prompt))
+        if entry is None:
+            if self.fallback is None:
+                raise ReplayMiss(f"No recorded {self.model_name} response for this prompt ({self.store.path})")
+            return self.fallback.generate_content(prompt, stream=stream, request_options=request_options)
+        text = entry["text"]
+        return TextResponse(text, str(prompt), split_chunks(text) if stream else None)
+
+
+def backend_model(live_model_factory, model_name: str, generation_config: dict, respond_as_json: bool):
+    """The model object setup_llm should call for the selected backend (live_model_factory() builds the Gemini one)."""
+    settings = backend_settings()
+    name = settings["name"]
+    if name == "gemini":
+        return live_model_factory()
+    if name == "record":
+        return RecordingModel(live_model_factory(), model_name, generation_config, recording_store())
+    synthetic = SyntheticModel(respond_as_json, Latency(settings["latency"], settings["seed"]))
+    if name == "synthetic":
+        return synthetic
+    fallback = synthetic if settings["replay_fallback"] == "synthetic" else None
+    return ReplayModel(model_name, generation_config, recording_store(), fallback)
+
+
+def embedding_key(model: str, text: str, task_type: Optional[str]) -> str:
+    return hashlib.sha256(json.dumps([model, task_type, text]).encode("utf-8")).hexdigest()
+
+
+def _task_type(kwargs: dict) -> Optional[str]:
+    return kwargs.get("task_type")
+
+
+def backend_embeddings(live_embeddings_factory, model: str):
+    """The embedding model setup_embeddings should return for the selected backend."""
+    from langchain_core.embeddings import Embeddings
+
+    settings = backend_settings()
+    name = settings["name"]
+    if name == "gemini":
+        return live_embeddings_factory()
+
+    class SyntheticEmbeddings(FakeEmbeddings):
+        """FakeEmbeddings with a sampled latency per request."""
+
+        def __init__(self, latency: Latency):
+            super().__init__()
+            self.sampled_latency = latency
+
+        def embed_documents(self, texts, **kwargs):
+            self.sampled_latency.wait()
+            return super().embed_documents(texts, **kwargs)
+
+    print(f"Setting up {name} embedding model for: {model}")
+    if name == "synthetic":
+        return SyntheticEmbeddings(Latency(settings["embedding_latency"], settings["seed"]))
+
+    store = recording_store()
+
+    class RecordingEmbeddings(Embeddings):
+        def __init__(self, embeddings):
+            self.embeddings = embeddings
+
+        def embed_documents(self, texts, **kwargs):
+            vectors = self.embeddings.embed_documents(texts, **kwargs)
+            for text, vector in zip(texts, vectors):
+                store.add({"key": embedding_key(model, text, _task_type(kwargs)), "kind": "embedding", "vector": list(vector)})
+            return vectors
+
+        def embed_query(self, text, **kwargs):
+            kwargs.setdefault("task_type", "RETRIEVAL_QUERY")
+            return self.embed_documents([text], **kwargs)[0]
+
+    class ReplayEmbeddings(Embeddings):
+        def __init__(self, fallback):
+            self.fallback = fallback
+
+        def embed_documents(self, texts, **kwargs):
+            vectors = []
+            for text in texts:
+                entry = store.get(embedding_key(model, text, _task_type(kwargs)))
+                if entry is not None:
+                    vectors.append(entry["vector"])
+                elif self.fallback is not None:
+                    vectors.append(self.fallback.embed_documents([text])[0])
+                else:
+                    raise ReplayMiss(f"No recorded {model} embedding for {text[:60]!r} ({store.path})")
+            return vectors
+
+        def embed_query(self, text, **kwargs):
+            kwargs.setdefault("task_type", "RETRIEVAL_QUERY")
+            return self.embed_documents([text], **kwargs)[0]
+
+    if name == "record":
+        return RecordingEmbeddings(live_embeddings_factory())
+    fallback = FakeEmbeddings() if settings["replay_fallback"] == "synthetic" else None
+    return ReplayEmbeddings(fallback)
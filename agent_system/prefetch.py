@@ -0,0 +1,59 @@
+import threading
+from concurrent.futures import Executor, Future
+from typing import Callable, Dict, Iterable, Optional
+
+
+class RetrievalPrefetcher:
+    """
+    Wraps an agent's retrieval function so its calls can be started in the background.
+    The wrapper has the same signature as retrieve_and_generate: a call for a request
+    that was prefetched waits for the background result, any other call goes live.
+    """
+
+    def __init__(self, retrieval_fn: Callable, batch_retrieval_fn: Optional[Callable] = None):
+        self.retrieval_fn = retrieval_fn
+        # Optional batched counterpart of retrieval_fn: takes a list of requests and an
+        # on_result(i, result) callback for results that are ready early, returns a list of results
+        self.batch_retrieval_fn = batch_retrieval_fn
+        self._futures: Dict[tuple[str, str], Future] = {}
+        self._lock = threading.Lock()
+
+    def prefetch(self, requests: Iterable[tuple[str, str]], executor: Executor) -> None:
+        """Start the given (query, specialized_instructions) requests on the executor."""
+        with self._lock:
+            new_requests = [request for request in dict.fromkeys(requests) if request not in self._futures]
+            if self.batch_retrieval_fn is not None and len(new_requests) > 1:
+                futures = {request: Future() for request in new_requests}
+                self._futures.update(futures)
+                executor.submit(self._run_batch, new_requests, futures)
+                return
+            for request in new_requests:
+                self._futures[request] = executor.submit(self.retrieval_fn, *request)
+
+    def _run_batch(self, requests: list[tuple[str, str]], futures: Dict[tuple[str, str], Future]) -> None:
+        # Each future is resolved as soon as its own answer is ready, not when the whole batch is
+        def on_result(i, result):
+            if not futures[requests[i]].done():
+                futures[requests[i]].set_result(result)
+
+        try:
+            results = self.batch_retrieval_fn(requests, on_result=on_result)
+        except Exception as e:
+            for future in futures.values():
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for i, result in enumerate(results):
+            on_result(i, result)
+
+    def reset(self) -> None:
+        """Forget the results of the previous program run."""
+        with self._lock:
+            self._futures = {}
+
+    def __call__(self, query: str, specialized_instructions: str = ""):
+        with self._lock:
+            future: Optional[Future] = self._futures.get((query, specialized_instructions))
+        if future is None:
+            return self.retrieval_fn(query, specialized_instructions)
+        return future.result()
@@ -0,0 +1,134 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Optional
+
+DEFAULT_RESPONSE_CACHE_PATH = os.path.join("data", "llm_cache", "responses.sqlite3")
+CACHE_MODES = ("read-write", "read-only", "bypass")
+
+
+class ResponseCache:
+    """
+    Content-addressed on-disk cache of raw Gemini response texts, backed by SQLite.
+    Entries are keyed by model, generation config and a hash of the prompt, and
+    stored zlib-compressed. Once the compressed texts exceed max_bytes, the least
+    recently used entries are evicted. The raw text is cached (not the parsed
+    JSON), so a cached response goes through the same parsing as a live one.
+    """
+
+    def __init__(self, path: str = DEFAULT_RESPONSE_CACHE_PATH, max_bytes: int = 256 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        self._connection: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, model TEXT, value BLOB, size INTEGER, created_at REAL, accessed_at REAL)"
+            )
+            self._connection.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed_at)")
+            self._connection.commit()
+        return self._connection
+
+    @staticmethod
+    def make_key(model: str, generation_config: dict, prompt, namespace: Optional[str] = None) -> str:
+        """namespace separates the entries of an offline LLM backend (see llm_backend.cache_namespace)."""
+        prompt_hash = hashlib.sha256(str(prompt).encode("utf-8")).hexdigest()
+        parts = [model, sorted(generation_config.items()), prompt_hash]
+        payload = json.dumps(parts + [namespace] if namespace else parts)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached response text for key, or None on a miss."""
+        with self._lock:
+            connection = self._connect()
+            row = connection.execute("SELECT value FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            connection.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (time.time(), key))
+            connection.commit()
+            self.hits += 1
+        return zlib.decompress(row[0]).decode("utf-8")
+
+    def put(self, key: str, model: str, text: str) -> None:
+        """Store a response text and evict least recently used entries beyond max_bytes."""
+        value = zlib.compress(text.encode("utf-8"), 6)
+        now = time.time()
+        with self._lock:
+            connection = self._connect()
+            connection.execute(
+                "INSERT OR REPLACE INTO responses (key, model, value, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model, value, len(value), now, now),
+            )
+            evicted = connection.execute(
+                "DELETE FROM responses WHERE key IN ("
+                "SELECT key FROM (SELECT key, SUM(size) OVER (ORDER BY accessed_at DESC, key) AS total FROM responses) "
+                "WHERE total > ?)",
+                (self.max_bytes,),
+            ).rowcount
+            connection.commit()
+            self.writes += 1
+            self.evictions += evicted
+
+    def clear(self) -> None:
+        with self._lock:
+            connection = self._connect()
+            connection.execute("DELETE FROM responses")
+            connection.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries, size = self._connect().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "writes": self.writes,
+            "evictions": self.evictions,
+            "entries": entries,
+            "compressed_mb": round(size / 1e6, 3),
+        }
+
+
+_caches: dict[str, ResponseCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_response_cache(path: Optional[str] = None) -> ResponseCache:
+    """The process-wide cache for path (LLM_CACHE_PATH by default), sized by LLM_CACHE_MAX_MB."""
+    path = path or os.environ.get("LLM_CACHE_PATH", DEFAULT_RESPONSE_CACHE_PATH)
+    with _caches_lock:
+        if path not in _caches:
+            max_mb = float(os.environ.get("LLM_CACHE_MAX_MB", 256))
+            _caches[path] = ResponseCache(path, max_bytes=int(max_mb * 1024 * 1024))
+        return _caches[path]
+
+
+def default_cache_mode() -> str:
+    # Opt-in: without LLM_CACHE_MODE every call goes to Gemini
+    mode = os.environ.get("LLM_CACHE_MODE", "bypass")
+    if mode not in CACHE_MODES:
+        raise ValueError(f"Unknown LLM_CACHE_MODE '{mode}', expected one of {CACHE_MODES}")
+    return mode
+
+
+def response_cache_stats() -> dict:
+    with _caches_lock:
+        caches = dict(_caches)
+    return {path: cache.stats() for path, cache in caches.items()}
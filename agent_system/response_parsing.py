@@ -0,0 +1,127 @@
+import json
+from typing import Callable, Iterable, Iterator, Optional
+
+
+def parse_json_response(response_text: str):
+    """Parse the JSON of a response_as_json model, unwrapping ```json fences; plain text is wrapped in a placeholder program."""
+    response_text = response_text.strip()
+    try:
+        if "```json" in response_text:
+            json_content = response_text.split("```json", 1)[1]
+            if "```" in json_content:
+                json_content = json_content.split("```", 1)[0]
+            response_text = json_content.strip()
+        elif response_text.strip().startswith("{") and response_text.strip().endswith("}"):
+            pass
+        else:
+            print("Converting plain text response to JSON")
+            return {"weekly_program": {"Day 1": []}, "message": response_text}
+        return json.loads(response_text)
+    except json.JSONDecodeError as e:
+        print(f"Failed to decode JSON: {e}")
+        print(f"Raw text: {response_text}")
+        return {"weekly_program": {"Day 1": []}, "message": response_text}
+
+
+class WeeklyProgramParser:
+    """
+    Incremental scanner for a streamed program response.
+    feed() takes the text as it arrives and returns the days of the top-level
+    "weekly_program" object that were completed by it, as (day, exercises) pairs.
+    Only brackets and strings are tracked, so each day is decoded exactly once,
+    when its closing bracket arrives. Text around the JSON (such as ```json fences)
+    is ignored.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self._position = 0
+        # Open containers: [bracket, key in the parent object, start offset]
+        self._stack: list[list] = []
+        self._in_string = False
+        self._escape = False
+        self._string_start = 0
+        self._last_string: Optional[str] = None
+        self._pending_key: Optional[str] = None
+        self._done = False
+
+    def _in_weekly_program(self) -> bool:
+        return len(self._stack) == 2 and self._stack[0][0] == "{" and self._stack[1][:2] == ["{", "weekly_program"]
+
+    def feed(self, text: str) -> list[tuple[str, list]]:
+        self.text += text
+        days = []
+        for i in range(self._position, len(self.text)):
+            char = self.text[i]
+            if self._done:
+                break
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                    self._last_string = json.loads(self.text[self._string_start:i + 1])
+                continue
+            if not self._stack and char != "{":
+                continue  # before the JSON object
+            if char == '"':
+                self._in_string = True
+                self._string_start = i
+            elif char == ":":
+                self._pending_key = self._last_string
+            elif char == ",":
+                self._pending_key = None
+            elif char in "{[":
+                key = self._pending_key if self._stack and self._stack[-1][0] == "{" else None
+                self._stack.append([char, key, i])
+                self._pending_key = None
+            elif char in "}]":
+                _, key, start = self._stack.pop()
+                if self._in_weekly_program() and key is not None:
+                    try:
+                        days.append((key, json.loads(self.text[start:i + 1])))
+                    except json.JSONDecodeError:
+                        pass  # malformed day; the full response is parsed again at the end
+                self._done = not self._stack
+        self._position = len(self.text)
+        return days
+
+
+class ProgramStream:
+    """
+    A streamed program response.
+    Iterating yields (day, exercises) as soon as each day of "weekly_program" is
+    complete; afterwards result holds the full response, parsed like a non-streamed
+    respond_as_json call. on_text, if given, is called with every text chunk.
+    """
+
+    def __init__(self, chunks: Iterable[str], on_text: Optional[Callable[[str], None]] = None):
+        self.chunks = chunks
+        self.on_text = on_text
+        self.parser = WeeklyProgramParser()
+        self.result = None
+
+    def __iter__(self) -> Iterator[tuple[str, list]]:
+        try:
+            for chunk in self.chunks:
+                if self.on_text:
+                    self.on_text(chunk)
+                yield from self.parser.feed(chunk)
+        finally:
+            self.close()
+        self.result = parse_json_response(self.parser.text)
+
+    def close(self) -> None:
+        """Stop the underlying stream (and release its call slot) if it was not read to the end."""
+        close = getattr(self.chunks, "close", None)
+        if close is not None:
+            close()
+
+    def collect(self, on_day: Optional[Callable[[str, list], None]] = None):
+        """Consume the stream, calling on_day(day, exercises) for every completed day; returns the parsed result."""
+        for day, exercises in self:
+            if on_day:
+                on_day(day, exercises)
+        return self.result
@@ -1,78 +1,197 @@
 from dotenv import load_dotenv
 import os
+import threading
 import google.generativeai as genai
-import json
 import time
 from langchain_google_genai import GoogleGenerativeAIEmbeddings
+from .call_governor import call_governor, estimate_tokens
+from .llm_backend import backend_embeddings, backend_model, backend_settings, cache_namespace
+from .response_cache import CACHE_MODES, ResponseCache, default_cache_mode, get_response_cache
+from .response_parsing import ProgramStream, parse_json_response
 
-def setup_llm(
-        model: str,
-        max_tokens: int | None = None,
-        temperature: float = 0.6,
-        top_p: float = 0.9,
-        respond_as_json: bool = False,
-):
-    # Load environment variables from cre.env
+_registry_lock = threading.Lock()
+# Per process: a forked worker (gunicorn, multiprocessing) must not reuse its parent's gRPC channels
+_registry_pid = None
+_configured_api_key = None
+_models: dict[tuple, object] = {}
+# Output tokens reserved against the TPM limit when a call sets no max_tokens
+DEFAULT_OUTPUT_TOKENS = 2048
+
+
+def _api_key(require_credentials: bool = True) -> str:
+    # Load environment variables from cre.env (only sets variables that are not set yet)
     load_dotenv('cre.env')
     credentials_path = os.environ.get("GOOGLE_APPLICATION_CREDENTIALS")
     api_key = os.environ.get("GOOGLE_GEMINI_API_KEY")
-    if not credentials_path or not api_key:
+    if not api_key:
+        raise EnvironmentError("Google API Key is missing.")
+    if require_credentials and not credentials_path:
         raise EnvironmentError("Required environment variables are missing.")
+    return api_key
+
+
+def _reset_if_forked():
+    global _registry_pid, _configured_api_key
+    if _registry_pid != os.getpid():
+        _registry_pid = os.getpid()
+        _configured_api_key = None
+        _models.clear()
+
+
+def configure_api(require_credentials: bool = True) -> None:
+    """Configure the Gemini API once per process; later calls only check the configuration."""
+    global _configured_api_key
+    with _registry_lock:
+        _reset_if_forked()
+        if _configured_api_key is not None:
+            # cre.env was loaded by the first call; only the credentials check is left
+            if require_credentials and not os.environ.get("GOOGLE_APPLICATION_CREDENTIALS"):
+                raise EnvironmentError("Required environment variables are missing.")
+            return
+        api_key = _api_key(require_credentials)
+        genai.configure(api_key=api_key)
+        _configured_api_key = api_key
+
+
+def get_model(model: str, generation_config: dict, respond_as_json: bool = False):
+    """
+    The shared GenerativeModel for (model, generation_config), created on first use.
+    Models are safe to share between threads and all use the process-wide Gemini
+    client, so its HTTP/gRPC connections are reused across requests.
+    With LLM_BACKEND set to replay or synthetic (llm_backend.py) this is an offline
+    stand-in instead, and no API key is needed.
+    """
+    backend = backend_settings()["name"]
+    if backend in ("gemini", "record"):
+        configure_api()
+    key = (backend, model, tuple(sorted(generation_config.items())), respond_as_json)
+    with _registry_lock:
+        _reset_if_forked()
+        if key not in _models:
+            _models[key] = backend_model(
+                lambda: genai.GenerativeModel(model_name=model, generation_config=generation_config),
+                model, generation_config, respond_as_json,
+            )
+        return _models[key]
+
 
+def registry_size() -> int:
+    with _registry_lock:
+        return len(_models)
 
-    # Configure the Gemini API using your API key
-    genai.configure(api_key=api_key)
 
+def response_tokens(response) -> int | None:
+    usage = getattr(response, "usage_metadata", None)
+    return getattr(usage, "total_token_count", None) or None
+
+
+def setup_llm(
+        model: str,
+        max_tokens: int | None = None,
+        temperature: float = 0.6,
+        top_p: float = 0.9,
+        respond_as_json: bool = False,
+        deadline_seconds: float | None = None,
+        cache_mode: str | None = None,
+):
     generation_config = {
         "temperature": temperature,
         "top_p": top_p,
         "max_output_tokens": max_tokens
     }
 
-    gemini_model = genai.GenerativeModel(model_name=model)
+    # Opt-in response cache (response_cache.py): "read-write", "read-only" or "bypass" (default: LLM_CACHE_MODE)
+    cache_mode = cache_mode or default_cache_mode()
+    if cache_mode not in CACHE_MODES:
+        raise ValueError(f"Unknown cache mode '{cache_mode}', expected one of {CACHE_MODES}")
+    response_cache = get_response_cache() if cache_mode != "bypass" else None
+    # Offline backends (synthetic, replay) keep their responses apart from live ones
+    namespace = cache_namespace()
+
+    # Shared with every other setup_llm call for the same model and settings
+    gemini_model = get_model(model, generation_config, respond_as_json)
 
     def generate_response(prompt):
-        response = gemini_model.generate_content(prompt, generation_config=generation_config)
-        response_text = response.text.strip()
+        cache_key = ResponseCache.make_key(model, generation_config, prompt, namespace) if response_cache else None
+        response_text = response_cache.get(cache_key) if response_cache else None
+        if response_text is None:
+            # Rate limits, concurrency, retries and the deadline are shared by all models (call_governor.py)
+            response = call_governor.call(
+                model,
+                lambda timeout: gemini_model.generate_content(prompt, request_options={"timeout": timeout}),
+                estimated_tokens=estimate_tokens(str(prompt)) + (max_tokens or DEFAULT_OUTPUT_TOKENS),
+                deadline_seconds=deadline_seconds,
+                usage=response_tokens,
+            )
+            response_text = response.text
+            if cache_mode == "read-write":
+                response_cache.put(cache_key, model, response_text)
+        response_text = response_text.strip()
         if respond_as_json:
-            # Attempt to parse JSON from the response text
-            try:
-                if "```json" in response_text:
-                    json_content = response_text.split("```json", 1)[1]
-                    if "```" in json_content:
-                        json_content = json_content.split("```", 1)[0]
-                    response_text = json_content.strip()
-                elif response_text.strip().startswith("{") and response_text.strip().endswith("}"):
-                    pass
-                else:
-                    print("Converting plain text response to JSON")
-                    return {"weekly_program": {"Day 1": []}, "message": response_text}
-                return json.loads(response_text)
-            except json.JSONDecodeError as e:
-                print(f"Failed to decode JSON: {e}")
-                print(f"Raw text: {response_text}")
-                return {"weekly_program": {"Day 1": []}, "message": response_text}
+            return parse_json_response(response_text)
         return response_text
 
+    def stream_response(prompt):
+        """Yield the response text in chunks as Gemini generates it (generate_content(stream=True))."""
+        cache_key = ResponseCache.make_key(model, generation_config, prompt, namespace) if response_cache else None
+        cached = response_cache.get(cache_key) if response_cache else None
+        if cached is not None:
+            yield cached
+            return
+        parts = []
+        chunks = call_governor.stream(
+            model,
+            lambda timeout: gemini_model.generate_content(prompt, stream=True, request_options={"timeout": timeout}),
+            estimated_tokens=estimate_tokens(str(prompt)) + (max_tokens or DEFAULT_OUTPUT_TOKENS),
+            deadline_seconds=deadline_seconds,
+            usage=response_tokens,
+        )
+        try:
+            for chunk in chunks:
+                try:
+                    text = chunk.text
+                except ValueError:
+                    continue  # a chunk without text parts, e.g. the final one carrying only the finish reason
+                if text:
+                    parts.append(text)
+                    yield text
+        finally:
+            # Frees the call slot right away when the caller stops reading early
+            chunks.close()
+        # Only reached once the stream is complete, so partial responses are never cached
+        if cache_mode == "read-write":
+            response_cache.put(cache_key, model, "".join(parts))
+
+    def stream_program(prompt, on_text=None):
+        """A ProgramStream over stream_response: yields the days of weekly_program as they complete."""
+        return ProgramStream(stream_response(prompt), on_text=on_text)
+
+    # Streaming variants of the same model, for callers that can use partial output
+    generate_response.stream = stream_response
+    generate_response.stream_program = stream_program
     return generate_response
 
-def setup_embeddings(model="models/gemini-embedding-exp-03-07"):
+def setup_embeddings(model="models/gemini-embedding-exp-03-07", probe=True):
     """
     Set up and return a Google Generative AI embeddings model.
     
     Args:
         model: The embedding model to use (must use format "models/embedding-001")
+        probe: Make a test embedding call (with retries) before returning.
+            Disable it to construct the model without any network round-trip.
     
     Returns:
-        A configured embedding model
+        A configured embedding model (an offline one for the replay and synthetic backends)
     """
 
-    load_dotenv('cre.env')
-    api_key = os.environ.get("GOOGLE_GEMINI_API_KEY")
-    if not api_key:
-        raise EnvironmentError("Google API Key is missing.")
-    genai.configure(api_key=api_key)
+    return backend_embeddings(lambda: _live_embeddings(model, probe), model)
+
+
+def _live_embeddings(model, probe):
+    configure_api(require_credentials=False)
     print(f"Setting up embedding model: {model}")
+    if not probe:
+        return GoogleGenerativeAIEmbeddings(model=model)
     
     # Initialize with retry mechanism
     max_retries = 3
@@ -4,6 +4,7 @@ import json
 import os
 import argparse
 import tempfile
+import threading
 from datetime import datetime, timedelta
 import uuid
 
@@ -22,7 +23,10 @@ from prompts import (
     CRITIC_PROMPT_SETTINGS,
 )
 
-from rag_retrieval import retrieve_and_generate
+from agent_system.call_governor import call_governor
+from agent_system.response_cache import response_cache_stats
+from knowledge_pack import DEFAULT_PACK_PATH, load_knowledge_pack
+from rag_retrieval import retrieval_service, retrieve_and_generate, retrieve_and_generate_many, warm_up
 
 app = Flask(__name__)
 app.secret_key = os.urandom(24)
@@ -42,9 +46,34 @@ DEFAULT_CONFIG = {
     'writer_top_p': 0.9,
     'writer_prompt_settings': 'v1',
     'critic_prompt_settings': 'week1',
-    'max_iterations': 1
+    'max_iterations': 1,
+    'critic_max_workers': 4,
+    'knowledge_pack_path': DEFAULT_PACK_PATH,  # None retrieves everything live
+    # "direct" gives an agent the retrieved chunks instead of a generated RAG answer (one LLM call less)
+    'writer_retrieval_mode': 'generate',
+    'critic_retrieval_modes': {},  # e.g. {'rep_ranges': 'direct', 'rpe': 'direct'}
 }
 
+# Knowledge packs checked against an index version and retrieval pipeline, so the staleness
+# check runs once per version instead of on every request
+_knowledge_packs = {}
+_knowledge_packs_lock = threading.Lock()
+
+def get_knowledge_pack(path):
+    """The pack at path if it matches the index version being served, else None."""
+    mtime = os.stat(path).st_mtime_ns if os.path.exists(path) else None
+    key = (path, mtime, retrieval_service.index_fingerprint(), retrieval_service.pipeline_signature())
+    with _knowledge_packs_lock:
+        if key not in _knowledge_packs:
+            _knowledge_packs[key] = load_knowledge_pack(path, index_fingerprint=key[2], pipeline=key[3])
+        return _knowledge_packs[key]
+
+def warm_up_retrieval():
+    """Connect the retrieval backend, then load and check the knowledge pack against the index it serves."""
+    warm_up()
+    if DEFAULT_CONFIG['knowledge_pack_path']:
+        get_knowledge_pack(DEFAULT_CONFIG['knowledge_pack_path'])
+
 def get_program_generator(config=None):
     """Setup the program generator with the given or default config"""
     if config is None:
@@ -87,6 +116,11 @@ def get_program_generator(config=None):
     if not task_revision and 'revision' in WRITER_PROMPT_SETTINGS:
         task_revision = WRITER_PROMPT_SETTINGS['revision'].task_revision
     
+    # Precomputed retrievals from build_knowledge_pack.py, if a current pack exists
+    knowledge_pack = None
+    if config.get('knowledge_pack_path'):
+        knowledge_pack = get_knowledge_pack(config['knowledge_pack_path'])
+
     # Agents
     writer = Writer(
         model=llm_writer,
@@ -96,14 +130,19 @@ def get_program_generator(config=None):
         task_revision=task_revision,
         task_progression=getattr(writer_prompt_settings, 'task_progression', None),
         writer_type=writer_type,
-        retrieval_fn=retrieve_and_generate # Retrieval function
+        retrieval_fn=retrieve_and_generate, # Retrieval function
+        knowledge_pack=knowledge_pack,
+        retrieval_mode=config.get('writer_retrieval_mode', 'generate'),
     )
 
     critic = Critic(
         model=llm_critic,
         role=critic_prompt_settings.role,
         tasks=getattr(critic_prompt_settings, 'tasks', None),
-        retrieval_fn=retrieve_and_generate
+        retrieval_fn=retrieve_and_generate,
+        max_workers=config.get('critic_max_workers', 1),
+        knowledge_pack=knowledge_pack,
+        retrieval_modes=config.get('critic_retrieval_modes'),
     )
 
     editor = Editor()
@@ -112,7 +151,8 @@ def get_program_generator(config=None):
         writer=writer,
         critic=critic,
         editor=editor,
-        max_iterations=config.get('max_iterations', 2)
+        max_iterations=config.get('max_iterations', 2),
+        batch_retrieval_fn=retrieve_and_generate_many,
     )
 
 def parse_program(program_output):
@@ -509,5 +549,12 @@ def load_program():
     except Exception as e:
         return jsonify({'success': False, 'message': f'Error loading program: {str(e)}'})
 
+@app.route('/llm_stats', methods=['GET'])
+def llm_stats():
+    """Queueing, wait times, retries and token use of the shared LLM call governor, and response cache hits"""
+    return jsonify(dict(call_governor.stats(), response_cache=response_cache_stats()))
+
 if __name__ == '__main__':
+    # Connect the retrieval backend in the background so the server starts immediately
+    threading.Thread(target=warm_up_retrieval, name="retrieval-warm-up", daemon=True).start()
     app.run(debug=True, use_reloader=False)
@@ -0,0 +1,235 @@
+"""
+End-to-end program generation latency with RAG answers ("generate") and with the
+retrieved chunks passed to the agents directly ("direct").
+
+    python -m benchmarks.agent_latency_benchmark              # Gemini and data/chroma_db, one run per persona
+    python -m benchmarks.agent_latency_benchmark --synthetic  # offline, with simulated LLM and retrieval latency
+    python -m benchmarks.agent_latency_benchmark --backend synthetic --persist-directory data/chroma_db_fake
+                                                              # offline, the real app graph and retrieval on a fake index
+
+--backend runs the app's own generator, retrieval and setup_llm stack (call governor,
+response cache, JSON parsing) on top of an offline LLM backend (agent_system/llm_backend.py):
+"synthetic" answers with generated programs after LLM_SYNTHETIC_LATENCY, "replay" serves the
+responses saved by an earlier "--backend record" run. The index of --persist-directory must
+have been built with the same embeddings (build_db.py --fake-embeddings for synthetic).
+
+Each mode generates a week 1 program for every persona in Data/personas/personas_vers2.json
+and reports the wall-clock time and the number of agent and RAG answer LLM calls.
+The answer caches and the knowledge pack are bypassed: every run starts with an empty
+answer cache, so each run generates its RAG answers cold.
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from benchmarks.queries import load_personas, persona_user_input
+
+MODES = ("generate", "direct")
+
+
+class CallCounter:
+    """Wraps a model or retrieval function and counts its calls."""
+
+    def __init__(self, fn):
+        self.fn = fn
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, *args, **kwargs):
+        with self._lock:
+            self.calls += 1
+        return self.fn(*args, **kwargs)
+
+
+def mode_config(mode):
+    """Retrieval mode settings for get_program_generator / build_synthetic_generator."""
+    from agent_system.agents import Critic
+
+    critic = Critic(model=None, role={})
+    return {
+        'writer_retrieval_mode': mode,
+        'critic_retrieval_modes': {task_type: mode for task_type in critic.task_configs},
+    }
+
+
+def build_live_generator(mode, persist_directory=None):
+    from app import DEFAULT_CONFIG, get_program_generator
+    from rag_cache import AnswerCache
+    from rag_retrieval import retrieval_service
+
+    if persist_directory:
+        retrieval_service.persist_directory = persist_directory
+    retrieval_service.warm()
+    retrieval_service.semantic_cache = None
+    if not isinstance(retrieval_service._generate_response, CallCounter):
+        retrieval_service._generate_response = CallCounter(retrieval_service.generate_response)
+    rag_counter = retrieval_service._generate_response
+
+    config = dict(DEFAULT_CONFIG, knowledge_pack_path=None, **mode_config(mode))
+    generator = get_program_generator(config)
+    generator.writer.model = CallCounter(generator.writer.model)
+    generator.critic.model = CallCounter(generator.critic.model)
+
+    def before_run():
+        # A throwaway answer cache per run, so the persistent one is neither used nor filled
+        # and no run is served answers generated by an earlier one
+        retrieval_service.answer_cache = AnswerCache(os.path.join(tempfile.mkdtemp(), "answers.sqlite3"))
+
+    return generator, rag_counter, before_run
+
+
+def build_synthetic_generator(mode, llm_latency, rag_latency, retrieval_latency, seed=0):
+    """The app's week 1 agents with simulated models and retrieval; latencies are lognormal medians in seconds."""
+    from agent_system import Critic, Editor, ProgramGenerator, Writer
+    from prompts import CRITIC_PROMPT_SETTINGS, WRITER_PROMPT_SETTINGS
+
+    rng = np.random.default_rng(seed)
+    rng_lock = threading.Lock()
+
+    def wait(median):
+        with rng_lock:
+            seconds = median * rng.lognormal(0.0, 0.3)
+        time.sleep(seconds)
+
+    def writer_model(prompt):
+        wait(llm_latency)
+        return {"weekly_program": {"Day 1": [{"name": "Squat", "sets": 3, "reps": "5-8", "target_rpe": 8}]}}
+
+    def critic_model(prompt):
+        wait(llm_latency)
+        return "None"
+
+    rag_counter = CallCounter(lambda: wait(rag_latency))
+
+    def retrieve_and_generate(query, specialized_instructions=""):
+        wait(retrieval_latency)
+        rag_counter()
+        return "Generated answer.", []
+
+    def retrieve_and_generate_many(requests, on_result=None):
+        wait(retrieval_latency)
+
+        def generate(i):
+            rag_counter()
+            if on_result:
+                on_result(i, ("Generated answer.", []))
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            list(executor.map(generate, range(len(requests))))
+        return [("Generated answer.", []) for _ in requests]
+
+    def retrieve_context(query, k=8):
+        wait(retrieval_latency)
+        return "Excerpt from the literature.", "Excerpt...", []
+
+    writer_settings = WRITER_PROMPT_SETTINGS["initial"]
+    critic_settings = CRITIC_PROMPT_SETTINGS["week1"]
+    modes = mode_config(mode)
+    writer = Writer(
+        model=CallCounter(writer_model),
+        role=writer_settings.role,
+        structure=writer_settings.structure,
+        task=writer_settings.task,
+        task_revision=WRITER_PROMPT_SETTINGS["revision"].task_revision,
+        writer_type="initial",
+        retrieval_fn=retrieve_and_generate,
+        retrieval_mode=modes['writer_retrieval_mode'],
+        context_fn=retrieve_context,
+    )
+    critic = Critic(
+        model=CallCounter(critic_model),
+        role=critic_settings.role,
+        tasks=getattr(critic_settings, 'tasks', None),
+        retrieval_fn=retrieve_and_generate,
+        max_workers=4,
+        retrieval_modes=modes['critic_retrieval_modes'],
+        context_fn=retrieve_context,
+    )
+    generator = ProgramGenerator(
+        writer=writer,
+        critic=critic,
+        editor=Editor(),
+        max_iterations=1,
+        batch_retrieval_fn=retrieve_and_generate_many,
+    )
+    return generator, rag_counter, None
+
+
+def run_mode(mode, personas, build, repeats):
+    generator, rag_counter, before_run = build(mode)
+    runs = []
+    for _ in range(repeats):
+        for persona_id, persona in personas.items():
+            if before_run:
+                before_run()
+            calls_before = (generator.writer.model.calls, generator.critic.model.calls, rag_counter.calls)
+            start = time.perf_counter()
+            generator.create_program(user_input=persona_user_input(persona))
+            runs.append({
+                "persona": persona_id,
+                "seconds": time.perf_counter() - start,
+                "agent_llm_calls": generator.writer.model.calls + generator.critic.model.calls - calls_before[0] - calls_before[1],
+                "rag_llm_calls": rag_counter.calls - calls_before[2],
+            })
+    seconds = [run["seconds"] for run in runs]
+    return {
+        "mode": mode,
+        "runs": len(runs),
+        "seconds_mean": round(float(np.mean(seconds)), 3),
+        "seconds_p50": round(float(np.percentile(seconds, 50)), 3),
+        "seconds_p95": round(float(np.percentile(seconds, 95)), 3),
+        "agent_llm_calls_mean": round(float(np.mean([run["agent_llm_calls"] for run in runs])), 2),
+        "rag_llm_calls_mean": round(float(np.mean([run["rag_llm_calls"] for run in runs])), 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--synthetic", action="store_true", help="simulate the LLM and retrieval latency instead of calling Gemini")
+    parser.add_argument("--modes", nargs="+", default=list(MODES), choices=MODES)
+    parser.add_argument("--repeats", type=int, default=1, help="runs per persona and mode")
+    parser.add_argument("--llm-latency", type=float, default=1.0, help="synthetic agent LLM call latency (s)")
+    parser.add_argument("--rag-latency", type=float, default=0.8, help="synthetic RAG answer call latency (s)")
+    parser.add_argument("--retrieval-latency", type=float, default=0.05, help="synthetic embedding and search latency (s)")
+    parser.add_argument("--backend", choices=("gemini", "record", "replay", "synthetic"),
+                        help="LLM and embedding backend of the app's generator (default: LLM_BACKEND, or gemini)")
+    parser.add_argument("--persist-directory", help="Chroma directory to retrieve from (default: data/chroma_db)")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    args = parser.parse_args()
+
+    personas = load_personas()
+    if args.synthetic:
+        def build(mode):
+            return build_synthetic_generator(mode, args.llm_latency, args.rag_latency, args.retrieval_latency)
+    else:
+        from agent_system.llm_backend import backend_settings, configure_backend
+
+        configure_backend(name=args.backend)
+        print(f"LLM backend: {backend_settings()['name']}")
+
+        def build(mode):
+            return build_live_generator(mode, args.persist_directory)
+
+    results = []
+    for mode in args.modes:
+        result = run_mode(mode, personas, build, args.repeats)
+        results.append(result)
+        print(json.dumps(result))
+    by_mode = {result["mode"]: result for result in results}
+    if len(by_mode) == 2:
+        print(f"direct / generate mean latency: {by_mode['direct']['seconds_mean'] / by_mode['generate']['seconds_mean']:.2f}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"synthetic": args.synthetic, "backend": args.backend, "personas": len(personas), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+Index size, chunk count and retrieval recall for different chunking settings.
+
+    python -m benchmarks.chunking_benchmark            # embeds the chunks with text-embedding-004
+    python -m benchmarks.chunking_benchmark --lexical  # offline, ranks the chunks with BM25
+
+Chunks the PDFs in Data/books with the original 1000-character splitter and with the
+structured token-based chunker at several sizes, retrieves the top k chunks for every
+Writer and Critic query and scores them against benchmarks/fixtures/retrieval_labels.json.
+Finally it names the smallest index whose recall is within --tolerance of the best one.
+"""
+
+import argparse
+import json
+import os
+
+import numpy as np
+
+from benchmarks.queries import project_queries
+from benchmarks.retrieval_benchmark import facet_recall, load_labels
+from chunking import get_chunker
+from ingestion import iter_batches, iter_pages, list_pdfs
+from rag_packing import estimate_tokens
+from rag_rerank import bm25_scores, normalize_rows
+
+BOOKS_DIRECTORY = os.path.join("Data", "books")
+
+
+def chunkers(sizes, overlaps):
+    yield get_chunker("recursive")
+    for max_tokens in sizes:
+        for overlap_tokens in overlaps:
+            yield get_chunker("structured", max_tokens=max_tokens, overlap_tokens=overlap_tokens)
+
+
+def embedding_ranker(embedding_model, batch_size=100):
+    def rank(texts, queries, k):
+        vectors = []
+        for batch in iter_batches(texts, batch_size):
+            vectors.extend(embedding_model.embed_documents(batch))
+        matrix = normalize_rows(np.array(vectors))
+        query_matrix = normalize_rows(np.array(embedding_model.embed_documents(queries, task_type="RETRIEVAL_QUERY")))
+        return np.argsort(-(query_matrix @ matrix.T), axis=1)[:, :k]
+    return rank
+
+
+def lexical_ranker(texts, queries, k):
+    return np.array([np.argsort(-bm25_scores(query, texts))[:k] for query in queries])
+
+
+def evaluate(chunker, pages, queries, labels, rank, k, dimension):
+    chunks = list(chunker.iter_chunks(iter(pages)))
+    texts = [chunk["text"] for chunk in chunks]
+    top = rank(texts, [item["query"] for item in queries], k)
+    recalls, context_tokens = [], []
+    for item, indices in zip(queries, top):
+        context = "\n\n".join(texts[i] for i in indices)
+        context_tokens.append(estimate_tokens(context))
+        recall = facet_recall(context, labels.get(item["task"]))
+        if recall is not None:
+            recalls.append(recall)
+    text_bytes = sum(len(text.encode("utf-8")) for text in texts)
+    return {
+        "settings": chunker.settings,
+        "chunks": len(chunks),
+        "chunk_tokens_mean": round(float(np.mean([estimate_tokens(text) for text in texts])), 1) if texts else 0,
+        "text_mb": round(text_bytes / 1e6, 2),
+        "index_mb": round((text_bytes + len(chunks) * dimension * 4) / 1e6, 2),
+        "context_tokens_mean": round(float(np.mean(context_tokens)), 1),
+        "recall_at_k": round(float(np.mean(recalls)), 4) if recalls else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--books", default=BOOKS_DIRECTORY)
+    parser.add_argument("--lexical", action="store_true", help="rank with BM25 instead of embeddings (no API calls)")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[128, 256, 512], help="structured max_tokens values")
+    parser.add_argument("--overlaps", type=int, nargs="+", default=[0, 32], help="structured overlap_tokens values")
+    parser.add_argument("--k", type=int, default=8)
+    parser.add_argument("--dimension", type=int, default=768, help="embedding width used for the index size")
+    parser.add_argument("--tolerance", type=float, default=0.02, help="recall loss accepted for a smaller index")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    args = parser.parse_args()
+
+    paths = list_pdfs(args.books) if os.path.isdir(args.books) else []
+    if not paths:
+        print(f"No PDF files found in '{args.books}'.")
+        return
+    pages = list(iter_pages(paths))
+    queries = project_queries()
+    labels = load_labels()
+    if args.lexical:
+        rank = lexical_ranker
+    else:
+        from agent_system.setup_api import setup_embeddings
+        rank = embedding_ranker(setup_embeddings(model="models/text-embedding-004", probe=False))
+    print(f"{len(paths)} books, {len(pages)} pages, {len(queries)} queries")
+
+    results = []
+    for chunker in chunkers(args.sizes, args.overlaps):
+        result = evaluate(chunker, pages, queries, labels, rank, args.k, args.dimension)
+        results.append(result)
+        print(json.dumps(result))
+
+    scored = [result for result in results if result["recall_at_k"] is not None]
+    if scored:
+        best_recall = max(result["recall_at_k"] for result in scored)
+        cheapest = min(
+            (result for result in scored if result["recall_at_k"] >= best_recall - args.tolerance),
+            key=lambda result: result["index_mb"],
+        )
+        print(f"Smallest index within {args.tolerance} of the best recall ({best_recall}): {json.dumps(cheapest['settings'])}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"lexical": args.lexical, "k": args.k, "pages": len(pages), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Throughput and resume correctness of the embedding stage in embedding_stage.py.
+
+    python -m benchmarks.embedding_benchmark
+    python -m benchmarks.embedding_benchmark --latency 0.3 --batch-sizes 50 100 --concurrency 1 4 8
+
+Runs offline against FakeEmbeddings, whose latency stands in for one embedding API
+request. For every batch size and concurrency it reports chunks/s, and checks that a
+run which fails halfway and is resumed from its checkpoint writes every chunk exactly once.
+"""
+
+import argparse
+import json
+import os
+import tempfile
+
+from google.api_core import exceptions as google_exceptions
+
+from embedding_stage import EmbeddingStage, FakeEmbeddings
+
+
+class FailingEmbeddings(FakeEmbeddings):
+    """Fails every request after the first fail_after ones, like an exhausted quota."""
+
+    def __init__(self, fail_after, **kwargs):
+        super().__init__(**kwargs)
+        self.fail_after = fail_after
+
+    def embed_documents(self, texts, **kwargs):
+        if self.requests >= self.fail_after:
+            raise google_exceptions.ResourceExhausted("quota exceeded")
+        return super().embed_documents(texts, **kwargs)
+
+
+def synthetic_chunks(n):
+    return [{"id": f"chunk-{i}", "text": f"Synthetic chunk {i} about squats, sets and reps.", "metadata": {}} for i in range(n)]
+
+
+def throughput(chunks, batch_size, concurrency, latency, qps):
+    stage = EmbeddingStage(FakeEmbeddings(latency=latency), batch_size=batch_size, max_concurrency=concurrency, qps=qps)
+    report = stage.run(chunks, lambda batch, embeddings: None)
+    return {
+        "batch_size": batch_size,
+        "concurrency": concurrency,
+        "qps": qps,
+        "seconds": round(report["seconds"], 3),
+        "chunks_per_second": round(report["chunks_per_second"], 1),
+    }
+
+
+def resume_check(chunks, batch_size, concurrency, latency):
+    """Fail halfway, resume from the checkpoint and count how often every chunk was written."""
+    checkpoint_path = os.path.join(tempfile.mkdtemp(), "checkpoint.txt")
+    written = []
+
+    def write_batch(batch, embeddings):
+        written.extend(chunk["id"] for chunk in batch)
+
+    total_batches = -(-len(chunks) // batch_size)
+    failing = FailingEmbeddings(total_batches // 2, latency=latency)
+    stage = EmbeddingStage(failing, batch_size, concurrency, checkpoint_path=checkpoint_path, max_retries=1, retry_delay=0.01)
+    try:
+        stage.run(chunks, write_batch)
+    except google_exceptions.ResourceExhausted:
+        pass
+    written_before_failure = len(written)
+    stage = EmbeddingStage(FakeEmbeddings(latency=latency), batch_size, concurrency, checkpoint_path=checkpoint_path)
+    report = stage.run(chunks, write_batch)
+    return {
+        "written_before_failure": written_before_failure,
+        "resumed": report["resumed"],
+        "every_chunk_once": sorted(written) == sorted(chunk["id"] for chunk in chunks),
+        "checkpoint_removed": not os.path.exists(checkpoint_path),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=2000)
+    parser.add_argument("--latency", type=float, default=0.1, help="seconds per simulated embedding request")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[25, 100])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--qps", type=float, default=None, help="request rate limit applied to every run")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    args = parser.parse_args()
+
+    chunks = synthetic_chunks(args.chunks)
+    results = []
+    for batch_size in args.batch_sizes:
+        for concurrency in args.concurrency:
+            result = throughput(chunks, batch_size, concurrency, args.latency, args.qps)
+            results.append(result)
+            print(json.dumps(result))
+    resume = resume_check(chunks, args.batch_sizes[-1], args.concurrency[-1], args.latency)
+    print(json.dumps({"resume": resume}))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"chunks": args.chunks, "latency": args.latency, "results": results, "resume": resume}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Recall loss, size and query latency of compact vector indexes.
+
+    python -m benchmarks.quantization_benchmark                          # synthetic clustered vectors
+    python -m benchmarks.quantization_benchmark --index data/vector_index  # the exported knowledge base
+
+Builds a VectorIndex for every combination of dtype, truncated dimensions and rescoring,
+answers the same queries (stored vectors with added noise, like paraphrased passages)
+and compares the top k with the exact full-width float32 result. Reports recall@k,
+the bytes scanned per query, the size on disk and the query latency.
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from index_versions import current_index_directory
+from vector_index import EMBEDDINGS_FILE, FULL_EMBEDDINGS_FILE, SCALES_FILE, VectorIndex, normalize
+
+
+def synthetic_vectors(n, dimension, clusters=50, spread=0.6, seed=0):
+    """Clustered unit vectors with most of the variance in the leading dimensions, like text embeddings."""
+    rng = np.random.default_rng(seed)
+    decay = 1.0 / np.sqrt(1.0 + np.arange(dimension) / 32.0)
+    centres = rng.normal(size=(clusters, dimension)) * decay
+    vectors = centres[rng.integers(clusters, size=n)] + spread * rng.normal(size=(n, dimension)) * decay
+    return normalize(vectors)
+
+
+def benchmark_queries(vectors, n, noise=0.5, seed=1):
+    rng = np.random.default_rng(seed)
+    sample = vectors[rng.choice(len(vectors), size=min(n, len(vectors)), replace=False)]
+    return normalize(sample + noise * rng.normal(size=sample.shape) / np.sqrt(vectors.shape[1]))
+
+
+def disk_bytes(index):
+    with tempfile.TemporaryDirectory() as directory:
+        index.save(directory)
+        return sum(
+            os.path.getsize(os.path.join(directory, name))
+            for name in (EMBEDDINGS_FILE, SCALES_FILE, FULL_EMBEDDINGS_FILE)
+            if os.path.exists(os.path.join(directory, name))
+        )
+
+
+def evaluate(vectors, queries, exact, k, dtype, dimensions, rescore, repeats):
+    texts = [""] * len(vectors)
+    index = VectorIndex.build(vectors, texts, [{}] * len(vectors), dtype=dtype, dimensions=dimensions, keep_full=rescore)
+    latencies = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        indices, _ = index.search(queries, k)
+        latencies.append(time.perf_counter() - start)
+    recall = np.mean([len(set(row) & set(truth)) / k for row, truth in zip(indices, exact)])
+    return {
+        "dtype": dtype,
+        "dimensions": index.dimensions,
+        "rescore": index.full_embeddings is not None,
+        "recall_at_k": round(float(recall), 4),
+        "scanned_mb": round(index.nbytes() / 1e6, 3),
+        "disk_mb": round(disk_bytes(index) / 1e6, 3),
+        "ms_per_query": round(1000 * float(np.median(latencies)) / len(queries), 4),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--index", help="VectorIndex directory to take the vectors from (default: synthetic vectors)")
+    parser.add_argument("--vectors", type=int, default=20000, help="number of synthetic vectors")
+    parser.add_argument("--dimension", type=int, default=768, help="width of the synthetic vectors")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=8)
+    parser.add_argument("--dtypes", nargs="+", default=["float32", "float16", "int8"])
+    parser.add_argument("--dimensions", type=int, nargs="+", default=[768, 256, 128])
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--output", help="write the results to this JSON file")
+    args = parser.parse_args()
+
+    if args.index:
+        index = VectorIndex.load(current_index_directory(args.index), mmap=False)
+        vectors = normalize(index.vectors(np.arange(len(index))))
+    else:
+        vectors = synthetic_vectors(args.vectors, args.dimension)
+    queries = benchmark_queries(vectors, args.queries)
+    exact, _ = VectorIndex.build(vectors, [""] * len(vectors), [{}] * len(vectors)).search(queries, args.k)
+    print(f"{len(vectors)} vectors of {vectors.shape[1]} dimensions, {len(queries)} queries, k={args.k}")
+
+    results = []
+    for dtype in args.dtypes:
+        for dimensions in args.dimensions:
+            for rescore in (False, True):
+                if rescore and dtype == "float32" and dimensions >= vectors.shape[1]:
+                    continue  # nothing to rescore
+                result = evaluate(vectors, queries, exact, args.k, dtype, dimensions, rescore, args.repeats)
+                results.append(result)
+                print(json.dumps(result))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"vectors": len(vectors), "dimension": int(vectors.shape[1]), "k": args.k, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""
+The retrieval queries the agents actually issue, formatted against the test personas.
+"""
+
+import json
+import os
+
+from agent_system.agents import Critic, Writer
+
+PERSONAS_PATH = os.path.join("Data", "personas", "personas_vers2.json")
+DEFAULT_USER_INPUT = "Generate a strength training program for the selected persona."
+
+
+def load_personas(path=PERSONAS_PATH):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)["Personas"]
+
+
+def persona_user_input(persona):
+    """The user input app.py builds when a persona is selected in the web interface."""
+    return f"{DEFAULT_USER_INPUT}\nTarget Persona: {persona}"
+
+
+def project_queries(personas=None, unique=True):
+    """
+    Every retrieval request of the Writer and the Critic tasks for each persona.
+    Returns dicts with task, persona, query and specialized_instructions. With unique=True
+    requests that do not depend on the persona (rep_ranges, rpe, ...) are only listed once.
+    """
+    personas = personas if personas is not None else load_personas()
+    writer = Writer(model=None, role={}, structure="", task="", writer_type="initial")
+    critic = Critic(model=None, role={})
+    queries = []
+    seen = set()
+    for persona_id, persona in personas.items():
+        program = {'user-input': persona_user_input(persona)}
+        requests = [("writer", writer.get_retrieval_request(program))]
+        requests += [
+            (task_type, critic.get_retrieval_request(program, task_type))
+            for task_type, task_config in critic.task_configs.items()
+            if task_config.needs_retrieval
+        ]
+        for task, request in requests:
+            if request is None or (unique and request in seen):
+                continue
+            seen.add(request)
+            query, specialized_instructions = request
+            queries.append({
+                "task": task,
+                "persona": persona_id,
+                "query": query,
+                "specialized_instructions": specialized_instructions,
+            })
+    return queries
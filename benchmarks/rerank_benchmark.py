@@ -0,0 +1,129 @@
+"""
+Compare the rerankers in rag_rerank.py on relevance, redundancy, context size and latency.
+
+    python -m benchmarks.rerank_benchmark              # project queries against data/chroma_db
+    python -m benchmarks.rerank_benchmark --synthetic  # offline, on a generated corpus with labels
+
+Both modes rerank the same candidate pool per query, so the numbers only reflect
+the reranking stage. The synthetic corpus contains near-duplicate chunks (like the
+200-character overlaps of build_db.py) and topic labels, so it also reports precision@k.
+"""
+
+import argparse
+import json
+import time
+
+import numpy as np
+from langchain_core.documents import Document
+
+from rag_rerank import LengthReranker, MMRReranker, normalize_rows
+
+
+def rerankers():
+    return [
+        LengthReranker(),
+        MMRReranker(),
+        MMRReranker(lexical_weight=0.3),
+    ]
+
+
+def synthetic_candidates(n_queries=20, n_topics=10, pool=24, dim=256, seed=0):
+    """Candidate pools over a clustered corpus; each chunk is labelled with its topic."""
+    rng = np.random.default_rng(seed)
+    topics = normalize_rows(rng.normal(size=(n_topics, dim)))
+    words = [f"term{i}" for i in range(200)]
+    candidates = []
+    for q in range(n_queries):
+        topic = q % n_topics
+        query_embedding = normalize_rows(topics[topic] + 0.3 * rng.normal(size=dim) / np.sqrt(dim))
+        documents, embeddings = [], []
+        while len(documents) < 4 * pool:
+            chunk_topic = topic if rng.random() < 0.5 else int(rng.integers(n_topics))
+            base = topics[chunk_topic] + 1.2 * rng.normal(size=dim) / np.sqrt(dim)
+            text = " ".join(rng.choice(words, size=int(rng.integers(20, 200))))
+            # Overlapping neighbours: the same passage shows up a few times, slightly shifted
+            for _ in range(int(rng.integers(1, 4))):
+                documents.append(Document(page_content=text, metadata={"topic": chunk_topic}))
+                embeddings.append(base + 0.05 * rng.normal(size=dim) / np.sqrt(dim))
+        # Ordered by similarity, like the nearest-neighbour results of the vector store
+        embeddings = normalize_rows(np.array(embeddings))
+        order = np.argsort(-(embeddings @ query_embedding))[:pool]
+        candidates.append({
+            "query": f"term{topic} " * 3,
+            "query_embedding": query_embedding,
+            "documents": [documents[i] for i in order],
+            "embeddings": embeddings[order],
+            "topic": topic,
+        })
+    return candidates
+
+
+def store_candidates(pool):
+    from benchmarks.queries import project_queries
+    from rag_retrieval import retrieval_service
+
+    queries = [item["query"] for item in project_queries()]
+    return [
+        {"query": query, "query_embedding": query_embedding, "documents": documents, "embeddings": embeddings}
+        for query, (query_embedding, documents, embeddings) in zip(
+            queries, retrieval_service.fetch_candidates(queries, pool))
+    ]
+
+
+def evaluate(reranker, candidates, k, repeats=20):
+    relevance, redundancy, sources, characters, distinct, precision, latencies = [], [], [], [], [], [], []
+    for item in candidates:
+        documents, embeddings = item["documents"], item["embeddings"]
+        start = time.perf_counter()
+        for _ in range(repeats):
+            ranked = reranker.rerank(item["query"], item["query_embedding"], documents, embeddings, k)
+        latencies.append((time.perf_counter() - start) / repeats * 1000)
+
+        index = {id(doc): i for i, doc in enumerate(documents)}
+        picked = normalize_rows(embeddings[[index[id(doc)] for doc in ranked]])
+        query = normalize_rows(item["query_embedding"])
+        relevance.append(float((picked @ query).mean()))
+        pairwise = picked @ picked.T
+        upper = pairwise[np.triu_indices(len(ranked), k=1)]
+        redundancy.append(float(upper.mean()) if upper.size else 0.0)
+        sources.append(len({json.dumps(doc.metadata, sort_keys=True) for doc in ranked}))
+        characters.append(sum(len(doc.page_content) for doc in ranked))
+        distinct.append(len({doc.page_content for doc in ranked}) / len(ranked))
+        if "topic" in item:
+            precision.append(sum(doc.metadata["topic"] == item["topic"] for doc in ranked) / len(ranked))
+
+    result = {
+        "reranker": reranker.name,
+        "k": k,
+        "mean_query_similarity": round(float(np.mean(relevance)), 4),
+        "mean_pairwise_similarity": round(float(np.mean(redundancy)), 4),
+        "distinct_sources": round(float(np.mean(sources)), 2),
+        "context_chars": round(float(np.mean(characters)), 1),
+        "distinct_passage_ratio": round(float(np.mean(distinct)), 4),
+        "latency_ms_p50": round(float(np.percentile(latencies, 50)), 4),
+        "latency_ms_p95": round(float(np.percentile(latencies, 95)), 4),
+    }
+    if precision:
+        result["precision_at_k"] = round(float(np.mean(precision)), 4)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--synthetic", action="store_true", help="use a generated corpus instead of data/chroma_db")
+    parser.add_argument("--k", type=int, nargs="+", default=[3, 5, 8])
+    parser.add_argument("--pool", type=int, default=24, help="candidates fetched per query")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    args = parser.parse_args()
+
+    candidates = synthetic_candidates(pool=args.pool) if args.synthetic else store_candidates(args.pool)
+    results = [evaluate(reranker, candidates, k) for k in args.k for reranker in rerankers()]
+    for result in results:
+        print(json.dumps(result))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"synthetic": args.synthetic, "queries": len(candidates), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""
+Retrieval benchmark over the queries the agents actually issue.
+
+    python -m benchmarks.retrieval_benchmark --output results.json
+    python -m benchmarks.retrieval_benchmark --baseline results.json
+
+Replays every Writer and Critic retrieval query, formatted against the personas in
+Data/personas/personas_vers2.json, against each retrieval backend and each
+configuration (k, reranker, packer). Reports p50/p95 latency, context tokens and
+recall@k against the labelled facets in benchmarks/fixtures/retrieval_labels.json.
+Query embeddings are warmed up first, so the latencies cover search, reranking and
+packing but not the embedding API.
+"""
+
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+from benchmarks.queries import project_queries
+from rag_packing import ContextPacker, PassthroughPacker, estimate_tokens
+from rag_rerank import get_reranker
+from rag_retrieval import RetrievalService, VECTOR_INDEX_DIRECTORY
+
+LABELS_PATH = os.path.join(os.path.dirname(__file__), "fixtures", "retrieval_labels.json")
+
+PACKERS = {
+    "none": PassthroughPacker,
+    "budget_2000": lambda: ContextPacker(token_budget=2000),
+    "budget_1000": lambda: ContextPacker(token_budget=1000),
+}
+
+
+def load_labels(path=LABELS_PATH):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)["tasks"]
+
+
+def facet_recall(context, facets):
+    """Fraction of the labelled facets mentioned anywhere in the context."""
+    if not facets:
+        return None
+    text = context.lower()
+    return sum(any(phrase in text for phrase in facet) for facet in facets) / len(facets)
+
+
+def percentile(values, q):
+    return round(float(np.percentile(values, q)), 3) if values else None
+
+
+def run_configuration(service, queries, labels, k, reranker_name, packer_name):
+    reranker = get_reranker(reranker_name)
+    packer = PACKERS[packer_name]()
+    latencies, tokens, recalls = [], [], []
+    for item in queries:
+        start = time.perf_counter()
+        context, _, _ = service.retrieve_context_many([item["query"]], k=k, reranker=reranker, packer=packer)[0]
+        latencies.append((time.perf_counter() - start) * 1000)
+        tokens.append(estimate_tokens(context))
+        recall = facet_recall(context, labels.get(item["task"]))
+        if recall is not None:
+            recalls.append(recall)
+
+    start = time.perf_counter()
+    service.retrieve_context_many([item["query"] for item in queries], k=k, reranker=reranker, packer=packer)
+    batched_ms = (time.perf_counter() - start) * 1000
+
+    return {
+        "backend": service.backend,
+        "k": k,
+        "reranker": reranker_name,
+        "packer": packer_name,
+        "latency_ms_p50": percentile(latencies, 50),
+        "latency_ms_p95": percentile(latencies, 95),
+        "batched_ms_per_query": round(batched_ms / len(queries), 3),
+        "context_tokens_mean": round(float(np.mean(tokens)), 1),
+        "context_tokens_max": int(max(tokens)),
+        "recall_at_k": round(float(np.mean(recalls)), 4) if recalls else None,
+    }
+
+
+def configuration_key(result):
+    return (result["backend"], result["k"], result["reranker"], result["packer"])
+
+
+def compare(results, baseline_path):
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {configuration_key(result): result for result in json.load(f)["results"]}
+    print("\nChanges against", baseline_path)
+    for result in results:
+        previous = baseline.get(configuration_key(result))
+        if previous is None:
+            continue
+        deltas = []
+        for metric in ("latency_ms_p95", "context_tokens_mean", "recall_at_k"):
+            if result[metric] is not None and previous.get(metric) is not None:
+                deltas.append(f"{metric} {previous[metric]} -> {result[metric]}")
+        print(" ", configuration_key(result), "; ".join(deltas))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    default_backends = ["chroma"] + (["vector_index"] if os.path.isdir(VECTOR_INDEX_DIRECTORY) else [])
+    parser.add_argument("--backends", nargs="+", default=default_backends, choices=["chroma", "vector_index"])
+    parser.add_argument("--k", type=int, nargs="+", default=[3, 5, 8])
+    parser.add_argument("--rerankers", nargs="+", default=["length", "mmr", "hybrid"])
+    parser.add_argument("--packers", nargs="+", default=list(PACKERS), choices=list(PACKERS))
+    parser.add_argument("--unique", action="store_true", help="skip queries that repeat across personas")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="earlier --output file to compare against")
+    args = parser.parse_args()
+
+    queries = project_queries(unique=args.unique)
+    labels = load_labels()
+    print(f"Replaying {len(queries)} queries on {', '.join(args.backends)}")
+
+    results = []
+    for backend in args.backends:
+        service = RetrievalService(backend=backend).warm()
+        service.embedding_model.embed_queries([item["query"] for item in queries])
+        for k in args.k:
+            for reranker_name in args.rerankers:
+                for packer_name in args.packers:
+                    result = run_configuration(service, queries, labels, k, reranker_name, packer_name)
+                    results.append(result)
+                    print(json.dumps(result))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"created_at": time.time(), "queries": len(queries), "results": results}, f, indent=2)
+    if args.baseline:
+        compare(results, args.baseline)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,61 +1,306 @@
+import argparse
+import gc
 import os
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_community.vectorstores import Chroma
 from agent_system.setup_api import setup_embeddings
-from pypdf import PdfReader
+from build_profile import BuildProfiler, print_report
+from rag_cache import write_index_version
+from chunking import get_chunker
+from embedding_stage import EmbeddingStage, FakeEmbeddings
+from index_versions import IndexVersions
+from ingestion import IngestManifest, iter_batches, iter_pages, list_pdfs, with_chunk_ids
+from vector_index import VectorIndex
+
+PERSIST_DIRECTORY = os.path.join("data", "chroma_db")
+VECTOR_INDEX_DIRECTORY = os.path.join("data", "vector_index")
+COLLECTION_NAME = "strength_training_books"
+EMBEDDING_MODEL = "models/text-embedding-004"
+EMBEDDING_CHECKPOINT_FILE = "embedding_checkpoint.txt"
+BUILD_REPORT_FILE = "build_report.json"
+
+
+def export_vector_index(collection, directory, dtype="float32", dimensions=None, rescore=False, keep_versions=3):
+    """
+    Export a Chroma collection to the in-process VectorIndex format used by rag_retrieval,
+    as a new version under directory that is promoted once it is complete.
+    dimensions truncates the vectors and dtype sets their storage (float32, float16 or int8);
+    with rescore the full-width vectors are kept to rescore the top candidates.
+    """
+    data = collection.get(include=["embeddings", "documents", "metadatas"])
+    index = VectorIndex.build(
+        data["embeddings"],
+        data["documents"],
+        data["metadatas"],
+        dtype=dtype,
+        collection_name=collection.name,
+        dimensions=dimensions,
+        keep_full=rescore,
+    )
+    versions = IndexVersions(directory)
+    version_directory, version = versions.stage(copy_current=False)
+    index.save(version_directory)
+    write_index_version(version_directory, version)
+    versions.promote(version)
+    versions.prune(keep_versions)
+    print(f"Exported {len(index)} vectors ({dtype}, {index.dimensions} dimensions, "
+          f"{index.nbytes() / 1e6:.1f} MB{', rescored at full precision' if index.full_embeddings is not None else ''}) "
+          f"to {directory} (version {version})")
+    return index
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Build the strength training knowledge base from Data/books.")
+    parser.add_argument("--export-vector-index", action="store_true",
+                        help="also export the collection to the NumPy vector index (RAG_BACKEND=vector_index)")
+    parser.add_argument("--export-only", action="store_true",
+                        help="skip the build and only export the existing Chroma collection")
+    parser.add_argument("--vector-index-dir", default=None,
+                        help=f"export directory (default: {VECTOR_INDEX_DIRECTORY}, or {VECTOR_INDEX_DIRECTORY}_fake with --fake-embeddings)")
+    parser.add_argument("--vector-index-dtype", choices=["float32", "float16", "int8"], default="float32",
+                        help="storage type of the exported vectors")
+    parser.add_argument("--vector-index-dimensions", type=int, default=None,
+                        help="keep only the first N dimensions of every vector (default: all)")
+    parser.add_argument("--vector-index-rescore", action="store_true",
+                        help="also keep the full float32 vectors to rescore the top candidates")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="processes extracting PDF pages (default: one per CPU)")
+    parser.add_argument("--pages-per-task", type=int, default=16,
+                        help="pages a worker extracts at a time; bounds the memory per worker")
+    parser.add_argument("--embed-batch-size", type=int, default=100,
+                        help="chunks embedded and written to Chroma per batch")
+    parser.add_argument("--chunker", choices=["structured", "recursive"], default="structured",
+                        help="structured: token-based, follows pages and headings; recursive: the original 1000-character splitter")
+    parser.add_argument("--chunk-tokens", type=int, default=256, help="maximum tokens per structured chunk")
+    parser.add_argument("--chunk-overlap-tokens", type=int, default=32,
+                        help="tokens of trailing sentences repeated in the next structured chunk")
+    parser.add_argument("--full-rebuild", action="store_true",
+                        help="discard the stored vectors and embed every document again")
+    parser.add_argument("--embed-concurrency", type=int, default=4,
+                        help="embedding requests in flight at the same time")
+    parser.add_argument("--embed-qps", type=float, default=None,
+                        help="maximum embedding requests per second (default: no limit)")
+    parser.add_argument("--fake-embeddings", action="store_true",
+                        help="embed with a deterministic local fake, to test the build offline")
+    parser.add_argument("--persist-directory", default=None,
+                        help=f"Chroma directory (default: {PERSIST_DIRECTORY}, or {PERSIST_DIRECTORY}_fake with --fake-embeddings)")
+    parser.add_argument("--keep-versions", type=int, default=3,
+                        help="finished index versions kept on disk, including the live one")
+    parser.add_argument("--report", default=None,
+                        help=f"where to write the JSON build report (default: {BUILD_REPORT_FILE} in the Chroma directory)")
+    parser.add_argument("--profile-dir", default=None,
+                        help="also write a cProfile dump per build stage (<stage>.prof) to this directory")
+    args = parser.parse_args()
+    # Like the Chroma directory: fake vectors are never exported into the index the app serves
+    if args.vector_index_dir is None:
+        args.vector_index_dir = VECTOR_INDEX_DIRECTORY + "_fake" if args.fake_embeddings else VECTOR_INDEX_DIRECTORY
+    return args
+
+
+def export_args(args):
+    return {
+        "dtype": args.vector_index_dtype,
+        "dimensions": args.vector_index_dimensions,
+        "rescore": args.vector_index_rescore,
+        "keep_versions": args.keep_versions,
+    }
+
+
+def open_collection(directory):
+    return Chroma(persist_directory=directory, collection_name=COLLECTION_NAME)._collection
+
+
+def close_collection(collection):
+    """Release the Chroma client of collection (and its SQLite handles), so its directory can be deleted."""
+    close = getattr(collection._client, "close", None)
+    if close is not None:  # chromadb < 1.1 has no close(); its clients are released once unreferenced
+        close()
+    gc.collect()
+
+
+def delete_ids(collection, ids, batch_size=1000):
+    for batch in iter_batches(ids, batch_size):
+        collection.delete(ids=batch)
 
 
 def main():
+    args = parse_args()
+    # Fake vectors never end up in the real store unless asked for explicitly
+    persist_directory = args.persist_directory or (PERSIST_DIRECTORY + "_fake" if args.fake_embeddings else PERSIST_DIRECTORY)
+    profiler = BuildProfiler(args.profile_dir)
+    outcome = "failed"
+    try:
+        outcome = build(args, persist_directory, profiler)
+    finally:
+        report_path = args.report or os.path.join(persist_directory, BUILD_REPORT_FILE)
+        report = profiler.save(report_path, outcome=outcome, index_version=IndexVersions(persist_directory).current()[1])
+        print_report(report)
+        print(f"Build report written to {report_path}")
+
+
+def build(args, persist_directory, profiler):
+    """Run one build; returns its outcome for the build report."""
+    versions = IndexVersions(persist_directory)
+    current_directory, current_version = versions.current()
+
+    def export(collection):
+        with profiler.stage("export"):
+            export_vector_index(collection, args.vector_index_dir, **export_args(args))
+        profiler.count("export", exported=collection.count())
+
+    if args.export_only:
+        export(open_collection(current_directory))
+        return "exported"
+
     path = os.path.join("Data", "books")
     if not os.path.exists(path):
         print(f"Directory '{path}' not found. Please create it and add PDF files.")
-        return
-        
-    documents = []
-    for filename in os.listdir(path):
-        if filename.endswith(".pdf"):
-            file_path = os.path.join(path, filename)
-            try:
-                pdf = PdfReader(file_path)
-                text = ""
-                for page in pdf.pages:
-                    text += page.extract_text() or ""
-                documents.append({"text": text, "metadata": {"source": filename}})
-                print(f"Successfully processed: {filename}")
-            except FileNotFoundError:
-                print(f"File not found: {file_path}")
-            except Exception as e:
-                print(f"Error processing {filename}: {str(e)}")
-    
-    if not documents:
+        return "no documents"
+
+    paths = list_pdfs(path)
+    if not paths:
         print("No documents found or processed in data/books folder.")
-        return
-    
-    print(f"Processing {len(documents)} documents...")
-    
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=1000,
-        chunk_overlap=200,
-        length_function=len,
-    )
-    chunks = []
-    for doc in documents:
-        for chunk in text_splitter.split_text(doc["text"]):
-            chunks.append({"text": chunk, "metadata": doc["metadata"]})
-    
-    print(f"Created {len(chunks)} text chunks")
-    
-    embedding_model = setup_embeddings(model="models/text-embedding-004")
-    texts = [c["text"] for c in chunks]
-    metadatas = [c["metadata"] for c in chunks]
-    vector_store = Chroma.from_texts(
-        texts=texts,
-        embedding=embedding_model,
-        metadatas=metadatas,
-        persist_directory="data/chroma_db",
-        collection_name="strength_training_books"
-    )
-    print("Chroma DB created with collection name: strength_training_books")
+        return "no documents"
+
+    # Chunks are only reusable if they were made and embedded the same way
+    if args.chunker == "structured":
+        chunker = get_chunker("structured", max_tokens=args.chunk_tokens, overlap_tokens=args.chunk_overlap_tokens)
+    else:
+        chunker = get_chunker("recursive")
+    settings = dict(chunker.settings, embedding_model="fake" if args.fake_embeddings else EMBEDDING_MODEL)
+    manifest = IngestManifest.load(current_directory)
+    full_rebuild = manifest is None or manifest.settings != settings or args.full_rebuild
+    if full_rebuild:
+        manifest = IngestManifest(settings=settings)
+
+    with profiler.stage("plan"):
+        changed, unchanged, removed = manifest.plan(paths)
+    profiler.count("plan", documents=len(paths))
+    print(f"{len(changed)} new or changed, {len(unchanged)} unchanged and {len(removed)} removed documents")
+    if not full_rebuild and not changed and not removed:
+        # Keep the index version, so the RAG answer caches stay valid
+        print(f"Knowledge base is up to date (version {current_version}).")
+        if args.export_vector_index:
+            export(open_collection(current_directory))
+        return "up to date"
+
+    # The build goes into a new version (a copy of the live one, or empty for a full
+    # rebuild); the live version keeps serving until the new one is promoted
+    with profiler.stage("copy"):
+        build_directory, version = versions.stage(copy_current=not full_rebuild)
+    print(f"Building index version {version} in {build_directory}")
+    if full_rebuild:
+        print("Rebuilding from scratch")
+    collection = open_collection(build_directory)
+
+    deleted_count = 0
+    for name in removed:
+        removed_ids = manifest.documents.pop(name)["chunk_ids"]
+        with profiler.stage("write"):
+            delete_ids(collection, removed_ids)
+        profiler.count("write", deleted=len(removed_ids))
+        deleted_count += len(removed_ids)
+        print(f"Removed {name}")
+
+    if changed:
+        print(f"Processing {len(changed)} documents with {args.workers or os.cpu_count()} workers...")
+
+    # Chunks of a changed document that are already stored keep their vectors
+    stored_ids = {
+        chunk_id
+        for changed_path in changed
+        for chunk_id in manifest.documents.get(os.path.basename(changed_path), {}).get("chunk_ids", [])
+    }
+    chunk_ids = {}
+
+    def new_chunks():
+        profiler.count("extract", bytes_in=sum(os.path.getsize(changed_path) for changed_path in changed))
+        pages = profiler.iterate(
+            "extract", iter_pages(changed, workers=args.workers, pages_per_task=args.pages_per_task),
+            "pages", size=lambda page: len(page[2].encode("utf-8")),
+        )
+        chunks = profiler.iterate(
+            "chunk", with_chunk_ids(chunker.iter_chunks(pages)),
+            "chunks", size=lambda chunk: len(chunk["text"].encode("utf-8")),
+        )
+        for chunk in chunks:
+            chunk_ids.setdefault(chunk["metadata"]["source"], []).append(chunk["id"])
+            if chunk["id"] not in stored_ids:
+                yield chunk
+
+    def write_batch(batch, embeddings):
+        with profiler.stage("write"):
+            collection.upsert(
+                ids=[c["id"] for c in batch],
+                embeddings=embeddings,
+                documents=[c["text"] for c in batch],
+                metadatas=[c["metadata"] for c in batch],
+            )
+        profiler.count(
+            "write",
+            vectors=len(batch),
+            bytes_out=sum(4 * len(embedding) for embedding in embeddings) + sum(len(c["text"].encode("utf-8")) for c in batch),
+        )
+
+    chunk_count = 0
+    if changed:
+        if args.fake_embeddings:
+            embedding_model = FakeEmbeddings()
+        else:
+            embedding_model = setup_embeddings(model=EMBEDDING_MODEL, probe=False)
+        stage = EmbeddingStage(
+            embedding_model,
+            batch_size=args.embed_batch_size,
+            max_concurrency=args.embed_concurrency,
+            qps=args.embed_qps,
+            checkpoint_path=os.path.join(build_directory, EMBEDDING_CHECKPOINT_FILE),
+            settings=settings,
+        )
+        with profiler.stage("embed"):
+            report = stage.run(new_chunks(), write_batch)
+        profiler.count("embed", embeddings=report["chunks"], requests=report["batches"], retries=report["retries"])
+        # Chunks resumed from the checkpoint were written to this version by the interrupted run
+        chunk_count = report["chunks"] + report["resumed"]
+        print(f"Embedding: {report['chunks']} chunks in {report['batches']} batches, {report['seconds']:.1f}s "
+              f"({report['chunks_per_second']:.1f} chunks/s), {report['resumed']} resumed from the checkpoint, "
+              f"{report['retries']} retries")
+
+    for changed_path in changed:
+        name = os.path.basename(changed_path)
+        if name not in chunk_ids:
+            # Nothing could be extracted; keep whatever an earlier build stored
+            continue
+        previous_ids = manifest.documents.get(name, {}).get("chunk_ids", [])
+        stale_ids = sorted(set(previous_ids) - set(chunk_ids[name]))
+        with profiler.stage("write"):
+            delete_ids(collection, stale_ids)
+        profiler.count("write", deleted=len(stale_ids))
+        deleted_count += len(stale_ids)
+        manifest.record(changed_path, chunk_ids[name])
+    manifest.save(build_directory)
+
+    print(f"Embedded {chunk_count} new and deleted {deleted_count} old text chunks, "
+          f"the collection holds {collection.count()} chunks")
+    if not chunk_count and not deleted_count and not full_rebuild:
+        # Keep the index version, so the RAG answer caches stay valid
+        close_collection(collection)
+        del collection
+        versions.discard(version)
+        # The live version gets the new hashes and mtimes, so the documents are not extracted again
+        if changed:
+            manifest.save(current_directory)
+        print(f"Knowledge base is up to date (version {current_version}).")
+        collection = open_collection(current_directory)
+        outcome = "up to date"
+    else:
+        write_index_version(build_directory, version)
+        versions.promote(version)
+        versions.prune(args.keep_versions)
+        print(f"Chroma DB updated with collection name: {COLLECTION_NAME}")
+        print(f"Index version: {version} (cached RAG answers from earlier builds are invalidated)")
+        outcome = "promoted"
+    if args.export_vector_index:
+        export(collection)
+    return outcome
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,79 @@
+import argparse
+
+from agent_system.agents import Critic, Writer
+from knowledge_pack import (
+    DAYS_PER_WEEK,
+    DEFAULT_PACK_PATH,
+    EXPERIENCE_LEVELS,
+    GOALS,
+    KnowledgePack,
+    enumerate_profiles,
+    profile_user_input,
+)
+from rag_retrieval import retrieval_service
+
+
+def pack_requests(profiles):
+    """
+    Every distinct retrieval request of the Writer and the Critic tasks over the profiles,
+    as (task, profile, query, specialized_instructions). Requests that do not depend on
+    the user input (rep_ranges, rpe, progression) are listed once, without a profile.
+    """
+    writer = Writer(model=None, role={}, structure="", task="", writer_type="initial")
+    critic = Critic(model=None, role={})
+    builders = [("writer", writer.get_retrieval_request)] + [
+        (task_type, lambda program, task_type=task_type: critic.get_retrieval_request(program, task_type))
+        for task_type, task_config in critic.task_configs.items()
+        if task_config.needs_retrieval
+    ]
+    requests = {}
+    for task, build_request in builders:
+        for profile in profiles:
+            request = build_request({'user-input': profile_user_input(profile)})
+            if request is None or request in requests:
+                continue
+            independent = request == build_request({'user-input': ''})
+            requests[request] = (task, None if independent else profile)
+    return [(task, profile, query, instructions) for (query, instructions), (task, profile) in requests.items()]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Precompute the RAG answers of the Writer and Critic into a knowledge pack.")
+    parser.add_argument("--output", default=DEFAULT_PACK_PATH)
+    parser.add_argument("--experience", nargs="+", default=list(EXPERIENCE_LEVELS), choices=EXPERIENCE_LEVELS)
+    parser.add_argument("--goals", nargs="+", default=list(GOALS), choices=GOALS)
+    parser.add_argument("--days", type=int, nargs="+", default=list(DAYS_PER_WEEK), choices=DAYS_PER_WEEK)
+    parser.add_argument("--batch-size", type=int, default=8, help="requests retrieved and generated together")
+    parser.add_argument("--dry-run", action="store_true", help="only list the requests that would be generated")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    profiles = enumerate_profiles(args.experience, args.goals, args.days)
+    requests = pack_requests(profiles)
+    print(f"{len(profiles)} profiles, {len(requests)} distinct retrieval requests")
+    if args.dry_run:
+        for task, profile, query, _ in requests:
+            print(f"  {task}: {profile or 'any profile'}")
+        return
+
+    retrieval_service.warm()
+    pack = KnowledgePack.create(
+        index_fingerprint=retrieval_service.index_fingerprint(),
+        pipeline=retrieval_service.pipeline_signature(),
+        dimensions={"experience": args.experience, "goals": args.goals, "days_per_week": args.days},
+    )
+    for start in range(0, len(requests), args.batch_size):
+        batch = requests[start:start + args.batch_size]
+        results = retrieval_service.retrieve_and_generate_many([(query, instructions) for _, _, query, instructions in batch])
+        for (task, profile, query, instructions), (answer, sources) in zip(batch, results):
+            pack.add(task, profile, query, instructions, answer, sources)
+        print(f"Generated {min(start + args.batch_size, len(requests))}/{len(requests)} answers")
+
+    pack.save(args.output)
+    print(f"Knowledge pack {pack.version} with {len(pack.entries)} answers written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+import cProfile
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process and of its finished child processes (the PDF workers), in MB."""
+    if resource is None:
+        return {"self": None, "workers": None}
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    unit = 1 if sys.platform == "darwin" else 1024
+    return {
+        "self": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * unit / 1e6, 1),
+        "workers": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * unit / 1e6, 1),
+    }
+
+
+# Counters reported as a rate (per second of their stage, and per second of the whole build)
+RATE_COUNTERS = ("pages", "chunks", "embeddings", "vectors")
+
+
+class BuildProfiler:
+    """
+    Stage timers and counters for build_db.py.
+    The build is a stream (pages -> chunks -> embeddings -> Chroma writes), so the
+    stages interleave. Time is attributed exclusively: while a stage pulls from an
+    inner stage (the chunker asking for the next page), the clock of the outer stage
+    is paused. Stages are timed on the main thread; extraction runs in worker
+    processes and is measured as the time spent waiting for their pages, and the
+    embedding stage as the time spent waiting for the embedding requests.
+    With profile_directory set, every stage also gets its own cProfile dump.
+    """
+
+    def __init__(self, profile_directory=None):
+        self.profile_directory = profile_directory
+        self.stages = {}
+        self._stack = []
+        self._started = None
+        self._profiles = {}
+        self._lock = threading.Lock()
+        self._start = time.perf_counter()
+
+    def _stage(self, name):
+        return self.stages.setdefault(name, {"seconds": 0.0})
+
+    def _profile(self, name):
+        if self.profile_directory is None:
+            return None
+        if name not in self._profiles:
+            self._profiles[name] = cProfile.Profile()
+        return self._profiles[name]
+
+    def _pause(self, now):
+        name = self._stack[-1]
+        self._stage(name)["seconds"] += now - self._started
+        if self._profile(name):
+            self._profile(name).disable()
+
+    def _resume(self, now):
+        self._started = now
+        if self._profile(self._stack[-1]):
+            self._profile(self._stack[-1]).enable()
+
+    @contextmanager
+    def stage(self, name):
+        now = time.perf_counter()
+        if self._stack:
+            self._pause(now)
+        self._stack.append(name)
+        self._resume(now)
+        try:
+            yield
+        finally:
+            now = time.perf_counter()
+            self._pause(now)
+            self._stack.pop()
+            if self._stack:
+                self._resume(now)
+
+    def count(self, name, **counters):
+        with self._lock:
+            stage = self._stage(name)
+            for counter, value in counters.items():
+                stage[counter] = stage.get(counter, 0) + value
+
+    def iterate(self, name, items, counter, size=None):
+        """Yield from items, timing every step under stage name and counting the items (and their bytes)."""
+        items = iter(items)
+        while True:
+            with self.stage(name):
+                try:
+                    item = next(items)
+                except StopIteration:
+                    return
+            self.count(name, **{counter: 1})
+            if size is not None:
+                self.count(name, bytes_out=size(item))
+            yield item
+
+    def report(self, **extra):
+        """The stage timings, counters and rates as a JSON-serialisable dict."""
+        total = time.perf_counter() - self._start
+        stages = {}
+        throughput = {}
+        for name, stage in self.stages.items():
+            stage = dict(stage, seconds=round(stage["seconds"], 3))
+            for counter, value in list(stage.items()):
+                if counter not in RATE_COUNTERS:
+                    continue
+                stage[f"{counter}_per_second"] = round(value / stage["seconds"], 1) if stage["seconds"] else None
+                throughput[f"{counter}_per_second"] = round(value / total, 1) if total else None
+            stages[name] = stage
+        return dict(
+            extra,
+            total_seconds=round(total, 3),
+            # Wall time outside every stage (setup, manifest bookkeeping, printing)
+            other_seconds=round(total - sum(stage["seconds"] for stage in self.stages.values()), 3),
+            peak_rss_mb=peak_rss_mb(),
+            stages=stages,
+            throughput=throughput,
+        )
+
+    def save(self, path, **extra):
+        report = self.report(**extra)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        if self.profile_directory is not None:
+            os.makedirs(self.profile_directory, exist_ok=True)
+            for name, profile in self._profiles.items():
+                profile.dump_stats(os.path.join(self.profile_directory, f"{name}.prof"))
+            print(f"cProfile dumps per stage written to {self.profile_directory}")
+        return report
+
+
+def print_report(report):
+    print(f"Build took {report['total_seconds']:.1f}s, peak RSS {report['peak_rss_mb']['self']} MB "
+          f"(PDF workers {report['peak_rss_mb']['workers']} MB)")
+    for name, stage in report["stages"].items():
+        counters = ", ".join(f"{key} {value}" for key, value in stage.items() if key != "seconds")
+        print(f"  {name:<8} {stage['seconds']:>8.2f}s  {counters}")
@@ -0,0 +1,177 @@
+import os
+import re
+
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+from ingestion import iter_chunks
+from rag_packing import estimate_tokens
+
+SENTENCE_PATTERN = re.compile(r"(?<=[.!?])\s+(?=[A-Z0-9\"'(])")
+NUMBERED_HEADING = re.compile(r"^(chapter|part|section)\s+\w+|^\d+(\.\d+)*\.?\s+[A-Z]", re.IGNORECASE)
+
+
+def is_heading(line):
+    """Short lines that look like chapter or section titles: numbered, ALL CAPS or Title Case without a full stop."""
+    line = line.strip()
+    if not line or len(line) > 80 or line.endswith((".", ",", ";", ":")) or not any(c.isalpha() for c in line):
+        return False
+    if NUMBERED_HEADING.match(line):
+        return True
+    words = re.findall(r"[A-Za-z][A-Za-z'-]*", line)
+    if not words or len(words) > 10:
+        return False
+    if line.isupper():
+        return True
+    minor = {"a", "an", "and", "as", "at", "for", "in", "of", "on", "or", "the", "to", "vs", "with"}
+    return len(words) >= 2 and all(word[0].isupper() or word in minor for word in words)
+
+
+def page_blocks(text):
+    """Split page text into ("heading", line) and ("text", paragraph) blocks."""
+    blocks, paragraph = [], []
+    for line in text.splitlines():
+        if is_heading(line):
+            if paragraph:
+                blocks.append(("text", " ".join(paragraph)))
+                paragraph = []
+            blocks.append(("heading", line.strip()))
+        elif line.strip():
+            paragraph.append(line.strip())
+        elif paragraph:
+            blocks.append(("text", " ".join(paragraph)))
+            paragraph = []
+    if paragraph:
+        blocks.append(("text", " ".join(paragraph)))
+    return blocks
+
+
+class StructuredChunker:
+    """
+    Token-budgeted chunker that follows the structure of the books.
+      * Chunks hold at most max_tokens tokens (estimate_tokens, as in the prompt packer),
+        built from whole paragraphs, or whole sentences of a long paragraph.
+      * A heading always starts a new chunk, and the heading is kept in the metadata.
+      * A page break ends the chunk, unless it is still below min_tokens (a sentence
+        running over the page), so page numbers in the metadata are exact.
+      * Consecutive chunks of a section share up to overlap_tokens of trailing sentences.
+    Chunk metadata: source, page (first page), page_end and section.
+    """
+
+    name = "structured"
+
+    def __init__(self, max_tokens=256, overlap_tokens=32, min_tokens=48, respect_pages=True):
+        self.max_tokens = max_tokens
+        self.overlap_tokens = overlap_tokens
+        self.min_tokens = min_tokens
+        self.respect_pages = respect_pages
+
+    @property
+    def settings(self):
+        return {
+            "chunker": self.name,
+            "max_tokens": self.max_tokens,
+            "overlap_tokens": self.overlap_tokens,
+            "min_tokens": self.min_tokens,
+            "respect_pages": self.respect_pages,
+        }
+
+    def units(self, paragraph):
+        """The paragraph itself if it fits, else its sentences (hard-split if a sentence is too long)."""
+        if estimate_tokens(paragraph) <= self.max_tokens:
+            return [paragraph]
+        units = []
+        for sentence in SENTENCE_PATTERN.split(paragraph):
+            while estimate_tokens(sentence) > self.max_tokens:
+                cut = sentence.rfind(" ", 0, self.max_tokens * 4)
+                cut = cut if cut > 0 else self.max_tokens * 4
+                units.append(sentence[:cut])
+                sentence = sentence[cut:].strip()
+            if sentence:
+                units.append(sentence)
+        return units
+
+    def iter_chunks(self, pages):
+        """Chunk a stream of (path, page_number, text) pages; yields {"text", "metadata"} dicts."""
+        path, section = None, ""
+        units = []  # (text, page_number, tokens)
+        fresh = 0  # units not carried over from the previous chunk as overlap
+
+        def make_chunk():
+            return {
+                "text": "\n".join(unit[0] for unit in units),
+                "metadata": {
+                    "source": os.path.basename(path),
+                    "page": units[0][1],
+                    "page_end": units[-1][1],
+                    "section": section,
+                },
+            }
+
+        def total_tokens():
+            return sum(unit[2] for unit in units)
+
+        def overlap():
+            kept, tokens = [], 0
+            for unit in reversed(units):
+                if tokens + unit[2] > self.overlap_tokens:
+                    break
+                kept.insert(0, unit)
+                tokens += unit[2]
+            return kept
+
+        for page_path, page_number, text in pages:
+            if page_path != path:
+                if fresh:
+                    yield make_chunk()
+                path, section, units, fresh = page_path, "", [], 0
+            elif self.respect_pages and (not fresh or total_tokens() >= self.min_tokens):
+                if fresh:
+                    yield make_chunk()
+                units, fresh = [], 0
+            for kind, block in page_blocks(text):
+                if kind == "heading":
+                    if fresh:
+                        yield make_chunk()
+                    section, units, fresh = block, [], 0
+                    continue
+                for text_unit in self.units(block):
+                    tokens = estimate_tokens(text_unit)
+                    if fresh and total_tokens() + tokens > self.max_tokens:
+                        yield make_chunk()
+                        units, fresh = overlap(), 0
+                        while units and total_tokens() + tokens > self.max_tokens:
+                            units.pop(0)
+                    units.append((text_unit, page_number, tokens))
+                    fresh += 1
+        if fresh:
+            yield make_chunk()
+
+
+class RecursiveChunker:
+    """The original character-based splitter (chunk_size characters), streamed with iter_chunks."""
+
+    name = "recursive"
+
+    def __init__(self, chunk_size=1000, chunk_overlap=200):
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.text_splitter = RecursiveCharacterTextSplitter(
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            length_function=len,
+        )
+
+    @property
+    def settings(self):
+        return {"chunker": self.name, "chunk_size": self.chunk_size, "chunk_overlap": self.chunk_overlap}
+
+    def iter_chunks(self, pages):
+        return iter_chunks(pages, self.text_splitter)
+
+
+def get_chunker(name="structured", **kwargs):
+    if name == "structured":
+        return StructuredChunker(**kwargs)
+    if name == "recursive":
+        return RecursiveChunker(**kwargs)
+    raise ValueError(f"Unknown chunker '{name}', expected 'structured' or 'recursive'")
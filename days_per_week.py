@@ -0,0 +1,16 @@
+import re
+
+NUMBER_WORDS = {"one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6, "seven": 7}
+DAYS_PATTERN = re.compile(
+    r"\b(\d|one|two|three|four|five|six|seven)\s*(?:x|days?|sessions?|times|workouts?)\s*(?:a|per|each|/|every)\s*week",
+    re.IGNORECASE,
+)
+
+
+def requested_days(text):
+    """The training days per week asked for in a free-text request ("3 days a week"), or None."""
+    days_match = DAYS_PATTERN.search(text)
+    if days_match is None:
+        return None
+    days = days_match.group(1).lower()
+    return NUMBER_WORDS.get(days) or int(days)
@@ -0,0 +1,149 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from agent_system.call_governor import RETRYABLE_ERRORS
+from agent_system.fake_embeddings import FakeEmbeddings  # re-exported for build_db and the benchmarks
+from ingestion import iter_batches
+
+
+class RateLimiter:
+    """Spaces calls at least 1/qps seconds apart across threads (no limit if qps is None)."""
+
+    def __init__(self, qps=None):
+        self.interval = 1.0 / qps if qps else 0.0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+class EmbeddingCheckpoint:
+    """
+    Ids of the chunks whose vectors are already written, appended to a file after every
+    batch. A build that fails halfway resumes from here instead of embedding everything
+    again. The first line records the settings; a checkpoint for other settings is ignored.
+    """
+
+    def __init__(self, path, settings):
+        self.path = path
+        self.settings = settings
+        self.done = set()
+        if path and os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                header = f.readline()
+                if header and json.loads(header) == settings:
+                    self.done = {line.strip() for line in f if line.strip()}
+        self._file = None
+
+    def record(self, ids):
+        if not self.path:
+            return
+        if self._file is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            resume = bool(self.done)
+            self._file = open(self.path, "a" if resume else "w", encoding="utf-8")
+            if not resume:
+                self._file.write(json.dumps(self.settings) + "\n")
+        self._file.write("".join(f"{chunk_id}\n" for chunk_id in ids))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self.done.update(ids)
+
+    def close(self, completed):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if completed and self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def is_retryable(error):
+    """Quota, overload and timeout errors, also when an embedding client wraps them in its own error."""
+    return isinstance(error, RETRYABLE_ERRORS) or isinstance(error.__cause__, RETRYABLE_ERRORS)
+
+
+class EmbeddingStage:
+    """
+    Embeds chunks in fixed-size batches with at most max_concurrency requests in flight
+    and at most qps requests per second. Failed requests (quota, timeouts) are retried
+    with exponential backoff; other errors are raised at once. Batches are written in order through write_batch and then
+    checkpointed, so an interrupted run can be resumed with the same checkpoint_path.
+    """
+
+    def __init__(self, embedding_model, batch_size=100, max_concurrency=4, qps=None,
+                 checkpoint_path=None, settings=None, max_retries=5, retry_delay=2.0):
+        self.embedding_model = embedding_model
+        self.batch_size = batch_size
+        self.max_concurrency = max(1, max_concurrency)
+        self.rate_limiter = RateLimiter(qps)
+        self.checkpoint = EmbeddingCheckpoint(checkpoint_path, settings or {})
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.stats = {"chunks": 0, "batches": 0, "resumed": 0, "retries": 0, "seconds": 0.0}
+        self._stats_lock = threading.Lock()
+
+    def embed_batch(self, texts):
+        delay = self.retry_delay
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.wait()
+            try:
+                return self.embedding_model.embed_documents(texts)
+            except Exception as e:
+                if not is_retryable(e) or attempt == self.max_retries:
+                    raise
+                print(f"Embedding request failed ({e}), retrying in {delay:.1f}s")
+                with self._stats_lock:
+                    self.stats["retries"] += 1
+                time.sleep(delay)
+                delay *= 2
+
+    def run(self, chunks, write_batch):
+        """Embed chunks ({"id", "text", "metadata"} dicts) and call write_batch(batch, embeddings) per batch."""
+        start = time.perf_counter()
+        completed = False
+
+        def pending_chunks():
+            for chunk in chunks:
+                if chunk["id"] in self.checkpoint.done:
+                    self.stats["resumed"] += 1
+                else:
+                    yield chunk
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="embed") as executor:
+                in_flight = deque()
+                for batch in iter_batches(pending_chunks(), self.batch_size):
+                    in_flight.append((batch, executor.submit(self.embed_batch, [c["text"] for c in batch])))
+                    if len(in_flight) >= self.max_concurrency:
+                        self._write(*in_flight.popleft(), write_batch, start)
+                while in_flight:
+                    self._write(*in_flight.popleft(), write_batch, start)
+            completed = True
+        finally:
+            self.stats["seconds"] = time.perf_counter() - start
+            self.checkpoint.close(completed)
+        return self.report()
+
+    def _write(self, batch, future, write_batch, start):
+        write_batch(batch, future.result())
+        self.checkpoint.record([c["id"] for c in batch])
+        self.stats["chunks"] += len(batch)
+        self.stats["batches"] += 1
+        elapsed = time.perf_counter() - start
+        print(f"Embedded {self.stats['chunks']} chunks ({self.stats['chunks'] / elapsed:.1f} chunks/s)")
+
+    def report(self):
+        seconds = self.stats["seconds"]
+        return dict(self.stats, chunks_per_second=self.stats["chunks"] / seconds if seconds else 0.0)
@@ -0,0 +1,120 @@
+import json
+import os
+import shutil
+import time
+import uuid
+
+CURRENT_FILE = "CURRENT.json"
+VERSIONS_DIRECTORY = "versions"
+BUILD_STATE_FILE = "build_state.json"
+
+
+class IndexVersions:
+    """
+    Blue/green versions of an index directory.
+    Every build writes into its own root/versions/<version> directory; the live
+    version is named by the root/CURRENT.json pointer, which is replaced atomically
+    (os.replace) when a finished build is promoted. Readers therefore only ever
+    see complete versions, and a build never writes into the files being served.
+    A root without a pointer is an unversioned index from before this layout and
+    is served from the root itself.
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def version_path(self, version):
+        return os.path.join(self.root, VERSIONS_DIRECTORY, version)
+
+    def pointer(self):
+        """The CURRENT.json contents, or None for an unversioned root."""
+        try:
+            with open(os.path.join(self.root, CURRENT_FILE), encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def current(self):
+        """(directory, version) of the live index; version is None for an unversioned root."""
+        pointer = self.pointer()
+        if pointer is None:
+            return self.root, None
+        return self.version_path(pointer["version"]), pointer["version"]
+
+    def versions(self):
+        """Version ids on disk, oldest first (ids start with their creation time)."""
+        directory = os.path.join(self.root, VERSIONS_DIRECTORY)
+        return sorted(os.listdir(directory)) if os.path.isdir(directory) else []
+
+    def stage(self, copy_current=True):
+        """
+        Directory for the next build: (directory, version).
+        An unfinished build staged on top of the current version is resumed, so its
+        embedding checkpoint stays valid; otherwise a new version is created, starting
+        from a copy of the current index unless copy_current is False.
+        """
+        base = self.pointer()
+        base = base["version"] if base else None
+        for version in reversed(self.versions()):
+            state_path = os.path.join(self.version_path(version), BUILD_STATE_FILE)
+            if os.path.exists(state_path):
+                with open(state_path, encoding="utf-8") as f:
+                    state = json.load(f)
+                if state.get("base") == base and state.get("copy") == copy_current:
+                    print(f"Resuming unfinished build {version}")
+                    return self.version_path(version), version
+        # Microseconds keep builds started within the same second in order ("." sorts after the
+        # "-" of ids without them, so older ids still sort first)
+        now = time.time()
+        version = f"{time.strftime('%Y%m%dT%H%M%S', time.localtime(now))}.{int(now % 1 * 1e6):06d}-{uuid.uuid4().hex[:8]}"
+        directory = self.version_path(version)
+        current_directory, _ = self.current()
+        if copy_current and os.path.isdir(current_directory):
+            shutil.copytree(
+                current_directory, directory,
+                ignore=shutil.ignore_patterns(VERSIONS_DIRECTORY, CURRENT_FILE, BUILD_STATE_FILE, "*.tmp"),
+            )
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, BUILD_STATE_FILE), "w", encoding="utf-8") as f:
+            json.dump({"base": base, "copy": copy_current, "started_at": time.time()}, f)
+        return directory, version
+
+    def promote(self, version):
+        """Atomically make a finished version the live one."""
+        directory = self.version_path(version)
+        state_path = os.path.join(directory, BUILD_STATE_FILE)
+        if os.path.exists(state_path):
+            os.remove(state_path)
+        previous = self.pointer()
+        pointer = {
+            "version": version,
+            "promoted_at": time.time(),
+            "previous": previous["version"] if previous else None,
+        }
+        tmp_path = os.path.join(self.root, CURRENT_FILE + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(pointer, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, os.path.join(self.root, CURRENT_FILE))
+        print(f"Promoted index version {version} in {self.root}")
+
+    def discard(self, version):
+        shutil.rmtree(self.version_path(version), ignore_errors=True)
+
+    def prune(self, keep=3):
+        """
+        Delete all but the newest keep finished versions. The live one is always kept,
+        and older ones stay around for a while so a service still reading them can swap over.
+        """
+        _, current = self.current()
+        finished = [v for v in self.versions() if not os.path.exists(os.path.join(self.version_path(v), BUILD_STATE_FILE))]
+        for version in finished[:-keep] if keep else finished:
+            if version != current:
+                self.discard(version)
+                print(f"Removed old index version {version}")
+
+
+def current_index_directory(root):
+    """Directory of the live index version under root (root itself if it is unversioned)."""
+    return IndexVersions(root).current()[0]
@@ -0,0 +1,191 @@
+import hashlib
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from pypdf import PdfReader
+
+MANIFEST_FILE = "ingest_manifest.json"
+
+
+def list_pdfs(directory):
+    return sorted(
+        os.path.join(directory, filename)
+        for filename in os.listdir(directory)
+        if filename.endswith(".pdf")
+    )
+
+
+def extract_page_range(path, start, end):
+    """
+    Extract the text of pages [start, end) of a PDF. Runs in a worker process.
+    Returns (path, [(page_number, text), ...], error); page numbers start at 1.
+    """
+    try:
+        pdf = PdfReader(path)
+        return path, [(number + 1, pdf.pages[number].extract_text() or "") for number in range(start, end)], None
+    except Exception as e:
+        return path, [], str(e)
+
+
+def page_tasks(paths, pages_per_task=16):
+    """Split every PDF into (path, start, end) page ranges, in document and page order."""
+    for path in paths:
+        try:
+            page_count = len(PdfReader(path).pages)
+        except Exception as e:
+            print(f"Error processing {os.path.basename(path)}: {str(e)}")
+            continue
+        for start in range(0, page_count, pages_per_task):
+            yield path, start, min(start + pages_per_task, page_count)
+
+
+def iter_pages(paths, workers=None, pages_per_task=16):
+    """
+    Yield (path, page_number, text) for every page of the PDFs, in order.
+    Page ranges are extracted on a process pool. At most two ranges per worker are in
+    flight, so memory stays bounded by the range size however large the books are.
+    """
+    workers = workers or os.cpu_count() or 1
+    tasks = page_tasks(paths, pages_per_task)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for task in tasks:
+            pending.append(executor.submit(extract_page_range, *task))
+            if len(pending) >= 2 * workers:
+                yield from _completed_pages(pending.popleft())
+        while pending:
+            yield from _completed_pages(pending.popleft())
+
+
+def _completed_pages(future):
+    path, pages, error = future.result()
+    if error:
+        print(f"Error processing {os.path.basename(path)}: {error}")
+        return
+    for page_number, text in pages:
+        yield path, page_number, text
+
+
+def iter_chunks(pages, text_splitter, buffer_size=8000):
+    """
+    Split a stream of (path, page_number, text) pages into chunks without holding whole
+    books in memory. Pages are buffered per document; once the buffer is larger than
+    buffer_size characters, every chunk but the last is emitted, and splitting resumes
+    from the last chunk so the overlap between consecutive chunks is kept.
+    Yields {"text": ..., "metadata": {"source": filename}} dicts.
+    """
+    current_path, buffer = None, ""
+    for path, _, text in pages:
+        if path != current_path:
+            if buffer:
+                yield from _split(text_splitter, buffer, current_path)
+            current_path, buffer = path, ""
+        buffer = f"{buffer}\n{text}" if buffer else text
+        if len(buffer) > buffer_size:
+            chunks = text_splitter.split_text(buffer)
+            for chunk in chunks[:-1]:
+                yield {"text": chunk, "metadata": {"source": os.path.basename(path)}}
+            buffer = chunks[-1] if chunks else ""
+    if buffer:
+        yield from _split(text_splitter, buffer, current_path)
+
+
+def _split(text_splitter, text, path):
+    for chunk in text_splitter.split_text(text):
+        yield {"text": chunk, "metadata": {"source": os.path.basename(path)}}
+
+
+def iter_batches(items, batch_size):
+    """Group an iterable into lists of batch_size items (the last one may be shorter)."""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def file_sha256(path, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def chunk_id(source, text, occurrence=0):
+    """Content-derived id: the same chunk text of the same document always gets the same id."""
+    return hashlib.sha256(f"{source}\0{occurrence}\0{text}".encode("utf-8")).hexdigest()[:32]
+
+
+def with_chunk_ids(chunks):
+    """Add an "id" to every chunk; repeated texts within a document are numbered."""
+    occurrences = {}
+    for chunk in chunks:
+        key = (chunk["metadata"]["source"], chunk["text"])
+        occurrence = occurrences.get(key, 0)
+        occurrences[key] = occurrence + 1
+        yield dict(chunk, id=chunk_id(key[0], key[1], occurrence))
+
+
+class IngestManifest:
+    """
+    Record of what is in the vector store: for each PDF its content hash and the ids of
+    its chunks, plus the settings the chunks were made with. build_db.py uses it to only
+    extract and embed new or changed PDFs and to delete the vectors of removed ones.
+    """
+
+    def __init__(self, documents=None, settings=None):
+        self.documents = documents or {}
+        self.settings = settings or {}
+
+    @classmethod
+    def load(cls, directory):
+        path = os.path.join(directory, MANIFEST_FILE)
+        if not os.path.exists(path):
+            return None
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(data["documents"], data["settings"])
+
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = os.path.join(directory, MANIFEST_FILE + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"documents": self.documents, "settings": self.settings, "updated_at": time.time()}, f, indent=2)
+        os.replace(tmp_path, os.path.join(directory, MANIFEST_FILE))
+
+    def file_hash(self, path):
+        """Content hash of a PDF; the stored hash is reused while size and mtime are unchanged."""
+        stat = os.stat(path)
+        entry = self.documents.get(os.path.basename(path))
+        if entry and entry.get("size") == stat.st_size and entry.get("mtime_ns") == stat.st_mtime_ns:
+            return entry["sha256"]
+        return file_sha256(path)
+
+    def plan(self, paths):
+        """Split the PDFs into (changed, unchanged) paths and the names of removed documents."""
+        changed, unchanged = [], []
+        for path in paths:
+            entry = self.documents.get(os.path.basename(path))
+            if entry and entry["sha256"] == self.file_hash(path):
+                unchanged.append(path)
+            else:
+                changed.append(path)
+        names = {os.path.basename(path) for path in paths}
+        removed = [name for name in self.documents if name not in names]
+        return changed, unchanged, removed
+
+    def record(self, path, chunk_ids):
+        stat = os.stat(path)
+        self.documents[os.path.basename(path)] = {
+            "sha256": self.file_hash(path),
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "chunk_ids": list(chunk_ids),
+        }
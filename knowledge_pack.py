@@ -0,0 +1,204 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import uuid
+
+from days_per_week import requested_days
+
+DEFAULT_PACK_PATH = os.path.join("data", "knowledge_pack", "knowledge_pack.json")
+PACK_FORMAT_VERSION = 1
+
+EXPERIENCE_LEVELS = ("beginner", "intermediate", "advanced")
+GOALS = ("strength", "hypertrophy", "general fitness")
+DAYS_PER_WEEK = (2, 3, 4, 5, 6)
+
+# Keywords that place a free-text user input on each dimension. When several goals
+# are mentioned, the one mentioned first wins ("get stronger and build some muscle").
+EXPERIENCE_KEYWORDS = {
+    "beginner": ("beginner", "novice", "new to", "never trained", "just started"),
+    "intermediate": ("intermediate", "a few years", "couple of years", "some experience"),
+    "advanced": ("advanced", "experienced", "competitive", "years of training"),
+}
+GOAL_KEYWORDS = {
+    "strength": ("strength", "stronger", "powerlifting", "1rm", "main lifts"),
+    "hypertrophy": ("hypertrophy", "muscle mass", "build muscle", "muscle size", "bodybuilding", "physique"),
+    "general fitness": ("general fitness", "health", "fitness", "fit", "lose weight", "weight loss"),
+}
+
+
+def earliest_match(text, keywords):
+    """The key whose keywords appear first in text, or None."""
+    best, best_position = None, None
+    for key, phrases in keywords.items():
+        for phrase in phrases:
+            match = re.search(r"\b" + re.escape(phrase) + r"\b", text)
+            if match and (best_position is None or match.start() < best_position):
+                best, best_position = key, match.start()
+    return best
+
+
+def parse_profile(user_input):
+    """
+    Place a free-text user input (or a selected persona) on the pack dimensions.
+    Returns a dict with experience, goal and days_per_week, or None if any of them
+    cannot be recognised.
+    """
+    text = (user_input or "").lower()
+    experience = earliest_match(text, EXPERIENCE_KEYWORDS)
+    if experience is None and re.search(r"\b(\d+|seven|eight|nine|ten)\s+years\b", text):
+        experience = "advanced"
+    # "strength training" describes every request, not the goal
+    goal = earliest_match(text.replace("strength training", ""), GOAL_KEYWORDS)
+    days = requested_days(text)
+    if experience is None or goal is None or days is None:
+        return None
+    # Outside the precomputed range the closest precomputed frequency is used
+    days = min(DAYS_PER_WEEK, key=lambda candidate: abs(candidate - days))
+    return {"experience": experience, "goal": goal, "days_per_week": days}
+
+
+def profile_user_input(profile):
+    """The canonical user input the pack answers for a profile were generated from."""
+    return (
+        f"Lifting experience: {profile['experience']}. "
+        f"Training goal: {profile['goal']}. "
+        f"Available time for training: {profile['days_per_week']} days per week."
+    )
+
+
+def enumerate_profiles(experience_levels=EXPERIENCE_LEVELS, goals=GOALS, days_per_week=DAYS_PER_WEEK):
+    return [
+        {"experience": experience, "goal": goal, "days_per_week": days}
+        for experience in experience_levels
+        for goal in goals
+        for days in days_per_week
+    ]
+
+
+def request_key(query, specialized_instructions):
+    return hashlib.sha256(json.dumps([query, specialized_instructions]).encode("utf-8")).hexdigest()
+
+
+class KnowledgePack:
+    """
+    Precomputed retrieve_and_generate answers, built offline by build_knowledge_pack.py.
+    Entries are keyed by the exact (query, specialized_instructions) request, so a
+    changed agent prompt simply misses. Requests that contain the user input are looked
+    up through the canonical profile of that input (experience, goal, days per week);
+    details outside these dimensions, such as injuries, are not reflected in the answer.
+    """
+
+    def __init__(self, entries=None, manifest=None):
+        self.entries = entries or {}
+        self.manifest = manifest or {}
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def create(cls, index_fingerprint, pipeline, dimensions):
+        manifest = {
+            "format_version": PACK_FORMAT_VERSION,
+            "pack_version": uuid.uuid4().hex,
+            "created_at": time.time(),
+            "index_fingerprint": index_fingerprint,
+            "pipeline": pipeline,
+            "dimensions": dimensions,
+        }
+        return cls({}, manifest)
+
+    def add(self, task, profile, query, specialized_instructions, answer, sources):
+        self.entries[request_key(query, specialized_instructions)] = {
+            "task": task,
+            "profile": profile,
+            "query": query,
+            "answer": answer,
+            "sources": sources,
+        }
+
+    def save(self, path=DEFAULT_PACK_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        manifest = dict(self.manifest, entries=len(self.entries))
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"manifest": manifest, "entries": self.entries}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path=DEFAULT_PACK_PATH):
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        if data["manifest"].get("format_version") != PACK_FORMAT_VERSION:
+            raise ValueError(f"Unsupported knowledge pack format in '{path}'. Rebuild it with build_knowledge_pack.py.")
+        return cls(data["entries"], data["manifest"])
+
+    @property
+    def version(self):
+        return self.manifest.get("pack_version")
+
+    def is_current(self, index_fingerprint, pipeline):
+        """True if the pack was built from this version of the index with the same retrieval pipeline."""
+        return self.manifest.get("index_fingerprint") == index_fingerprint and self.manifest.get("pipeline") == pipeline
+
+    def lookup(self, build_request, program, record=True):
+        """
+        Return the precomputed (answer, sources) for an agent's retrieval, or None on a miss.
+        build_request is the agent's own request builder, called with the program and,
+        if the exact request is not in the pack, with the program's canonical profile.
+        record=False leaves the hit and miss counters alone (used when planning prefetches).
+        """
+        request = build_request(program)
+        if request is None:
+            return None
+        entry = self.entries.get(request_key(*request))
+        if entry is None:
+            profile = parse_profile(program.get('user-input', ''))
+            if profile is not None:
+                profile_request = build_request(dict(program, **{'user-input': profile_user_input(profile)}))
+                entry = self.entries.get(request_key(*profile_request)) if profile_request else None
+        if record:
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if entry is None:
+            return None
+        return entry["answer"], entry["sources"]
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "version": self.version,
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+_loaded_packs = {}
+_loaded_packs_lock = threading.Lock()
+
+
+def load_knowledge_pack(path=DEFAULT_PACK_PATH, index_fingerprint=None, pipeline=None):
+    """
+    Load the pack at path, reusing the loaded pack until the file changes.
+    Returns None if there is no pack, or if it was built from another index version
+    or retrieval pipeline than the given ones (the agents then retrieve live).
+    """
+    if not os.path.exists(path):
+        return None
+    mtime = os.stat(path).st_mtime_ns
+    with _loaded_packs_lock:
+        cached = _loaded_packs.get(path)
+        if cached is None or cached[0] != mtime:
+            cached = (mtime, KnowledgePack.load(path))
+            _loaded_packs[path] = cached
+    pack = cached[1]
+    if index_fingerprint is not None and not pack.is_current(index_fingerprint, pipeline):
+        print(f"Knowledge pack {pack.version} is stale (index or retrieval pipeline changed), using live retrieval. "
+              f"Rebuild it with build_knowledge_pack.py.")
+        return None
+    return pack
@@ -0,0 +1,373 @@
+import hashlib
+import inspect
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from index_versions import current_index_directory
+
+DEFAULT_ANSWER_CACHE_PATH = os.path.join("data", "rag_cache", "answers.sqlite3")
+DEFAULT_EMBEDDING_CACHE_PATH = os.path.join("data", "rag_cache", "embeddings.sqlite3")
+INDEX_VERSION_FILE = "index_version.json"
+
+
+def write_index_version(persist_directory, version=None):
+    """
+    Stamp a freshly built vector store with a version id (a new one unless given).
+    Called by build_db.py after every build so caches keyed on the
+    collection fingerprint are invalidated automatically.
+    """
+    os.makedirs(persist_directory, exist_ok=True)
+    version = {"version": version or uuid.uuid4().hex, "built_at": time.time()}
+    tmp_path = os.path.join(persist_directory, INDEX_VERSION_FILE + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(version, f)
+    os.replace(tmp_path, os.path.join(persist_directory, INDEX_VERSION_FILE))
+    return version["version"]
+
+
+def collection_fingerprint(persist_directory, collection_name):
+    """
+    Identify the current contents of a vector store collection.
+    Uses the version id of the live version (see index_versions.py) or the version
+    stamp written by build_db.py, and falls back to the size and modification time
+    of the store files for older builds.
+    """
+    digest = hashlib.sha256(collection_name.encode("utf-8"))
+    persist_directory = current_index_directory(persist_directory)
+    version_path = os.path.join(persist_directory, INDEX_VERSION_FILE)
+    if os.path.exists(version_path):
+        with open(version_path, encoding="utf-8") as f:
+            digest.update(json.load(f)["version"].encode("utf-8"))
+    elif os.path.isdir(persist_directory):
+        for root, dirs, files in os.walk(persist_directory):
+            dirs.sort()
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                stat = os.stat(path)
+                digest.update(f"{os.path.relpath(path, persist_directory)}:{stat.st_size}:{stat.st_mtime_ns}".encode("utf-8"))
+    else:
+        digest.update(b"missing")
+    return digest.hexdigest()[:16]
+
+
+class AnswerCache:
+    """
+    On-disk cache for retrieve_and_generate answers, backed by SQLite.
+    Entries are keyed by query, specialized instructions, model and collection
+    fingerprint, expire after ttl_seconds and are evicted least recently used
+    once the cache holds more than max_entries.
+    """
+
+    def __init__(self, path=DEFAULT_ANSWER_CACHE_PATH, max_entries=2000, ttl_seconds=7 * 24 * 3600):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._connection = None
+        self._fingerprint = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._connection is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS answers ("
+                "key TEXT PRIMARY KEY, fingerprint TEXT, value TEXT, created_at REAL, accessed_at REAL)"
+            )
+            self._connection.execute("CREATE INDEX IF NOT EXISTS answers_accessed ON answers (accessed_at)")
+            self._connection.commit()
+        return self._connection
+
+    @staticmethod
+    def make_key(query, specialized_instructions, model, fingerprint, namespace=None):
+        # namespace separates the answers of an offline LLM backend (see llm_backend.cache_namespace)
+        parts = [query, specialized_instructions or "", model, fingerprint]
+        payload = json.dumps(parts + [namespace] if namespace else parts)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _check_fingerprint(self, connection, fingerprint):
+        # Entries from an older build can never be hit again, so drop them on the first lookup after a rebuild
+        if fingerprint != self._fingerprint:
+            deleted = connection.execute("DELETE FROM answers WHERE fingerprint != ?", (fingerprint,)).rowcount
+            connection.commit()
+            if deleted:
+                print(f"Answer cache: dropped {deleted} entries from a previous index version")
+            self._fingerprint = fingerprint
+
+    def get(self, key, fingerprint):
+        """Return the cached value for key, or None on a miss."""
+        now = time.time()
+        with self._lock:
+            connection = self._connect()
+            self._check_fingerprint(connection, fingerprint)
+            row = connection.execute(
+                "SELECT value, created_at FROM answers WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or (self.ttl_seconds and now - row[1] > self.ttl_seconds):
+                self.misses += 1
+                return None
+            connection.execute("UPDATE answers SET accessed_at = ? WHERE key = ?", (now, key))
+            connection.commit()
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key, value, fingerprint):
+        """Store a JSON-serialisable value and evict expired and least recently used entries."""
+        now = time.time()
+        with self._lock:
+            connection = self._connect()
+            self._check_fingerprint(connection, fingerprint)
+            connection.execute(
+                "INSERT OR REPLACE INTO answers (key, fingerprint, value, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, fingerprint, json.dumps(value), now, now),
+            )
+            if self.ttl_seconds:
+                connection.execute("DELETE FROM answers WHERE created_at < ?", (now - self.ttl_seconds,))
+            connection.execute(
+                "DELETE FROM answers WHERE key IN ("
+                "SELECT key FROM answers ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            connection.commit()
+
+    def clear(self):
+        with self._lock:
+            connection = self._connect()
+            connection.execute("DELETE FROM answers")
+            connection.commit()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+def canonicalize_query(text):
+    """Collapse whitespace so trivially different spellings of a query share a cache entry."""
+    return " ".join(text.split())
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wraps an embedding model with a process-wide cache for query embeddings.
+    Recently used vectors are kept in a bounded in-memory LRU, optionally backed by
+    a SQLite file so they survive restarts. Document embeddings are passed straight
+    through, since every chunk is only embedded once when the store is built.
+    namespace separates the vectors of an offline embedding backend (see
+    llm_backend.cache_namespace) from those of the real model.
+    """
+
+    def __init__(self, embeddings, model_name, max_entries=4096, persist_path=None, namespace=None):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self.persist_path = persist_path
+        self.hits = 0
+        self.persistent_hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._connection = None
+        self._lock = threading.Lock()
+        # Embedding models without task types embed queries and documents the same way
+        parameters = inspect.signature(embeddings.embed_documents).parameters.values()
+        self._accepts_task_type = any(
+            parameter.name == "task_type" or parameter.kind is inspect.Parameter.VAR_KEYWORD
+            for parameter in parameters
+        )
+
+    def _connect(self):
+        if self._connection is None and self.persist_path:
+            directory = os.path.dirname(self.persist_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._connection = sqlite3.connect(self.persist_path, timeout=30, check_same_thread=False)
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, model TEXT, vector BLOB)"
+            )
+            self._connection.commit()
+        return self._connection
+
+    def _key(self, text):
+        model = f"{self.namespace}:{self.model_name}" if self.namespace else self.model_name
+        return hashlib.sha256(f"{model}\n{canonicalize_query(text)}".encode("utf-8")).hexdigest()
+
+    def _remember(self, key, vector):
+        # float32 arrays take a quarter of the memory of a list of Python floats
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def lookup(self, text):
+        """Return the cached embedding for a query, or None, updating the hit counters."""
+        key = self._key(text)
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return self._memory[key].tolist()
+            connection = self._connect()
+            if connection is not None:
+                row = connection.execute("SELECT vector FROM embeddings WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    vector = np.frombuffer(row[0], dtype=np.float32)
+                    self._remember(key, vector)
+                    self.hits += 1
+                    self.persistent_hits += 1
+                    return vector.tolist()
+            self.misses += 1
+        return None
+
+    def store(self, text, vector):
+        """Cache the embedding of a query; returns it as stored (float32), like later hits."""
+        key = self._key(text)
+        vector = np.asarray(vector, dtype=np.float32)
+        with self._lock:
+            self._remember(key, vector)
+            connection = self._connect()
+            if connection is not None:
+                connection.execute(
+                    "INSERT OR REPLACE INTO embeddings (key, model, vector) VALUES (?, ?, ?)",
+                    (key, self.model_name, vector.tobytes()),
+                )
+                connection.commit()
+        return vector.tolist()
+
+    def embed_query(self, text):
+        vector = self.lookup(text)
+        if vector is None:
+            return self.store(text, self.embeddings.embed_query(canonicalize_query(text)))
+        return vector
+
+    def embed_queries(self, texts):
+        """
+        Embed several queries, sending all cache misses to the model in one batched request.
+        Returns one vector per text, in order.
+        """
+        vectors = [self.lookup(text) for text in texts]
+        missing = list(dict.fromkeys(canonicalize_query(text) for text, vector in zip(texts, vectors) if vector is None))
+        if missing:
+            if self._accepts_task_type:
+                computed = self.embeddings.embed_documents(missing, task_type="RETRIEVAL_QUERY")
+            else:
+                computed = self.embeddings.embed_documents(missing)
+            by_text = {text: self.store(text, vector) for text, vector in zip(missing, computed)}
+            vectors = [vector if vector is not None else list(by_text[canonicalize_query(text)])
+                       for text, vector in zip(texts, vectors)]
+        return vectors
+
+    def embed_documents(self, texts):
+        return self.embeddings.embed_documents(texts)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "persistent_hits": self.persistent_hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": len(self._memory),
+        }
+
+
+class SemanticAnswerCache:
+    """
+    In-memory cache that returns a stored answer for a query whose embedding is
+    close enough to an earlier one (cosine similarity >= threshold). Only entries
+    whose scope (specialized instructions, retrieval pipeline and index version)
+    is exactly equal are compared; the embedding only decides between those.
+    Answers are reused across queries that differ in wording, so the cache is
+    opt-in (see RetrievalService.semantic_cache_threshold).
+    Embeddings live in one preallocated NumPy matrix of max_entries rows; when it
+    is full the least recently used entry is replaced.
+    """
+
+    def __init__(self, threshold=0.97, max_entries=512):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._similarity_sum = 0.0
+        self._matrix = None
+        self._groups = np.zeros(max_entries, dtype=np.int64)
+        self._last_used = np.zeros(max_entries, dtype=np.float64)
+        self._values = [None] * max_entries
+        self._scopes = [None] * max_entries
+        self._size = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def group_id(scope):
+        # Prefilter only: a 64-bit hash of the scope; hits are checked against the full scope
+        digest = hashlib.sha256(json.dumps(scope).encode("utf-8")).digest()
+        return int.from_bytes(digest[:8], "little", signed=True)
+
+    @staticmethod
+    def _normalize(embedding):
+        vector = np.asarray(embedding, dtype=np.float32)
+        return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+    def get(self, embedding, scope):
+        """Return (value, similarity) of the closest entry with this exact scope above the threshold, or None."""
+        query = self._normalize(embedding)
+        scope = list(scope)
+        group = self.group_id(scope)
+        with self._lock:
+            if self._size and self._matrix.shape[1] == query.shape[0]:
+                similarities = self._matrix[:self._size] @ query
+                similarities[self._groups[:self._size] != group] = -1.0
+                for slot in np.flatnonzero(similarities >= self.threshold):
+                    if self._scopes[slot] != scope:
+                        similarities[slot] = -1.0
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.threshold:
+                    self._last_used[best] = time.monotonic()
+                    self.hits += 1
+                    self._similarity_sum += float(similarities[best])
+                    return self._values[best], float(similarities[best])
+            self.misses += 1
+        return None
+
+    def put(self, embedding, scope, value):
+        vector = self._normalize(embedding)
+        scope = list(scope)
+        with self._lock:
+            if self._matrix is None or self._matrix.shape[1] != vector.shape[0]:
+                self._matrix = np.zeros((self.max_entries, vector.shape[0]), dtype=np.float32)
+                self._size = 0
+            if self._size < self.max_entries:
+                slot = self._size
+                self._size += 1
+            else:
+                slot = int(np.argmin(self._last_used))
+            self._matrix[slot] = vector
+            self._groups[slot] = self.group_id(scope)
+            self._scopes[slot] = scope
+            self._last_used[slot] = time.monotonic()
+            self._values[slot] = value
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "mean_hit_similarity": self._similarity_sum / self.hits if self.hits else None,
+            "entries": self._size,
+        }
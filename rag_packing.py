@@ -0,0 +1,114 @@
+import math
+import re
+
+from langchain_core.documents import Document
+
+WORD_PATTERN = re.compile(r"\w+")
+
+
+def estimate_tokens(text):
+    """Rough Gemini token count: about four characters per token for English text."""
+    return math.ceil(len(text) / 4)
+
+
+def overlap_length(first, second, min_overlap=40, max_overlap=400):
+    """Length of the longest suffix of first that is also a prefix of second (0 if shorter than min_overlap)."""
+    if len(first) < min_overlap or len(second) < min_overlap:
+        return 0
+    tail = first[-max_overlap:]
+    anchor = second[:min_overlap]
+    position = tail.find(anchor)
+    while position != -1:
+        if second.startswith(tail[position:]):
+            return len(tail) - position
+        position = tail.find(anchor, position + 1)
+    return 0
+
+
+def shingles(text, size=5):
+    words = WORD_PATTERN.findall(text.lower())
+    if len(words) <= size:
+        return {" ".join(words)}
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def jaccard(first, second):
+    if not first or not second:
+        return 0.0
+    return len(first & second) / len(first | second)
+
+
+class ContextPacker:
+    """
+    Packs ranked chunks into a bounded prompt context.
+      1. Chunks from the same source whose text overlaps (the chunk_overlap of
+         build_db.py) are stitched back together into one passage.
+      2. Passages that are contained in, or near-duplicates of, a more relevant
+         passage are dropped.
+      3. Passages are added in order of relevance until token_budget is reached.
+    """
+
+    def __init__(self, token_budget=2000, min_overlap=40, max_overlap=400, duplicate_threshold=0.8):
+        self.token_budget = token_budget
+        self.min_overlap = min_overlap
+        self.max_overlap = max_overlap
+        self.duplicate_threshold = duplicate_threshold
+
+    def merge_overlapping(self, documents):
+        # Each block keeps the rank of its most relevant chunk
+        blocks = [{"text": doc.page_content, "metadata": dict(doc.metadata), "rank": rank}
+                  for rank, doc in enumerate(documents)]
+        merged = True
+        while merged:
+            merged = False
+            for first in blocks:
+                for second in blocks:
+                    if first is second or first["metadata"].get("source") != second["metadata"].get("source"):
+                        continue
+                    overlap = overlap_length(first["text"], second["text"], self.min_overlap, self.max_overlap)
+                    if overlap:
+                        first["text"] += second["text"][overlap:]
+                        first["rank"] = min(first["rank"], second["rank"])
+                        blocks.remove(second)
+                        merged = True
+                        break
+                if merged:
+                    break
+        return sorted(blocks, key=lambda block: block["rank"])
+
+    def remove_duplicates(self, blocks):
+        kept, kept_shingles = [], []
+        for block in blocks:
+            block_shingles = shingles(block["text"])
+            duplicate = any(
+                block["text"] in other["text"] or jaccard(block_shingles, other_shingles) >= self.duplicate_threshold
+                for other, other_shingles in zip(kept, kept_shingles)
+            )
+            if not duplicate:
+                kept.append(block)
+                kept_shingles.append(block_shingles)
+        return kept
+
+    def pack(self, documents):
+        """Return the packed passages as Documents, most relevant first, within the token budget."""
+        blocks = self.remove_duplicates(self.merge_overlapping(documents))
+        packed, used = [], 0
+        for block in blocks:
+            tokens = estimate_tokens(block["text"])
+            if used + tokens > self.token_budget:
+                continue
+            packed.append(Document(page_content=block["text"], metadata=block["metadata"]))
+            used += tokens
+        if not packed and blocks:
+            # Even the best passage is over budget on its own: keep its beginning
+            block = blocks[0]
+            packed.append(Document(page_content=block["text"][:self.token_budget * 4], metadata=block["metadata"]))
+        return packed
+
+
+class PassthroughPacker:
+    """Joins the ranked chunks as they are, without merging or a budget (the original behaviour)."""
+    token_budget = None
+
+    def pack(self, documents):
+        return list(documents)
@@ -0,0 +1,106 @@
+import math
+import re
+from collections import Counter
+
+import numpy as np
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def normalize_rows(matrix):
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
+
+
+def bm25_scores(query, texts, k1=1.5, b=0.75):
+    """BM25 scores of each text for the query, with IDF computed over the given texts only."""
+    query_terms = set(tokenize(query))
+    documents = [Counter(tokenize(text)) for text in texts]
+    if not query_terms or not documents:
+        return np.zeros(len(texts), dtype=np.float32)
+    lengths = np.array([sum(doc.values()) for doc in documents], dtype=np.float32)
+    average_length = max(float(lengths.mean()), 1.0)
+    scores = np.zeros(len(documents), dtype=np.float32)
+    for term in query_terms:
+        frequencies = np.array([doc.get(term, 0) for doc in documents], dtype=np.float32)
+        document_frequency = int(np.count_nonzero(frequencies))
+        if not document_frequency:
+            continue
+        idf = math.log(1 + (len(documents) - document_frequency + 0.5) / (document_frequency + 0.5))
+        scores += idf * frequencies * (k1 + 1) / (frequencies + k1 * (1 - b + b * lengths / average_length))
+    return scores
+
+
+class LengthReranker:
+    """The original behaviour: keep the top k hits and put the longest chunks first."""
+    name = "length"
+
+    def fetch_k(self, k):
+        return k
+
+    def rerank(self, query, query_embedding, documents, embeddings, k):
+        return sorted(documents[:k], key=lambda x: len(x.page_content), reverse=True)
+
+
+class MMRReranker:
+    """
+    Maximal marginal relevance over the stored chunk embeddings.
+    Fetches fetch_multiplier * k candidates and greedily picks chunks that are
+    relevant to the query but not redundant with the chunks already picked.
+    With lexical_weight > 0 the relevance is a hybrid of cosine similarity and a
+    BM25 score computed over the candidates, which helps exact terms like "RPE".
+    """
+
+    def __init__(self, lambda_mult=0.7, fetch_multiplier=3, lexical_weight=0.0):
+        self.lambda_mult = lambda_mult
+        self.fetch_multiplier = fetch_multiplier
+        self.lexical_weight = lexical_weight
+        self.name = f"mmr(lambda={lambda_mult}, lexical={lexical_weight})"
+
+    def fetch_k(self, k):
+        return max(k, k * self.fetch_multiplier)
+
+    def relevance(self, query, query_embedding, documents, embeddings):
+        relevance = embeddings @ normalize_rows(query_embedding)
+        if self.lexical_weight:
+            lexical = bm25_scores(query, [doc.page_content for doc in documents])
+            if lexical.max() > 0:
+                lexical = lexical / lexical.max()
+            relevance = (1 - self.lexical_weight) * relevance + self.lexical_weight * lexical
+        return relevance
+
+    def rerank(self, query, query_embedding, documents, embeddings, k):
+        if not documents:
+            return []
+        embeddings = normalize_rows(embeddings)
+        relevance = self.relevance(query, query_embedding, documents, embeddings)
+        similarity = embeddings @ embeddings.T
+
+        selected = [int(np.argmax(relevance))]
+        max_similarity = similarity[selected[0]].copy()
+        available = np.ones(len(documents), dtype=bool)
+        available[selected[0]] = False
+        while len(selected) < min(k, len(documents)):
+            scores = self.lambda_mult * relevance - (1 - self.lambda_mult) * max_similarity
+            scores[~available] = -np.inf
+            best = int(np.argmax(scores))
+            selected.append(best)
+            available[best] = False
+            np.maximum(max_similarity, similarity[best], out=max_similarity)
+        return [documents[i] for i in selected]
+
+
+def get_reranker(name):
+    """Build a reranker from a short name: "length", "mmr" or "hybrid"."""
+    if name == "length":
+        return LengthReranker()
+    if name == "mmr":
+        return MMRReranker()
+    if name == "hybrid":
+        return MMRReranker(lexical_weight=0.3)
+    raise ValueError(f"Unknown reranker: {name}")
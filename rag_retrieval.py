@@ -1,37 +1,380 @@
 import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import numpy as np
 from langchain_chroma import Chroma
+from langchain_core.documents import Document
+from agent_system.llm_backend import cache_namespace
 from agent_system.setup_api import setup_embeddings, setup_llm
+from index_versions import current_index_directory
+from rag_cache import AnswerCache, CachedEmbeddings, SemanticAnswerCache, collection_fingerprint, DEFAULT_EMBEDDING_CACHE_PATH
+from rag_rerank import MMRReranker
+from rag_packing import ContextPacker
+from vector_index import VectorIndex
 
+PERSIST_DIRECTORY = "data/chroma_db"
+VECTOR_INDEX_DIRECTORY = "data/vector_index"
+COLLECTION_NAME = "strength_training_books"
+# "chroma" or "vector_index" (the exact NumPy index exported by build_db.py --export-vector-index)
+RETRIEVAL_BACKEND = os.environ.get("RAG_BACKEND", "chroma")
+# Opt-in: a cosine similarity (e.g. 0.97) above which a near-identical query reuses a generated answer
+SEMANTIC_CACHE_THRESHOLD = float(os.environ["RAG_SEMANTIC_CACHE_THRESHOLD"]) if os.environ.get("RAG_SEMANTIC_CACHE_THRESHOLD") else None
+GENERATION_MODEL = "models/gemini-2.0-flash"
+EMBEDDING_MODEL = "models/text-embedding-004"
+# Seconds a replaced Chroma store stays open, so queries that started on it can finish
+RETIRED_STORE_GRACE_SECONDS = 30.0
 
-embedding_model = setup_embeddings(model="models/text-embedding-004")
-generate_response = setup_llm(model="models/gemini-2.0-flash", max_tokens=1000, temperature=0.3)
 
-vector_store = Chroma(
-    persist_directory="data/chroma_db",
-    embedding_function=embedding_model,
-    collection_name="strength_training_books"
-)
+class RetrievalService:
+    """
+    Lazily initialised retrieval backend.
+    The embedding model, the Gemini model and the vector index are only set up on
+    first use (or by an explicit warm()), so importing this module never blocks on
+    the network. Initialisation is guarded by a lock and safe to trigger from
+    several request threads at once.
+
+    The index is either the Chroma store or an in-process VectorIndex; both are
+    queried through the same collection-style query() call.
+
+    build_db.py promotes every build as a new index version (see index_versions.py).
+    At most every index_check_interval seconds the service checks the version pointer
+    and, if it moved, loads the new version and swaps it in. Queries already running
+    finish on the version they started with, and until the new one has loaded (or if
+    it fails to load) the previous version keeps serving. The replaced Chroma client is
+    closed RETIRED_STORE_GRACE_SECONDS later, which releases its SQLite handles.
+    """
+
+    def __init__(
+            self,
+            persist_directory=PERSIST_DIRECTORY,
+            collection_name=COLLECTION_NAME,
+            embedding_model_name=EMBEDDING_MODEL,
+            generation_model=GENERATION_MODEL,
+            reranker=None,
+            packer=None,
+            backend=RETRIEVAL_BACKEND,
+            vector_index_directory=VECTOR_INDEX_DIRECTORY,
+            semantic_cache_threshold=SEMANTIC_CACHE_THRESHOLD,
+            index_check_interval=2.0,
+            ):
+        if backend not in ("chroma", "vector_index"):
+            raise ValueError(f"Unknown retrieval backend: {backend}")
+        self.backend = backend
+        self.vector_index_directory = vector_index_directory
+        self.persist_directory = persist_directory
+        self.collection_name = collection_name
+        self.embedding_model_name = embedding_model_name
+        self.generation_model = generation_model
+        # See rag_rerank.py; MMR over the stored embeddings unless another reranker is given
+        self.reranker = reranker or MMRReranker()
+        # See rag_packing.py; merges overlapping chunks and bounds the context size
+        self.packer = packer or ContextPacker()
+        # Persistent cache of generated answers, invalidated whenever build_db.py rebuilds the store
+        self.answer_cache = AnswerCache()
+        # Answers for near-identical queries; off unless a threshold is given, since it answers
+        # a query with the answer generated for a different (if similar) one
+        self.semantic_cache = SemanticAnswerCache(threshold=semantic_cache_threshold) if semantic_cache_threshold else None
+        self._embedding_model = None
+        self._generate_response = None
+        self._vector_store = None
+        self._index = None
+        self._lock = threading.Lock()
+        # Directory of the index version being served, and when to look for a newer one
+        self._index_path = None
+        self.index_check_interval = index_check_interval
+        self._next_index_check = 0.0
+        self._swap_lock = threading.Lock()
+        # (close after, Chroma store) for the versions swapped out, oldest first
+        self._retired_stores = deque()
+
+    @property
+    def index_directory(self):
+        return self.persist_directory if self.backend == "chroma" else self.vector_index_directory
+
+    def _ensure_ready(self):
+        if self._index is not None:
+            return
+        with self._lock:
+            if self._index is not None:
+                return
+            print(f"Connecting retrieval backend ({self.backend}: {self.collection_name})...")
+            # Query embeddings are cached in memory and on disk, so repeated queries skip the embedding API
+            embedding_model = CachedEmbeddings(
+                setup_embeddings(model=self.embedding_model_name, probe=False),
+                model_name=self.embedding_model_name,
+                persist_path=DEFAULT_EMBEDDING_CACHE_PATH,
+                namespace=cache_namespace(),
+            )
+            self._generate_response = setup_llm(model=self.generation_model, max_tokens=1000, temperature=0.3)
+            self._embedding_model = embedding_model
+            directory = current_index_directory(self.index_directory)
+            index, self._vector_store = self._open_index(directory)
+            self._index_path = directory
+            self._next_index_check = time.monotonic() + (self.index_check_interval or 0)
+            # Assigned last: a loaded index signals that the service is ready
+            self._index = index
+
+    def _open_index(self, directory):
+        """Open the index version in directory; returns (index, Chroma store or None)."""
+        if self.backend == "chroma":
+            vector_store = Chroma(
+                persist_directory=directory,
+                embedding_function=self._embedding_model,
+                collection_name=self.collection_name
+            )
+            return vector_store._collection, vector_store
+        return VectorIndex.load(directory), None
+
+    def refresh_index(self):
+        """Swap to the live index version if a newer one was promoted. Returns True if it swapped."""
+        directory = current_index_directory(self.index_directory)
+        if directory == self._index_path:
+            return False
+        # One thread loads the new version; the others keep querying the current one
+        if not self._swap_lock.acquire(blocking=False):
+            return False
+        try:
+            if directory == self._index_path:
+                return False
+            try:
+                index, vector_store = self._open_index(directory)
+            except Exception as e:
+                print(f"Could not load index version {directory}, still serving {self._index_path}: {e}")
+                return False
+            previous_store = self._vector_store
+            self._vector_store, self._index_path, self._index = vector_store, directory, index
+            if previous_store is not None:
+                self._retired_stores.append((time.monotonic() + RETIRED_STORE_GRACE_SECONDS, previous_store))
+            print(f"Retrieval switched to index version {directory}")
+            return True
+        finally:
+            self._swap_lock.release()
+
+    def _maybe_refresh_index(self):
+        if self.index_check_interval is None or self._index is None:
+            return
+        now = time.monotonic()
+        if now < self._next_index_check:
+            return
+        self._next_index_check = now + self.index_check_interval
+        self.refresh_index()
+        self.close_retired_stores(now)
+
+    def close_retired_stores(self, now=None):
+        """Close the Chroma clients of swapped-out index versions whose grace period is over."""
+        now = time.monotonic() if now is None else now
+        with self._swap_lock:
+            while self._retired_stores and self._retired_stores[0][0] <= now:
+                _, vector_store = self._retired_stores.popleft()
+                close = getattr(vector_store._client, "close", None)
+                if close is not None:  # chromadb < 1.1 releases a client once it is unreferenced
+                    close()
+
+    def warm(self, probe=False):
+        """Connect the backend ahead of the first request, optionally checking the embedding API."""
+        self._ensure_ready()
+        if probe:
+            self._embedding_model.embed_query("test")
+        return self
+
+    @property
+    def is_ready(self):
+        return self._index is not None
+
+    @property
+    def embedding_model(self):
+        self._ensure_ready()
+        return self._embedding_model
+
+    @property
+    def vector_store(self):
+        """The Chroma store (None when the vector_index backend is used)."""
+        self._ensure_ready()
+        return self._vector_store
+
+    @property
+    def index(self):
+        self._ensure_ready()
+        self._maybe_refresh_index()
+        return self._index
+
+    @property
+    def generate_response(self):
+        self._ensure_ready()
+        return self._generate_response
+
+    def cache_stats(self):
+        """Hit/miss counters of the answer and query-embedding caches."""
+        return {
+            "answers": self.answer_cache.stats(),
+            "semantic_answers": self.semantic_cache.stats() if self.semantic_cache else None,
+            "embeddings": self._embedding_model.stats() if self._embedding_model else None,
+            "index_directory": self._index_path,
+        }
+
+    def search_many(self, queries, k=8, reranker=None):
+        """
+        Finds the top k chunks for every query with one batched embedding request
+        and one multi-query index call. The reranker picks the final k chunks from
+        its candidate pool. Returns a list of Documents per query.
+        """
+        reranker = reranker or self.reranker
+        return [
+            reranker.rerank(query, query_embedding, documents, embeddings, k)
+            for query, (query_embedding, documents, embeddings) in zip(
+                queries, self.fetch_candidates(queries, reranker.fetch_k(k)))
+        ]
+
+    def fetch_candidates(self, queries, n):
+        """
+        Nearest-neighbour candidates for each query, before reranking.
+        Returns (query_embedding, documents, embedding matrix) per query.
+        """
+        if not queries:
+            return []
+        query_embeddings = self.embedding_model.embed_queries(queries)
+        results = self.index.query(
+            query_embeddings=query_embeddings,
+            n_results=n,
+            include=["documents", "metadatas", "embeddings"],
+        )
+        candidates = []
+        for query_embedding, texts, metadatas, embeddings in zip(
+                query_embeddings, results["documents"], results["metadatas"], results["embeddings"]):
+            documents = [Document(page_content=text, metadata=metadata or {}) for text, metadata in zip(texts, metadatas)]
+            embeddings = np.asarray(embeddings, dtype=np.float32)
+            # A truncated vector index returns shorter vectors; compare the query on the same prefix
+            query_embedding = np.asarray(query_embedding, dtype=np.float32)
+            if embeddings.ndim == 2:
+                query_embedding = query_embedding[:embeddings.shape[1]]
+            candidates.append((query_embedding, documents, embeddings))
+        return candidates
+
+    def retrieve_context(self, query, k=8):
+        """
+        Retrieves the top k relevant chunks from the vector store for the query and
+        packs them into a context of at most packer.token_budget tokens.
+        Returns the prompt context, a simple summary, and the source metadata.
+        """
+        return self.retrieve_context_many([query], k=k)[0]
+
+    def retrieve_context_many(self, queries, k=8, reranker=None, packer=None):
+        """Batched retrieve_context: one (context, summary, sources) tuple per query, in order."""
+        packer = packer or self.packer
+        return [format_context(packer.pack(results)) for results in self.search_many(queries, k=k, reranker=reranker)]
+
+    def served_index_directory(self):
+        """Directory of the index version queries go to (the live version before the backend is connected)."""
+        self._maybe_refresh_index()
+        return self._index_path or current_index_directory(self.index_directory)
+
+    def index_fingerprint(self):
+        """Fingerprint of the index version being served."""
+        return collection_fingerprint(self.served_index_directory(), self.collection_name)
+
+    def pipeline_signature(self):
+        # The retrieval pipeline settings change the context, and therefore the answer
+        return f"{self.generation_model}|{self.reranker.name}|{self.packer.token_budget}"
+
+    def answer_cache_key(self, query, specialized_instructions, fingerprint):
+        return self.answer_cache.make_key(query, specialized_instructions, self.pipeline_signature(), fingerprint,
+                                          namespace=cache_namespace())
+
+    def retrieve_and_generate(self, query, specialized_instructions="", use_cache=True):
+        """
+        Combines retrieval and generation:
+          1. Looks the answer up in the persistent answer cache, then in the semantic cache.
+          2. Retrieves context from the vector store.
+          3. Builds a prompt that includes any specialized instructions and a summary.
+          4. Generates and returns an answer using Gemini Flash 2.0.
+        """
+        return self.retrieve_and_generate_many([(query, specialized_instructions)], use_cache=use_cache)[0]
+
+    def retrieve_and_generate_many(self, requests, use_cache=True, max_workers=4, on_result=None):
+        """
+        Batched retrieve_and_generate for a list of (query, specialized_instructions) requests.
+        Context for every uncached request is fetched in one round-trip, then the answers
+        are generated concurrently; repeated requests are answered once. Returns one
+        (answer, sources) tuple per request. on_result(i, result), if given, is called
+        for every request as soon as its answer is ready, before the rest of the batch.
+        """
+        results = [None] * len(requests)
+        positions = {}
+        for i, request in enumerate(requests):
+            positions.setdefault(tuple(request), []).append(i)
+        unique = list(positions)
+
+        def resolve(request, result):
+            for i in positions[request]:
+                results[i] = result
+                if on_result:
+                    on_result(i, result)
+
+        use_semantic_cache = use_cache and self.semantic_cache is not None
+        pending = list(unique)
+        if use_cache:
+            fingerprint = self.index_fingerprint()
+            cache_keys = {request: self.answer_cache_key(*request, fingerprint) for request in unique}
+            scopes = {request: (request[1], self.pipeline_signature(), fingerprint) for request in unique}
+            for request in unique:
+                cached = self.answer_cache.get(cache_keys[request], fingerprint)
+                if cached is not None:
+                    resolve(request, tuple(cached))
+            pending = [request for request in unique if results[positions[request][0]] is None]
+        if use_semantic_cache and pending:
+            # These embeddings are cached, so the retrieval below does not embed the queries again
+            query_embeddings = self.embedding_model.embed_queries([query for query, _ in pending])
+            for request, query_embedding in zip(pending, query_embeddings):
+                hit = self.semantic_cache.get(query_embedding, scopes[request])
+                if hit is not None:
+                    value, similarity = hit
+                    print(f"Semantic cache hit (similarity {similarity:.3f})")
+                    self.answer_cache.put(cache_keys[request], list(value), fingerprint)
+                    resolve(request, tuple(value))
+            pending = [request for request in pending if results[positions[request][0]] is None]
+        if not pending:
+            return results
+
+        contexts = self.retrieve_context_many([query for query, _ in pending])
+
+        def generate(request, retrieved):
+            query, specialized_instructions = request
+            context, summary, sources = retrieved
+            prompt = build_rag_prompt(query, specialized_instructions, summary, context)
+            return self.generate_response(prompt), sources
+
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(pending)))) as executor:
+            futures = {executor.submit(generate, request, retrieved): request for request, retrieved in zip(pending, contexts)}
+            for future in as_completed(futures):
+                request = futures[future]
+                answer, sources = future.result()
+                if use_cache:
+                    self.answer_cache.put(cache_keys[request], [answer, sources], fingerprint)
+                if use_semantic_cache:
+                    query_embedding = self.embedding_model.embed_queries([request[0]])[0]
+                    self.semantic_cache.put(query_embedding, scopes[request], (answer, sources))
+                resolve(request, (answer, sources))
+        return results
+
+    def generate_answer(self, query, specialized_instructions=""):
+        """Retrieve context for the query and generate an answer with Gemini, without caching."""
+        context, summary, sources = self.retrieve_context(query)
+        prompt = build_rag_prompt(query, specialized_instructions, summary, context)
+        return self.generate_response(prompt), sources
+
 
 def simple_summary(text):
     return text[:200] + "..." if len(text) > 200 else text
 
-def rerank_results(results):
-    return sorted(results, key=lambda x: len(x.page_content), reverse=True)
-
-# Retrieval Function: Get Context from ChromaDB
-def retrieve_context(query, k=8):
-    """
-    Retrieves the top k relevant chunks from the vector store for the query.
-    Returns the prompt context, a simple summary, and the source metadata.
-    """
-    results = vector_store.similarity_search(query, k=k)
-    results = rerank_results(results)
+def format_context(results):
+    """Turn ranked Documents into the prompt context, a simple summary and the source metadata."""
     context = "\n\n".join([res.page_content for res in results])
-    
+
     # Generate a simple summary from the context
     summary = simple_summary(context)
-    
+
     # Extract metadata from results for display
     sources = []
     for res in results:
@@ -39,19 +382,11 @@ def retrieve_context(query, k=8):
             'content': res.page_content[:100] + "...",  # Show first 100 chars
             'metadata': res.metadata
         })
-    
-    return context, summary, sources
 
+    return context, summary, sources
 
-def retrieve_and_generate(query, specialized_instructions=""):
-    """
-    Combines retrieval and generation:
-      1. Retrieves context from the vector store.
-      2. Builds a prompt that includes any specialized instructions and a summary.
-      3. Generates and returns an answer using Gemini Flash 2.0.
-    """
-    context, summary, sources = retrieve_context(query)
-    prompt = f"""You are a specialized strength training expert.
+def build_rag_prompt(query, specialized_instructions, summary, context):
+    return f"""You are a specialized strength training expert.
 {specialized_instructions}
 
 Using the following excerpts from strength training books, programs.
@@ -67,4 +402,30 @@ Context:
 Query: {query}
 
 Answer:"""
-    return generate_response(prompt), sources
+
+
+# Shared service used by the agents; nothing connects until the first retrieval
+retrieval_service = RetrievalService()
+
+def warm_up(probe=False):
+    """Connect the shared retrieval backend now instead of on the first request."""
+    return retrieval_service.warm(probe=probe)
+
+def cache_stats():
+    return retrieval_service.cache_stats()
+
+# Retrieval Function: Get Context from ChromaDB
+def retrieve_context(query, k=8):
+    return retrieval_service.retrieve_context(query, k=k)
+
+def retrieve_context_many(queries, k=8):
+    return retrieval_service.retrieve_context_many(queries, k=k)
+
+def retrieve_and_generate(query, specialized_instructions="", use_cache=True):
+    return retrieval_service.retrieve_and_generate(query, specialized_instructions, use_cache=use_cache)
+
+def retrieve_and_generate_many(requests, use_cache=True, on_result=None):
+    return retrieval_service.retrieve_and_generate_many(requests, use_cache=use_cache, on_result=on_result)
+
+def generate_answer(query, specialized_instructions=""):
+    return retrieval_service.generate_answer(query, specialized_instructions)
@@ -0,0 +1,46 @@
+import os
+
+# Every test runs offline: setup_llm and setup_embeddings use the synthetic backend (agent_system/llm_backend.py)
+os.environ["LLM_BACKEND"] = "synthetic"
+os.environ["LLM_SYNTHETIC_LATENCY"] = "constant:0"
+os.environ["EMBEDDING_SYNTHETIC_LATENCY"] = "constant:0"
+os.environ["LLM_CACHE_MODE"] = "bypass"
+
+import pytest
+
+import agent_system  # noqa: F401  (imported before the rag_* modules, which import it back)
+
+
+def write_pdf(path, pages):
+    """Write a minimal text PDF with one page per string in pages."""
+    objects = ["<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    page_ids = []
+    for text in pages:
+        lines = " ".join(f"({line}) '" for line in text.replace("(", "").replace(")", "").split("\n"))
+        stream = f"BT /F1 10 Tf 50 750 Td 12 TL {lines} ET"
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+        objects.append(None)
+        page_ids.append(len(objects))
+    objects.append(None)
+    pages_id = len(objects)
+    for page_id in page_ids:
+        objects[page_id - 1] = (f"<< /Type /Page /Parent {pages_id} 0 R /MediaBox [0 0 612 792] "
+                                f"/Contents {page_id - 1} 0 R /Resources << /Font << /F1 1 0 R >> >> >>")
+    objects[pages_id - 1] = f"<< /Type /Pages /Kids [{' '.join(f'{i} 0 R' for i in page_ids)}] /Count {len(page_ids)} >>"
+    objects.append(f"<< /Type /Catalog /Pages {pages_id} 0 R >>")
+    out = b"%PDF-1.4\n"
+    offsets = []
+    for i, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f"{i} 0 obj\n{body}\nendobj\n".encode("latin-1")
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("latin-1")
+    out += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode("latin-1")
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root {len(objects)} 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode("latin-1")
+    with open(path, "wb") as f:
+        f.write(out)
+
+
+@pytest.fixture
+def pdf_writer():
+    return write_pdf
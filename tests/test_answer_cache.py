@@ -0,0 +1,67 @@
+import time
+
+from index_versions import IndexVersions
+from rag_cache import AnswerCache, collection_fingerprint, write_index_version
+
+COLLECTION = "strength_training_books"
+
+
+def promote_new_version(root):
+    versions = IndexVersions(str(root))
+    directory, version = versions.stage(copy_current=False)
+    write_index_version(directory, version)
+    versions.promote(version)
+    return version
+
+
+def test_hit_and_miss(tmp_path):
+    cache = AnswerCache(str(tmp_path / "answers.sqlite3"))
+    key = cache.make_key("rep ranges", "", "model", "v1")
+    assert cache.get(key, "v1") is None
+    cache.put(key, ["answer", ["source.pdf"]], "v1")
+    assert cache.get(key, "v1") == ["answer", ["source.pdf"]]
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+
+def test_key_covers_instructions_and_model():
+    keys = {
+        AnswerCache.make_key("q", "", "model", "v1"),
+        AnswerCache.make_key("q", "cite sources", "model", "v1"),
+        AnswerCache.make_key("q", "", "other-model", "v1"),
+        AnswerCache.make_key("q", "", "model", "v2"),
+    }
+    assert len(keys) == 4
+
+
+def test_promoting_an_index_version_invalidates_answers(tmp_path):
+    root = tmp_path / "chroma_db"
+    promote_new_version(root)
+    old_fingerprint = collection_fingerprint(str(root), COLLECTION)
+    cache = AnswerCache(str(tmp_path / "answers.sqlite3"))
+    key = cache.make_key("rep ranges", "", "model", old_fingerprint)
+    cache.put(key, ["old answer", []], old_fingerprint)
+
+    promote_new_version(root)
+    new_fingerprint = collection_fingerprint(str(root), COLLECTION)
+    assert new_fingerprint != old_fingerprint
+    assert cache.get(cache.make_key("rep ranges", "", "model", new_fingerprint), new_fingerprint) is None
+    # Entries of the previous version are dropped, not just unreachable
+    assert cache.get(key, old_fingerprint) is None
+
+
+def test_fingerprint_is_stable_without_a_new_version(tmp_path):
+    root = tmp_path / "chroma_db"
+    version = promote_new_version(root)
+    fingerprint = collection_fingerprint(str(root), COLLECTION)
+    assert collection_fingerprint(str(root), COLLECTION) == fingerprint
+    # The version directory itself fingerprints the same as the root pointing to it
+    assert collection_fingerprint(IndexVersions(str(root)).version_path(version), COLLECTION) == fingerprint
+
+
+def test_expired_entries_miss(tmp_path):
+    cache = AnswerCache(str(tmp_path / "answers.sqlite3"), ttl_seconds=0.05)
+    key = cache.make_key("q", "", "model", "v1")
+    cache.put(key, ["answer", []], "v1")
+    assert cache.get(key, "v1") is not None
+    time.sleep(0.1)
+    assert cache.get(key, "v1") is None
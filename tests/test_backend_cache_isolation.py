@@ -0,0 +1,47 @@
+from langchain_community.vectorstores import Chroma
+
+from agent_system import setup_api
+from agent_system.llm_backend import TextResponse
+from embedding_stage import FakeEmbeddings
+from rag_cache import DEFAULT_EMBEDDING_CACHE_PATH, AnswerCache, CachedEmbeddings
+from rag_retrieval import COLLECTION_NAME, EMBEDDING_MODEL, RetrievalService
+
+PROMPT = "Beginner, 3 days per week"
+
+
+class LiveModel:
+    """Stands in for Gemini when LLM_BACKEND is switched to gemini."""
+
+    def generate_content(self, prompt, **kwargs):
+        return TextResponse('{"weekly_program": {"Day 1": [{"name": "Live"}]}}', prompt)
+
+
+def test_synthetic_responses_are_never_served_to_gemini(tmp_path, monkeypatch):
+    monkeypatch.setenv("LLM_CACHE_PATH", str(tmp_path / "responses.sqlite3"))
+    synthetic = setup_api.setup_llm("models/test", respond_as_json=True, cache_mode="read-write")(PROMPT)
+
+    monkeypatch.setenv("LLM_BACKEND", "gemini")
+    monkeypatch.setattr(setup_api, "get_model", lambda *args: LiveModel())
+    live = setup_api.setup_llm("models/test", respond_as_json=True, cache_mode="read-write")(PROMPT)
+    assert live != synthetic
+    assert live["weekly_program"]["Day 1"][0]["name"] == "Live"
+
+
+def test_synthetic_query_embeddings_and_answers_are_never_served_to_gemini(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    Chroma.from_texts(["Squats build leg strength."], FakeEmbeddings(),
+                      persist_directory=str(tmp_path / "chroma_db"), collection_name=COLLECTION_NAME)
+    service = RetrievalService(persist_directory=str(tmp_path / "chroma_db"), index_check_interval=None)
+    service.answer_cache = AnswerCache(str(tmp_path / "answers.sqlite3"))
+    service.retrieve_and_generate("How often should I squat?")
+    fingerprint = service.index_fingerprint()
+    synthetic_key = service.answer_cache_key("How often should I squat?", "", fingerprint)
+    assert service.answer_cache.get(synthetic_key, fingerprint) is not None
+
+    monkeypatch.setenv("LLM_BACKEND", "gemini")
+    live_embeddings = CachedEmbeddings(FakeEmbeddings(dimension=8), model_name=EMBEDDING_MODEL,
+                                       persist_path=DEFAULT_EMBEDDING_CACHE_PATH)
+    assert live_embeddings.lookup("How often should I squat?") is None
+    live_key = service.answer_cache_key("How often should I squat?", "", fingerprint)
+    assert live_key != synthetic_key
+    assert service.answer_cache.get(live_key, fingerprint) is None
@@ -0,0 +1,130 @@
+import threading
+import time
+
+import pytest
+from google.api_core import exceptions as google_exceptions
+
+from agent_system.call_governor import CallDeadlineExceeded, CallGovernor, TokenBucket
+
+MODEL = "models/test"
+
+
+def governor(**kwargs):
+    kwargs.setdefault("model_limits", {MODEL: (600, 10_000)})
+    return CallGovernor(base_delay=0.01, max_delay=0.02, log_wait_seconds=60, **kwargs)
+
+
+def test_token_bucket_reserve_and_refund():
+    bucket = TokenBucket(600)
+    assert bucket.reserve(600) == 0.0
+    assert bucket.reserve(60) == pytest.approx(6.0, abs=0.05)  # in debt: 60 tokens at 10 per second
+    bucket.refund(60)
+    assert bucket.reserve(0) == pytest.approx(0.0, abs=0.05)
+
+
+def test_usage_corrects_the_token_reservation():
+    calls = governor()
+    tpm = calls._model_state(MODEL)[1]
+    calls.call(MODEL, lambda timeout: "ok", estimated_tokens=1000, usage=lambda result: 100)
+    assert tpm.level == pytest.approx(10_000 - 100, abs=5)
+    stats = calls.stats()["models"][MODEL]
+    assert stats["tokens_reserved"] == 1000 and stats["tokens_used"] == 100
+
+
+def test_retries_release_their_slot():
+    calls = governor(max_concurrency=1)
+    attempts = []
+
+    def flaky(timeout):
+        attempts.append(calls.stats()["in_flight"])
+        if len(attempts) < 3:
+            raise google_exceptions.ServiceUnavailable("overloaded")
+        return "ok"
+
+    assert calls.call(MODEL, flaky) == "ok"
+    assert attempts == [1, 1, 1]
+    stats = calls.stats()
+    assert stats["in_flight"] == 0 and stats["models"][MODEL]["retries"] == 2
+
+
+def test_non_retryable_error_is_raised_and_releases_the_slot():
+    calls = governor(max_concurrency=1)
+
+    def broken(timeout):
+        raise ValueError("bad request")
+
+    with pytest.raises(ValueError):
+        calls.call(MODEL, broken)
+    assert calls.stats()["in_flight"] == 0
+    assert calls.call(MODEL, lambda timeout: "ok") == "ok"
+
+
+def test_slot_timeout_refunds_the_rate_budget():
+    calls = governor(max_concurrency=1)
+    rpm, tpm, _ = calls._model_state(MODEL)
+    release = threading.Event()
+    holder = threading.Thread(target=calls.call, args=(MODEL, lambda timeout: release.wait(5)))
+    holder.start()
+    while calls.stats()["in_flight"] == 0:
+        time.sleep(0.01)
+    rpm_level, tpm_level = rpm.level, tpm.level
+    with pytest.raises(CallDeadlineExceeded):
+        calls.call(MODEL, lambda timeout: "never", estimated_tokens=5000, deadline_seconds=0.1)
+    release.set()
+    holder.join()
+    # Only the refill since then, not the 5000 reserved tokens
+    assert tpm.level >= tpm_level - 1
+    assert rpm.level >= rpm_level - 0.01
+    stats = calls.stats()["models"][MODEL]
+    assert stats["deadline_exceeded"] == 1 and stats["tokens_reserved"] == 0
+
+
+def test_rate_limit_past_the_deadline_fails_fast():
+    calls = governor(model_limits={MODEL: (1, None)})
+    calls.call(MODEL, lambda timeout: "ok")
+    start = time.monotonic()
+    with pytest.raises(CallDeadlineExceeded):
+        calls.call(MODEL, lambda timeout: "ok", deadline_seconds=1)
+    assert time.monotonic() - start < 0.5
+
+
+def test_concurrency_is_bounded():
+    calls = governor(max_concurrency=2)
+    peak = []
+    lock = threading.Lock()
+
+    def request(timeout):
+        with lock:
+            peak.append(calls.stats()["in_flight"])
+        time.sleep(0.02)
+        return "ok"
+
+    threads = [threading.Thread(target=calls.call, args=(MODEL, request)) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert max(peak) <= 2
+    assert calls.stats()["in_flight"] == 0 and calls.stats()["queued"] == 0
+
+
+def test_closing_a_stream_early_releases_its_slot():
+    calls = governor(max_concurrency=1)
+    stream = calls.stream(MODEL, lambda timeout: iter(["a", "b", "c"]))
+    assert next(stream) == "a"
+    assert calls.stats()["in_flight"] == 1
+    stream.close()
+    assert calls.stats()["in_flight"] == 0
+    assert list(calls.stream(MODEL, lambda timeout: iter(["a", "b"]))) == ["a", "b"]
+    assert calls.stats()["in_flight"] == 0
+
+
+def test_stopping_a_program_stream_early_releases_the_shared_slot():
+    from agent_system.call_governor import call_governor
+    from agent_system.setup_api import setup_llm
+
+    writer = setup_llm("models/test-writer", respond_as_json=True)
+    days = iter(writer.stream_program("Beginner, 4 days per week"))
+    assert next(days)[0] == "Day 1"
+    days.close()
+    assert call_governor.stats()["in_flight"] == 0
@@ -0,0 +1,57 @@
+import pytest
+from google.api_core import exceptions as google_exceptions
+
+from embedding_stage import EmbeddingStage, FakeEmbeddings
+
+
+class FlakyEmbeddings(FakeEmbeddings):
+    """Raises the given errors, one per request, before embedding normally."""
+
+    def __init__(self, errors):
+        super().__init__(dimension=8)
+        self.errors = list(errors)
+
+    def embed_documents(self, texts, **kwargs):
+        if self.errors:
+            with self._lock:
+                self.requests += 1
+            raise self.errors.pop(0)
+        return super().embed_documents(texts, **kwargs)
+
+
+class WrappedError(Exception):
+    pass
+
+
+def wrapped(error):
+    # Like langchain_google_genai, which raises its own error from the API error
+    try:
+        raise WrappedError("Error embedding content") from error
+    except WrappedError as wrapper:
+        return wrapper
+
+
+@pytest.mark.parametrize("error", [
+    google_exceptions.ResourceExhausted("quota"),
+    google_exceptions.ServiceUnavailable("overloaded"),
+    TimeoutError("timed out"),
+    wrapped(google_exceptions.TooManyRequests("rate limit")),
+])
+def test_transient_errors_are_retried(error):
+    model = FlakyEmbeddings([error])
+    stage = EmbeddingStage(model, retry_delay=0)
+    assert len(stage.embed_batch(["squat"])) == 1
+    assert stage.stats["retries"] == 1
+
+
+@pytest.mark.parametrize("error", [
+    google_exceptions.InvalidArgument("bad request"),
+    ValueError("bug"),
+    wrapped(google_exceptions.PermissionDenied("bad key")),
+])
+def test_other_errors_are_raised_at_once(error):
+    model = FlakyEmbeddings([error])
+    stage = EmbeddingStage(model, retry_delay=0)
+    with pytest.raises(type(error)):
+        stage.embed_batch(["squat"])
+    assert model.requests == 1 and stage.stats["retries"] == 0
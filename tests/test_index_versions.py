@@ -0,0 +1,91 @@
+import os
+
+from index_versions import BUILD_STATE_FILE, IndexVersions, current_index_directory
+
+
+def build(versions, copy_current=True, content="index"):
+    directory, version = versions.stage(copy_current=copy_current)
+    with open(os.path.join(directory, "data.txt"), "w", encoding="utf-8") as f:
+        f.write(content)
+    return directory, version
+
+
+def read(directory):
+    with open(os.path.join(directory, "data.txt"), encoding="utf-8") as f:
+        return f.read()
+
+
+def test_unversioned_root_is_served_from_itself(tmp_path):
+    versions = IndexVersions(str(tmp_path))
+    assert versions.current() == (str(tmp_path), None)
+    assert current_index_directory(str(tmp_path)) == str(tmp_path)
+
+
+def test_staged_build_is_invisible_until_promoted(tmp_path):
+    versions = IndexVersions(str(tmp_path))
+    _, first = build(versions, content="v1")
+    versions.promote(first)
+    directory, second = build(versions, content="v2")
+    assert read(current_index_directory(str(tmp_path))) == "v1"
+    versions.promote(second)
+    assert current_index_directory(str(tmp_path)) == directory
+    assert read(directory) == "v2"
+    assert not os.path.exists(os.path.join(directory, BUILD_STATE_FILE))
+
+
+def test_pointer_records_the_previous_version_for_rollback(tmp_path):
+    versions = IndexVersions(str(tmp_path))
+    _, first = build(versions, content="v1")
+    versions.promote(first)
+    _, second = build(versions, content="v2")
+    versions.promote(second)
+    assert versions.pointer()["previous"] == first
+    # Rolling back is promoting the previous version again
+    versions.promote(versions.pointer()["previous"])
+    assert versions.current()[1] == first
+    assert read(current_index_directory(str(tmp_path))) == "v1"
+
+
+def test_stage_copies_the_live_version(tmp_path):
+    versions = IndexVersions(str(tmp_path))
+    _, first = build(versions, content="v1")
+    versions.promote(first)
+    directory, _ = versions.stage()
+    assert read(directory) == "v1"
+    empty, _ = versions.stage(copy_current=False)
+    assert not os.path.exists(os.path.join(empty, "data.txt"))
+
+
+def test_unfinished_build_is_resumed(tmp_path):
+    versions = IndexVersions(str(tmp_path))
+    _, first = build(versions)
+    versions.promote(first)
+    directory, version = versions.stage()
+    assert versions.stage() == (directory, version)
+    # Not once the live version has moved on
+    _, other = build(IndexVersions(str(tmp_path)), copy_current=False)
+    versions.promote(other)
+    assert versions.stage()[1] not in (version, other)
+
+
+def test_prune_keeps_the_newest_and_the_live_version(tmp_path):
+    versions = IndexVersions(str(tmp_path))
+    promoted = []
+    for i in range(4):
+        _, version = build(versions, copy_current=False, content=str(i))
+        versions.promote(version)
+        promoted.append(version)
+    # Roll back to the oldest version: it stays even though it is not among the newest
+    versions.promote(promoted[0])
+    versions.prune(keep=2)
+    assert versions.versions() == [promoted[0], promoted[2], promoted[3]]
+    assert read(current_index_directory(str(tmp_path))) == "0"
+
+
+def test_prune_leaves_unfinished_builds_alone(tmp_path):
+    versions = IndexVersions(str(tmp_path))
+    _, first = build(versions)
+    versions.promote(first)
+    _, unfinished = versions.stage()
+    versions.prune(keep=1)
+    assert unfinished in versions.versions()
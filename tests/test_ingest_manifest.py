@@ -0,0 +1,126 @@
+import os
+import sys
+
+import pytest
+
+import build_db
+from build_profile import BuildProfiler
+from index_versions import IndexVersions
+from ingestion import IngestManifest, with_chunk_ids
+
+
+def page(topic, lines=30):
+    return "\n".join(f"{topic} line {i}: squat bench deadlift volume intensity rpe sets reps" for i in range(lines))
+
+
+def test_plan_splits_changed_unchanged_and_removed(tmp_path):
+    a, b = tmp_path / "a.pdf", tmp_path / "b.pdf"
+    a.write_bytes(b"book a")
+    b.write_bytes(b"book b")
+    manifest = IngestManifest()
+    manifest.record(str(a), ["a1"])
+    manifest.record(str(b), ["b1"])
+    manifest.documents["gone.pdf"] = {"sha256": "x", "chunk_ids": ["g1"]}
+
+    b.write_bytes(b"book b, second edition")
+    c = tmp_path / "c.pdf"
+    c.write_bytes(b"book c")
+    changed, unchanged, removed = manifest.plan([str(a), str(b), str(c)])
+    assert changed == [str(b), str(c)]
+    assert unchanged == [str(a)]
+    assert removed == ["gone.pdf"]
+
+
+def test_touched_but_identical_file_is_unchanged(tmp_path):
+    a = tmp_path / "a.pdf"
+    a.write_bytes(b"book a")
+    manifest = IngestManifest()
+    manifest.record(str(a), ["a1"])
+    os.utime(a, ns=(1, 1))
+    assert manifest.plan([str(a)])[1] == [str(a)]
+
+
+def test_chunk_ids_are_stable_and_number_repeats():
+    chunks = [{"text": text, "metadata": {"source": "a.pdf"}} for text in ("x", "y", "x")]
+    ids = [chunk["id"] for chunk in with_chunk_ids(chunks)]
+    assert ids == [chunk["id"] for chunk in with_chunk_ids(chunks)]
+    assert len(set(ids)) == 3
+
+
+@pytest.fixture
+def knowledge_base(tmp_path, monkeypatch, pdf_writer):
+    monkeypatch.chdir(tmp_path)
+    books = tmp_path / "Data" / "books"
+    books.mkdir(parents=True)
+    persist_directory = str(tmp_path / "chroma_db")
+
+    def build():
+        monkeypatch.setattr(sys, "argv", ["build_db.py", "--fake-embeddings", "--workers", "1"])
+        profiler = BuildProfiler()
+        outcome = build_db.build(build_db.parse_args(), persist_directory, profiler)
+        directory, version = IndexVersions(persist_directory).current()
+        return outcome, profiler.report()["stages"], IngestManifest.load(directory), directory, version
+
+    def write(name, pages):
+        pdf_writer(str(books / name), pages)
+
+    return build, write, books
+
+
+def stored_ids(directory):
+    collection = build_db.open_collection(directory)
+    ids = set(collection.get(include=[])["ids"])
+    build_db.close_collection(collection)
+    return ids
+
+
+def test_incremental_rebuild_embeds_only_changes_and_deletes_stale_chunks(knowledge_base):
+    build, write, books = knowledge_base
+    write("a.pdf", [page("alpha"), page("beta"), page("gamma")])
+    write("b.pdf", [page("delta"), page("epsilon")])
+    outcome, stages, manifest, directory, first_version = build()
+    assert outcome == "promoted"
+    all_ids = {i for entry in manifest.documents.values() for i in entry["chunk_ids"]}
+    assert stored_ids(directory) == all_ids
+    assert stages["embed"]["embeddings"] == len(all_ids)
+
+    outcome, stages, _, _, version = build()
+    assert outcome == "up to date" and version == first_version
+    assert "embed" not in stages
+
+    old_a_ids = set(manifest.documents["a.pdf"]["chunk_ids"])
+    write("a.pdf", [page("alpha"), page("beta"), page("gamma, revised")])
+    os.remove(books / "b.pdf")
+    outcome, stages, manifest, directory, version = build()
+    assert outcome == "promoted" and version != first_version
+    new_a_ids = set(manifest.documents["a.pdf"]["chunk_ids"])
+    # Only the chunks of the revised page are embedded again
+    assert 0 < stages["embed"]["embeddings"] == len(new_a_ids - old_a_ids) < len(new_a_ids)
+    assert set(manifest.documents) == {"a.pdf"}
+    assert stored_ids(directory) == new_a_ids
+
+
+def test_rewritten_file_with_the_same_text_is_extracted_once(knowledge_base):
+    build, write, books = knowledge_base
+    write("a.pdf", [page("alpha"), page("beta")])
+    _, _, manifest, _, first_version = build()
+
+    # New bytes and mtime, but the same text and therefore the same chunk ids
+    with open(books / "a.pdf", "ab") as f:
+        f.write(b"% trailing comment\n")
+    outcome, stages, refreshed, _, version = build()
+    assert outcome == "up to date" and version == first_version
+    assert stages["extract"]["pages"] == 2
+    assert refreshed.documents["a.pdf"]["chunk_ids"] == manifest.documents["a.pdf"]["chunk_ids"]
+    assert refreshed.documents["a.pdf"]["sha256"] != manifest.documents["a.pdf"]["sha256"]
+
+    outcome, stages, _, _, version = build()
+    assert outcome == "up to date" and version == first_version
+    assert "extract" not in stages
+
+
+def test_fake_embeddings_never_export_into_the_served_index(monkeypatch):
+    monkeypatch.setattr(sys, "argv", ["build_db.py", "--fake-embeddings", "--export-vector-index"])
+    assert build_db.parse_args().vector_index_dir == build_db.VECTOR_INDEX_DIRECTORY + "_fake"
+    monkeypatch.setattr(sys, "argv", ["build_db.py", "--export-vector-index"])
+    assert build_db.parse_args().vector_index_dir == build_db.VECTOR_INDEX_DIRECTORY
@@ -0,0 +1,133 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from langchain_community.vectorstores import Chroma
+
+from agent_system.prefetch import RetrievalPrefetcher
+from embedding_stage import FakeEmbeddings
+from rag_cache import AnswerCache
+from rag_retrieval import COLLECTION_NAME, RetrievalService
+
+
+def test_futures_resolve_as_their_answers_arrive():
+    release_last = threading.Event()
+
+    def batch_retrieval(requests, on_result=None):
+        results = []
+        for i, (query, _) in enumerate(requests):
+            if query == "last":
+                release_last.wait(5)
+            results.append((f"answer to {query}", []))
+            if on_result:
+                on_result(i, results[-1])
+        return results
+
+    prefetcher = RetrievalPrefetcher(lambda query, instructions="": (f"live {query}", []), batch_retrieval)
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        prefetcher.prefetch([("first", ""), ("last", "")], executor)
+        # The first answer is served while the batch is still running
+        assert prefetcher("first") == ("answer to first", [])
+        release_last.set()
+        assert prefetcher("last") == ("answer to last", [])
+    assert prefetcher("not prefetched") == ("live not prefetched", [])
+
+
+def test_batch_failure_reaches_every_waiting_request():
+    def batch_retrieval(requests, on_result=None):
+        raise RuntimeError("quota")
+
+    prefetcher = RetrievalPrefetcher(lambda query, instructions="": None, batch_retrieval)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        prefetcher.prefetch([("a", ""), ("b", "")], executor)
+        for query in ("a", "b"):
+            with pytest.raises(RuntimeError):
+                prefetcher(query)
+
+
+def test_reset_forgets_previous_runs():
+    calls = []
+
+    def retrieval(query, instructions=""):
+        calls.append(query)
+        return query, []
+
+    prefetcher = RetrievalPrefetcher(retrieval)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        prefetcher.prefetch([("a", "")], executor)
+        prefetcher("a")
+    prefetcher.reset()
+    prefetcher("a")
+    assert calls == ["a", "a"]
+
+
+@pytest.fixture
+def service(tmp_path, monkeypatch):
+    # The service keeps its query embedding cache under data/ of the working directory
+    monkeypatch.chdir(tmp_path)
+    Chroma.from_texts(
+        ["Squats build leg strength.", "Rest two to three minutes between heavy sets.", "Progress the load weekly."],
+        FakeEmbeddings(),
+        persist_directory=str(tmp_path / "chroma_db"),
+        collection_name=COLLECTION_NAME,
+    )
+    service = RetrievalService(persist_directory=str(tmp_path / "chroma_db"), index_check_interval=None)
+    service.answer_cache = AnswerCache(str(tmp_path / "answers.sqlite3"))
+    service.warm()
+    prompts = []
+    generate = service._generate_response
+
+    def counting_generate(prompt):
+        prompts.append(prompt)
+        time.sleep(0.01)
+        return generate(prompt)
+
+    service._generate_response = counting_generate
+    service.prompts = prompts
+    return service
+
+
+def test_repeated_requests_are_generated_once(service):
+    requests = [("squat volume", ""), ("rest periods", ""), ("squat volume", ""), ("squat volume", "cite")]
+    resolved = []
+    results = service.retrieve_and_generate_many(requests, on_result=lambda i, result: resolved.append(i))
+    assert len(service.prompts) == 3
+    assert results[0] == results[2]
+    assert sorted(resolved) == [0, 1, 2, 3]
+    # All of them are now cached
+    service.retrieve_and_generate_many(requests)
+    assert len(service.prompts) == 3
+
+
+def test_writer_request_is_not_batched_with_the_critic():
+    from agent_system import Critic, Editor, ProgramGenerator, Writer
+    from prompts import CRITIC_PROMPT_SETTINGS, WRITER_PROMPT_SETTINGS
+
+    batches = []
+
+    def retrieval(query, instructions=""):
+        return "answer", []
+
+    def batch_retrieval(requests, on_result=None):
+        batches.append(list(requests))
+        return [("answer", []) for _ in requests]
+
+    writer_settings = WRITER_PROMPT_SETTINGS["initial"]
+    writer = Writer(
+        model=None,
+        role=writer_settings.role,
+        structure=writer_settings.structure,
+        task=writer_settings.task,
+        writer_type="initial",
+        retrieval_fn=retrieval,
+    )
+    critic = Critic(model=None, role=CRITIC_PROMPT_SETTINGS["week1"].role, retrieval_fn=retrieval)
+    generator = ProgramGenerator(writer=writer, critic=critic, editor=Editor(), batch_retrieval_fn=batch_retrieval)
+    program = {"user-input": "Beginner, hypertrophy, 3 days per week", "draft": None, "feedback": None,
+               "formatted": None, "iteration_count": 0}
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        generator.start_prefetch(program, executor)
+    writer_request = writer.get_retrieval_request(program)
+    assert batches and all(writer_request not in batch for batch in batches)
+    assert writer.retrieval_fn(*writer_request) == ("answer", [])
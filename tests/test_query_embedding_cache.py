@@ -0,0 +1,61 @@
+import numpy as np
+
+from embedding_stage import FakeEmbeddings
+from rag_cache import CachedEmbeddings
+
+
+def test_repeated_queries_are_embedded_once():
+    fake = FakeEmbeddings()
+    embeddings = CachedEmbeddings(fake, model_name="fake")
+    first = embeddings.embed_query("rep ranges for hypertrophy")
+    # Whitespace differences share an entry
+    assert embeddings.embed_query("rep  ranges for\nhypertrophy") == first
+    assert fake.requests == 1
+    assert embeddings.stats()["hits"] == 1
+
+
+def test_embed_queries_batches_the_misses():
+    fake = FakeEmbeddings()
+    embeddings = CachedEmbeddings(fake, model_name="fake")
+    embeddings.embed_query("a")
+    vectors = embeddings.embed_queries(["a", "b", "c", "b"])
+    assert fake.requests == 2  # "a" on its own, then one request for "b" and "c"
+    assert vectors[1] == vectors[3]
+    assert np.allclose(vectors[1], fake.embed_query("b"), atol=1e-6)
+    assert np.allclose(vectors[0], fake.embed_query("a"), atol=1e-6)
+
+
+def test_cached_vectors_are_kept_as_float32():
+    embeddings = CachedEmbeddings(FakeEmbeddings(), model_name="fake")
+    vector = embeddings.embed_query("deload")
+    assert isinstance(vector, list)
+    assert embeddings._memory[embeddings._key("deload")].dtype == np.float32
+
+
+def test_models_without_task_types_are_called_without_one():
+    class PlainEmbeddings(FakeEmbeddings):
+        def embed_documents(self, texts):
+            return super().embed_documents(texts)
+
+    fake = PlainEmbeddings()
+    vectors = CachedEmbeddings(fake, model_name="fake").embed_queries(["a", "b"])
+    assert len(vectors) == 2 and fake.requests == 1
+
+
+def test_persisted_embeddings_survive_a_restart(tmp_path):
+    path = str(tmp_path / "embeddings.sqlite3")
+    vector = CachedEmbeddings(FakeEmbeddings(), model_name="fake", persist_path=path).embed_query("deload")
+    fake = FakeEmbeddings()
+    restarted = CachedEmbeddings(fake, model_name="fake", persist_path=path)
+    # Stored as float32
+    assert np.allclose(restarted.embed_query("deload"), vector, atol=1e-6)
+    assert fake.requests == 0
+    assert restarted.stats()["persistent_hits"] == 1
+
+
+def test_models_do_not_share_entries(tmp_path):
+    path = str(tmp_path / "embeddings.sqlite3")
+    CachedEmbeddings(FakeEmbeddings(), model_name="model-a", persist_path=path).embed_query("deload")
+    fake = FakeEmbeddings()
+    CachedEmbeddings(fake, model_name="model-b", persist_path=path).embed_query("deload")
+    assert fake.requests == 1
@@ -0,0 +1,130 @@
+import random
+import time
+
+import pytest
+from langchain_community.vectorstores import Chroma
+
+from agent_system import setup_api
+from agent_system.response_cache import ResponseCache
+from embedding_stage import FakeEmbeddings
+from index_versions import IndexVersions
+from rag_cache import write_index_version
+from rag_retrieval import COLLECTION_NAME, RETIRED_STORE_GRACE_SECONDS, RetrievalService
+
+CONFIG = {"temperature": 0.3, "top_p": 0.9, "max_output_tokens": 1000}
+
+
+def test_get_put_round_trip(tmp_path):
+    cache = ResponseCache(str(tmp_path / "responses.sqlite3"))
+    key = cache.make_key("model", CONFIG, "prompt")
+    assert cache.get(key) is None
+    cache.put(key, "model", "```json\n{}\n```")
+    assert cache.get(key) == "```json\n{}\n```"
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+
+def test_key_covers_model_config_and_prompt():
+    keys = {
+        ResponseCache.make_key("model", CONFIG, "prompt"),
+        ResponseCache.make_key("other-model", CONFIG, "prompt"),
+        ResponseCache.make_key("model", dict(CONFIG, temperature=0.9), "prompt"),
+        ResponseCache.make_key("model", CONFIG, "other prompt"),
+    }
+    assert len(keys) == 4
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    # About 1.1 kB each once compressed, so two fit
+    cache = ResponseCache(str(tmp_path / "responses.sqlite3"), max_bytes=2500)
+    texts = {f"key-{i}": random.Random(i).randbytes(1000).hex() for i in range(4)}
+    for key, text in texts.items():
+        cache.put(key, "model", text)
+        cache.get("key-0")  # keep the first entry in use
+    assert cache.get("key-0") is not None
+    assert cache.get("key-1") is None
+    assert cache.stats()["evictions"] >= 1
+
+
+@pytest.fixture
+def counted_generation(monkeypatch):
+    """Counts the prompts that reach the (synthetic) model."""
+    prompts = []
+    original = setup_api.get_model
+
+    def get_model(model, generation_config, respond_as_json=False):
+        backend_model = original(model, generation_config, respond_as_json)
+
+        class Counted:
+            def generate_content(self, prompt, **kwargs):
+                prompts.append(prompt)
+                return backend_model.generate_content(prompt, **kwargs)
+
+        return Counted()
+
+    monkeypatch.setattr(setup_api, "get_model", get_model)
+    return prompts
+
+
+def test_cache_modes(tmp_path, monkeypatch, counted_generation):
+    monkeypatch.setenv("LLM_CACHE_PATH", str(tmp_path / "responses.sqlite3"))
+    prompt = "Beginner, 3 days per week"
+    writer = setup_api.setup_llm("models/test", respond_as_json=True, cache_mode="read-write")
+    program = writer(prompt)
+    assert writer(prompt) == program
+    assert len(counted_generation) == 1
+
+    setup_api.setup_llm("models/test", respond_as_json=True, cache_mode="bypass")(prompt)
+    assert len(counted_generation) == 2
+    read_only = setup_api.setup_llm("models/test", respond_as_json=True, cache_mode="read-only")
+    assert read_only(prompt) == program
+    read_only("Advanced, 5 days per week")
+    assert len(counted_generation) == 3
+    # read-only does not store the new response
+    read_only("Advanced, 5 days per week")
+    assert len(counted_generation) == 4
+
+
+def test_streamed_response_is_cached_once_complete(tmp_path, monkeypatch, counted_generation):
+    monkeypatch.setenv("LLM_CACHE_PATH", str(tmp_path / "responses.sqlite3"))
+    writer = setup_api.setup_llm("models/test", respond_as_json=True, cache_mode="read-write")
+    days = iter(writer.stream_program("Beginner, 4 days per week"))
+    next(days)
+    days.close()
+    # An abandoned stream is not cached
+    full = writer.stream_program("Beginner, 4 days per week").collect()
+    assert len(counted_generation) == 2
+    assert writer("Beginner, 4 days per week") == full
+    assert len(counted_generation) == 2
+
+
+def add_version(root, texts):
+    versions = IndexVersions(root)
+    directory, version = versions.stage(copy_current=False)
+    Chroma.from_texts(texts, FakeEmbeddings(), persist_directory=directory, collection_name=COLLECTION_NAME)
+    write_index_version(directory, version)
+    versions.promote(version)
+
+
+def test_new_index_version_does_not_reuse_cached_rag_responses(tmp_path, monkeypatch, counted_generation):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("LLM_CACHE_MODE", "read-write")
+    monkeypatch.setenv("LLM_CACHE_PATH", str(tmp_path / "responses.sqlite3"))
+    root = str(tmp_path / "chroma_db")
+    add_version(root, ["Squats build leg strength.", "Rest two minutes between sets."])
+    service = RetrievalService(persist_directory=root, index_check_interval=None)
+    service.generate_answer("How long should I rest?")
+    service.generate_answer("How long should I rest?")
+    assert len(counted_generation) == 1
+
+    add_version(root, ["Rest three to five minutes between heavy sets.", "Deadlifts train the posterior chain."])
+    assert service.refresh_index()
+    service.generate_answer("How long should I rest?")
+    # The prompt carries the new version's context, so it misses the response cache
+    assert len(counted_generation) == 2
+
+    # The replaced Chroma client is closed once its grace period is over
+    (_, previous_store), = service._retired_stores
+    service.close_retired_stores(now=time.monotonic())
+    assert len(service._retired_stores) == 1
+    service.close_retired_stores(now=time.monotonic() + RETIRED_STORE_GRACE_SECONDS)
+    assert not service._retired_stores and previous_store._client._closed
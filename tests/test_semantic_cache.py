@@ -0,0 +1,42 @@
+import numpy as np
+
+from rag_cache import SemanticAnswerCache
+from rag_retrieval import RetrievalService
+
+SCOPE = ("cite the literature", "pipeline", "index-v1")
+
+
+def test_off_by_default():
+    assert RetrievalService().semantic_cache is None
+    assert RetrievalService(semantic_cache_threshold=0.97).semantic_cache is not None
+
+
+def test_near_identical_query_in_the_same_scope_hits():
+    cache = SemanticAnswerCache(threshold=0.97)
+    embedding = np.ones(16)
+    cache.put(embedding, SCOPE, ("answer", []))
+    value, similarity = cache.get(embedding + 0.01, SCOPE)
+    assert value == ("answer", []) and similarity >= 0.97
+
+
+def test_scope_must_match_exactly():
+    cache = SemanticAnswerCache(threshold=0.97)
+    embedding = np.ones(16)
+    cache.put(embedding, SCOPE, ("answer", []))
+    assert cache.get(embedding, ("other instructions", "pipeline", "index-v1")) is None
+    assert cache.get(embedding, ("cite the literature", "pipeline", "index-v2")) is None
+
+
+def test_scope_is_checked_beyond_the_group_hash(monkeypatch):
+    # Even if two scopes collided on the 64-bit prefilter, the full scope decides
+    monkeypatch.setattr(SemanticAnswerCache, "group_id", staticmethod(lambda scope: 1))
+    cache = SemanticAnswerCache(threshold=0.97)
+    cache.put(np.ones(16), SCOPE, ("answer", []))
+    assert cache.get(np.ones(16), ("other", "pipeline", "index-v1")) is None
+    assert cache.get(np.ones(16), SCOPE) is not None
+
+
+def test_dissimilar_query_misses():
+    cache = SemanticAnswerCache(threshold=0.97)
+    cache.put(np.eye(16)[0], SCOPE, ("answer", []))
+    assert cache.get(np.eye(16)[1], SCOPE) is None
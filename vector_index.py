@@ -0,0 +1,189 @@
+import json
+import os
+import time
+
+import numpy as np
+
+MANIFEST_FILE = "manifest.json"
+EMBEDDINGS_FILE = "embeddings.npy"
+SCALES_FILE = "scales.npy"
+FULL_EMBEDDINGS_FILE = "full_embeddings.npy"
+DOCUMENTS_FILE = "documents.json"
+DTYPES = ("float32", "float16", "int8")
+
+
+def normalize(matrix):
+    matrix = np.asarray(matrix, dtype=np.float32)
+    return matrix / np.maximum(np.linalg.norm(matrix, axis=-1, keepdims=True), 1e-12)
+
+
+def quantize_int8(matrix):
+    """Symmetric per-row int8 quantisation: matrix ~ codes * scales[:, None]."""
+    scales = np.maximum(np.abs(matrix).max(axis=1), 1e-12) / 127.0
+    codes = np.clip(np.rint(matrix / scales[:, None]), -127, 127).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+class VectorIndex:
+    """
+    Exact nearest-neighbour index over L2-normalised embeddings.
+    The knowledge base is a few thousand chunks, so a single brute-force matrix
+    product answers top-k exactly, without Chroma's SQLite and HNSW overhead.
+    The embedding matrix is stored as a .npy file and memory-mapped on load;
+    texts and metadata are kept as parallel arrays.
+
+    For a compact index the stored vectors can be truncated to their first
+    `dimensions` components (text-embedding-004 front-loads information, so the
+    prefix is a usable embedding) and stored as float16 or per-row int8. Candidates
+    are then scored on the compact vectors; if the full float32 vectors are kept,
+    the best rescore_multiplier * k candidates are rescored at full precision.
+    """
+
+    def __init__(self, embeddings, texts, metadatas, manifest=None, scales=None, full_embeddings=None,
+                 rescore_multiplier=4, block_size=16384):
+        self.embeddings = embeddings
+        self.scales = scales
+        self.full_embeddings = full_embeddings
+        self.texts = list(texts)
+        self.metadatas = list(metadatas)
+        self.manifest = manifest or {}
+        self.rescore_multiplier = rescore_multiplier
+        self.block_size = block_size
+
+    @property
+    def dimensions(self):
+        return self.embeddings.shape[1]
+
+    @classmethod
+    def build(cls, embeddings, texts, metadatas, dtype="float32", collection_name=None, dimensions=None, keep_full=False):
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        if len(embeddings) != len(texts) or len(texts) != len(metadatas):
+            raise ValueError("embeddings, texts and metadatas must have the same length")
+        if embeddings.ndim != 2:
+            raise ValueError("embeddings must be a 2-D matrix")
+        if dtype not in DTYPES:
+            raise ValueError(f"Unknown dtype '{dtype}', expected one of {DTYPES}")
+        full = normalize(embeddings)
+        dimensions = min(dimensions or full.shape[1], full.shape[1])
+        compact = normalize(full[:, :dimensions])
+        scales = None
+        if dtype == "int8":
+            compact, scales = quantize_int8(compact)
+        else:
+            compact = compact.astype(dtype)
+        manifest = {
+            "count": len(texts),
+            "dimension": dimensions,
+            "full_dimension": int(full.shape[1]),
+            "dtype": dtype,
+            "rescore": bool(keep_full and (dtype != "float32" or dimensions < full.shape[1])),
+            "collection_name": collection_name,
+            "built_at": time.time(),
+        }
+        full_embeddings = full if manifest["rescore"] else None
+        return cls(compact, texts, [metadata or {} for metadata in metadatas], manifest, scales, full_embeddings)
+
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, EMBEDDINGS_FILE), self.embeddings)
+        for name, array in ((SCALES_FILE, self.scales), (FULL_EMBEDDINGS_FILE, self.full_embeddings)):
+            path = os.path.join(directory, name)
+            if array is not None:
+                np.save(path, array)
+            elif os.path.exists(path):
+                os.remove(path)
+        with open(os.path.join(directory, DOCUMENTS_FILE), "w", encoding="utf-8") as f:
+            json.dump({"texts": self.texts, "metadatas": self.metadatas}, f, ensure_ascii=False)
+        # Written last, so a directory with a manifest always holds a complete index
+        with open(os.path.join(directory, MANIFEST_FILE), "w", encoding="utf-8") as f:
+            json.dump(self.manifest, f, indent=2)
+
+    @classmethod
+    def load(cls, directory, mmap=True):
+        manifest_path = os.path.join(directory, MANIFEST_FILE)
+        if not os.path.exists(manifest_path):
+            raise FileNotFoundError(f"No vector index found in '{directory}'. Run build_db.py --export-vector-index first.")
+        with open(manifest_path, encoding="utf-8") as f:
+            manifest = json.load(f)
+        mmap_mode = "r" if mmap else None
+        embeddings = np.load(os.path.join(directory, EMBEDDINGS_FILE), mmap_mode=mmap_mode)
+        scales = np.load(os.path.join(directory, SCALES_FILE)) if manifest.get("dtype") == "int8" else None
+        full_embeddings = None
+        if manifest.get("rescore"):
+            # Only the rows of the rescored candidates are ever read
+            full_embeddings = np.load(os.path.join(directory, FULL_EMBEDDINGS_FILE), mmap_mode=mmap_mode)
+        with open(os.path.join(directory, DOCUMENTS_FILE), encoding="utf-8") as f:
+            documents = json.load(f)
+        return cls(embeddings, documents["texts"], documents["metadatas"], manifest, scales, full_embeddings)
+
+    def __len__(self):
+        return len(self.texts)
+
+    def nbytes(self):
+        """Bytes of the vectors scanned on every query (the compact matrix and its scales)."""
+        return self.embeddings.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def compact_scores(self, queries):
+        """Scores of the normalised full-width queries against the compact vectors."""
+        queries = normalize(queries[:, :self.dimensions])
+        if self.embeddings.dtype == np.float32:
+            return queries @ self.embeddings.T
+        # No fast float16/int8 matmul in NumPy: upcast a block of rows at a time to bound memory
+        scores = np.empty((len(queries), len(self)), dtype=np.float32)
+        for start in range(0, len(self), self.block_size):
+            block = np.asarray(self.embeddings[start:start + self.block_size], dtype=np.float32)
+            scores[:, start:start + len(block)] = queries @ block.T
+        if self.scales is not None:
+            scores *= self.scales
+        return scores
+
+    def vectors(self, indices):
+        """Best available float32 vectors of the given rows (full precision if it was kept)."""
+        if self.full_embeddings is not None:
+            return np.asarray(self.full_embeddings[indices], dtype=np.float32)
+        vectors = np.asarray(self.embeddings[indices], dtype=np.float32)
+        if self.scales is not None:
+            vectors = vectors * self.scales[indices][:, None]
+        return vectors
+
+    @staticmethod
+    def _top_k(scores, k):
+        if k < scores.shape[1]:
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        else:
+            top = np.tile(np.arange(scores.shape[1]), (len(scores), 1))
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1)
+        return np.take_along_axis(top, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+
+    def search(self, query_embeddings, k):
+        """
+        Batch top-k by cosine similarity.
+        Returns (indices, scores), both shaped (n_queries, k), best match first.
+        """
+        queries = normalize(np.atleast_2d(np.asarray(query_embeddings, dtype=np.float32)))
+        k = min(k, len(self))
+        if k == 0:
+            empty = np.empty((len(queries), 0))
+            return empty.astype(np.int64), empty.astype(np.float32)
+        scores = self.compact_scores(queries)
+        if self.full_embeddings is None:
+            return self._top_k(scores, k)
+        candidates, _ = self._top_k(scores, min(k * self.rescore_multiplier, len(self)))
+        rescored = np.einsum("qd,qcd->qc", queries, self.vectors(candidates))
+        top, top_scores = self._top_k(rescored, k)
+        return np.take_along_axis(candidates, top, axis=1), top_scores
+
+    def query(self, query_embeddings, n_results, include=("documents", "metadatas", "embeddings", "distances")):
+        """Same result layout as a Chroma collection query, so the two backends are interchangeable."""
+        indices, scores = self.search(query_embeddings, n_results)
+        results = {}
+        if "documents" in include:
+            results["documents"] = [[self.texts[i] for i in row] for row in indices]
+        if "metadatas" in include:
+            results["metadatas"] = [[self.metadatas[i] for i in row] for row in indices]
+        if "embeddings" in include:
+            results["embeddings"] = [self.vectors(row) for row in indices]
+        if "distances" in include:
+            results["distances"] = (1 - scores).tolist()
+        return results